@@ -0,0 +1,330 @@
+# Implements a compressed archive of the telemetry from the devices on disk
+
+import bisect
+import collections
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from array import array
+
+from .telemetry import FIELDS
+
+# chunk header: magic, number of samples, first time, last time, size of the compressed payload
+_HEADER = struct.Struct("<4sIddI")
+_MAGIC = b"VTA1"
+_TIME = "time"
+
+
+def _little_endian(data: array) -> array:
+    """The arrays are stored little endian in the files"""
+    if sys.byteorder == "big":
+        data = array(data.typecode, data)
+        data.byteswap()
+    return data
+
+
+def _encode_times(times: array) -> bytes:
+    """Times in milliseconds as the first time followed by the deltas"""
+    milliseconds = [round(timestamp * 1000) for timestamp in times]
+    deltas = array("q", [milliseconds[0]])
+    deltas.extend(current - previous for previous, current in zip(milliseconds, milliseconds[1:]))
+    return zlib.compress(_little_endian(deltas).tobytes())
+
+
+def _decode_times(payload: bytes) -> array:
+    deltas = _little_endian(array("q", zlib.decompress(payload)))
+    times = array("d")
+    total = 0
+    for delta in deltas:
+        total += delta
+        times.append(total / 1000)
+    return times
+
+
+def _encode_values(values: array) -> bytes:
+    """The bits of every double XORed with the bits of the previous one.
+    Values that do not change become zero bytes that compress to almost nothing"""
+    bits = array("Q", values.tobytes())
+    encoded = array("Q", bits[:1])
+    encoded.extend(current ^ previous for previous, current in zip(bits, bits[1:]))
+    return zlib.compress(_little_endian(encoded).tobytes())
+
+
+def _decode_values(payload: bytes) -> array:
+    encoded = _little_endian(array("Q", zlib.decompress(payload)))
+    bits = array("Q")
+    previous = 0
+    for value in encoded:
+        previous ^= value
+        bits.append(previous)
+    return array("d", bits.tobytes())
+
+
+class TelemetryArchive:
+    """Writes the telemetry of the devices to compressed column files.
+    Every device has a directory with a file per column, the sample times and
+    every field. The samples are buffered and written as a chunk to every
+    column file when chunk_size samples are buffered or on flush().
+    The times are delta encoded and the values XOR encoded before the chunk
+    is compressed with zlib. Every chunk header has the time range of the
+    chunk so the reader can skip the chunks outside a query.
+    The full chunks are compressed and written by a writer thread so a slow
+    disk does not stall the client. A chunk that can not be written is cut
+    off all the column files again and retried later. While the files can not
+    be written at most max_pending chunks are kept, the oldest are dropped.
+    Give the archive to the client and a sample is written every time a
+    status response is received from a device.
+    """
+
+    def __init__(self, directory: str, chunk_size: int = 4096, fields=tuple(FIELDS), max_pending: int = 64, retry_interval: float = 5.0):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.fields = tuple(fields)
+        self.max_pending = max_pending
+        self.retry_interval = retry_interval
+        self.dropped = 0        # samples dropped as the files could not be written
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._buffers = {}      # device id -> {column: array}
+        self._pending = collections.deque()     # (device id, {column: array}) of the chunks to write
+        self._wakeup = threading.Condition(self._lock)
+        self._running = True
+        os.makedirs(directory, exist_ok=True)
+        self._writer = threading.Thread(target=self.__writer_fn, daemon=True)
+        self._writer.start()
+
+    def record(self, device, timestamp: float = None):
+        """Add a sample with the current values of the device"""
+        values = {field: FIELDS[field](device) for field in self.fields}
+        self.append(device.device_id, time.time() if timestamp is None else timestamp, values)
+
+    def append(self, device_id: str, timestamp: float, values: dict):
+        """Add a sample. values is field -> value, None for a missing value.
+        The samples of a device must be added in time order"""
+        with self._lock:
+            buffer = self._buffers.get(device_id)
+            if buffer is None:
+                buffer = self._buffers[device_id] = {column: array("d") for column in (_TIME,) + self.fields}
+            buffer[_TIME].append(timestamp)
+            for field in self.fields:
+                value = values.get(field)
+                buffer[field].append(math.nan if value is None else value)
+            if len(buffer[_TIME]) >= self.chunk_size:
+                self.__queue_chunk(device_id, buffer)
+                self._wakeup.notify()
+
+    def flush(self):
+        """Write the buffered samples of all devices. Raises OSError if they
+        can not be written, they are kept and written later"""
+        with self._lock:
+            for device_id, buffer in self._buffers.items():
+                if buffer[_TIME]:
+                    self.__queue_chunk(device_id, buffer)
+        self.__write_pending()
+
+    def close(self):
+        """Write the buffered samples and end the writer thread"""
+        with self._lock:
+            self._running = False
+            self._wakeup.notify()
+        self._writer.join()
+        self.flush()
+
+    def __queue_chunk(self, device_id: str, buffer: dict):
+        """Move the samples in the buffer to the chunks to write. Must be called with the lock held"""
+        self._pending.append((device_id, dict(buffer)))
+        for column in buffer:
+            buffer[column] = array("d")
+        while len(self._pending) > self.max_pending:
+            self.dropped += len(self._pending.popleft()[1][_TIME])
+
+    def __writer_fn(self):
+        """Writer thread writing the chunks. Waits retry_interval after an error"""
+        while True:
+            with self._lock:
+                while self._running and not self._pending:
+                    self._wakeup.wait()
+                if not self._running:
+                    return
+            try:
+                self.__write_pending()
+            except OSError:
+                with self._lock:
+                    self._wakeup.wait(self.retry_interval)
+
+    def __write_pending(self):
+        """Write the pending chunks in order. A chunk that fails is put back first"""
+        with self._write_lock:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        return
+                    device_id, columns = self._pending.popleft()
+                try:
+                    self.__write_chunk(device_id, columns)
+                except OSError:
+                    with self._lock:
+                        self._pending.appendleft((device_id, columns))
+                    raise
+
+    def __write_chunk(self, device_id: str, columns: dict):
+        """Append the chunk to every column file of the device. If a file can
+        not be written all the files are cut back so the chunks stay aligned"""
+        times = columns[_TIME]
+        directory = os.path.join(self.directory, device_id)
+        os.makedirs(directory, exist_ok=True)
+        records = [
+            (os.path.join(directory, column + ".col"), _encode_times(data) if column == _TIME else _encode_values(data))
+            for column, data in columns.items()
+        ]
+        written = []        # (path, size before the chunk)
+        try:
+            for path, payload in records:
+                with open(path, "ab") as file:
+                    written.append((path, file.tell()))
+                    file.write(_HEADER.pack(_MAGIC, len(times), times[0], times[-1], len(payload)) + payload)
+        except OSError:
+            for path, size in written:
+                try:
+                    os.truncate(path, size)
+                except OSError:
+                    # the reader skips a chunk that is not in all the columns
+                    pass
+            raise
+
+
+class _ColumnFile:
+    """A memory mapped column file and the index of its chunks"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = -1
+        self.mmap = None
+        self.offsets = []       # offset of the payload of every chunk
+        self.lengths = []
+        self.first_times = []
+        self.last_times = []
+        self.counts = []
+        self.chunk_of = {}      # (first time, number of samples) -> chunk
+
+    def refresh(self):
+        """Map the file again and index the new chunks if the file has grown.
+        A file that has shrunk, e.g. cut back after a failed write, is indexed again"""
+        size = os.path.getsize(self.path)
+        if size == self.size:
+            return
+        if size < self.size:
+            self.offsets = []
+            self.lengths = []
+            self.first_times = []
+            self.last_times = []
+            self.counts = []
+            self.chunk_of = {}
+        if self.mmap is not None:
+            self.mmap.close()
+        with open(self.path, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.size = size
+        position = self.offsets[-1] + self.lengths[-1] if self.offsets else 0
+        while position + _HEADER.size <= size:
+            magic, count, first_time, last_time, length = _HEADER.unpack_from(self.mmap, position)
+            if magic != _MAGIC or position + _HEADER.size + length > size:
+                # a chunk that is being written
+                break
+            self.chunk_of[(first_time, count)] = len(self.offsets)
+            self.offsets.append(position + _HEADER.size)
+            self.lengths.append(length)
+            self.counts.append(count)
+            self.first_times.append(first_time)
+            self.last_times.append(last_time)
+            position += _HEADER.size + length
+
+    def chunks(self, start: float, end: float) -> range:
+        """Return the numbers of the chunks with samples from start up to end"""
+        first = 0 if start is None else bisect.bisect_left(self.last_times, start)
+        last = len(self.first_times) if end is None else bisect.bisect_left(self.first_times, end)
+        return range(first, max(first, last))
+
+    def payload(self, chunk: int) -> bytes:
+        offset = self.offsets[chunk]
+        return self.mmap[offset: offset + self.lengths[chunk]]
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+
+class TelemetryArchiveReader:
+    """Reads the column files written by TelemetryArchive.
+    The files are memory mapped and only the chunks in the time range of a
+    query are decompressed"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._files = {}        # (device id, column) -> _ColumnFile
+
+    def device_ids(self) -> list:
+        """Return the ids of the devices in the archive"""
+        return sorted(
+            name for name in os.listdir(self.directory)
+            if os.path.isfile(os.path.join(self.directory, name, _TIME + ".col"))
+        )
+
+    def query(self, device_id: str, field: str, start: float = None, end: float = None) -> tuple:
+        """Return the samples of a field with a time from start up to but not
+        including end as (times, values) arrays of doubles. NaN is a missing value"""
+        times = array("d")
+        values = array("d")
+        with self._lock:
+            time_file = self.__column(device_id, _TIME)
+            value_file = self.__column(device_id, field)
+            if time_file is None or value_file is None:
+                return times, values
+            for chunk in time_file.chunks(start, end):
+                # the chunks of the columns are matched by their time range so
+                # a chunk missing in one of the files can not shift the others
+                count = time_file.counts[chunk]
+                value_chunk = value_file.chunk_of.get((time_file.first_times[chunk], count))
+                if value_chunk is None:
+                    continue
+                try:
+                    chunk_times = _decode_times(time_file.payload(chunk))
+                    first = 0 if start is None else bisect.bisect_left(chunk_times, start)
+                    last = len(chunk_times) if end is None else bisect.bisect_left(chunk_times, end)
+                    if first >= last:
+                        continue
+                    chunk_values = _decode_values(value_file.payload(value_chunk))
+                except (zlib.error, ValueError):
+                    # a damaged chunk
+                    continue
+                if len(chunk_times) != count or len(chunk_values) != count:
+                    continue
+                times.extend(chunk_times[first:last])
+                values.extend(chunk_values[first:last])
+        return times, values
+
+    def close(self):
+        with self._lock:
+            for column_file in self._files.values():
+                column_file.close()
+            self._files.clear()
+
+    def __column(self, device_id: str, column: str) -> _ColumnFile:
+        """Return the refreshed column file. None if it does not exist.
+        Must be called with the lock held"""
+        column_file = self._files.get((device_id, column))
+        if column_file is None:
+            path = os.path.join(self.directory, device_id, column + ".col")
+            if not os.path.isfile(path):
+                return None
+            column_file = self._files[(device_id, column)] = _ColumnFile(path)
+        column_file.refresh()
+        return column_file if column_file.mmap is not None else None
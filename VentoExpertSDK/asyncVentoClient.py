@@ -0,0 +1,480 @@
+# Implements an asyncio client for making a UDP connection to the Blauberg Vento Expert devices
+
+import asyncio
+import socket
+import time
+
+from socket import SOL_SOCKET, SO_REUSEADDR, SO_BROADCAST, SO_RCVBUF
+
+from .clientbase import VentoClientBase
+from .command import Command, CommandGroup
+from .device import Device, Mode
+from .metrics import MetricsRegistry
+from .registry import DeviceRegistry
+from .archive import TelemetryArchive
+from .telemetry import TelemetryRecorder
+from .ventoClient import RECEIVE_BUFFER
+from .ventoPacket import VentoExpertPacket
+from .responsepacket import ResponsePacket
+from VentoExpertSDK import ventoProtocol as protocol
+
+
+class _VentoDatagramProtocol(asyncio.DatagramProtocol):
+    """asyncio protocol forwarding received datagrams to the AsyncVentoClient"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def datagram_received(self, data, addr):
+        self._client._datagram_received(data, addr)
+
+    def error_received(self, exc):
+        # UDP errors (e.g. ICMP port unreachable) are not fatal, the device
+        # will be polled again at the next interval
+        pass
+
+    def connection_lost(self, exc):
+        self._client._connection_lost()
+
+
+class AsyncVentoClient(VentoClientBase):
+    """asyncio client object for making connection to the Blauberg Vento Expert devices.
+    All devices are served by a single datagram transport on the running event loop,
+    so no thread is used per client.
+
+        async with AsyncVentoClient() as client:
+            device = await client.validate_device(device_id, ip_address=ip)
+            command = await client.set_speed(device, protocol.SPEED_LOW)
+            confirmed = await command
+            async for device in client.changes():
+                ...
+    """
+
+    def __init__(
+        self,
+        poll_interval: float = 1.0,
+        command_timeout: float = 2.0,
+        interfaces=None,
+        registry: DeviceRegistry = None,
+        telemetry: TelemetryRecorder = None,
+        archive: TelemetryArchive = None,
+        metrics: MetricsRegistry = None,
+        retries: int = 0,
+        retry_interval: float = 0.2,
+    ):
+        """interfaces is a list of CIDRs or NetworkInterface to search for devices
+        on, e.g. network.local_interfaces(). Default is the broadcast on the
+        default interface.
+        The devices in the registry are added at once and the registry is
+        updated with the devices of the client while it runs.
+        The telemetry recorder and the archive record a sample for every status response.
+        The packets, errors and latencies are counted in metrics. Default is a
+        new MetricsRegistry.
+        A command that is not confirmed is sent again up to retries times,
+        first after retry_interval and then with a doubled interval until
+        the command timeout. Default is no retransmissions"""
+        super().__init__(command_timeout, poll_interval, interfaces, registry, telemetry, archive, metrics, retries, retry_interval)
+        self._transport = None
+        self._poll_task = None
+        self._pollwakeup = asyncio.Event()
+        self._status_waiters = {}       # device id -> futures set by the first status with the mode
+        self._firmware_waiters = {}     # device id -> futures set when the firmware version is received
+        self._subscribers = set()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self, bind_address: str = "0.0.0.0", port: int = 4000):
+        """Open the socket and start polling the devices"""
+        if self._transport is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _VentoDatagramProtocol(self), sock=self.__open_socket(bind_address, port)
+        )
+        self._poll_task = loop.create_task(self.__poll_fn())
+
+    async def close(self):
+        """Stop polling, close the socket and end all change iterators"""
+        try:
+            if self._poll_task is not None:
+                self._poll_task.cancel()
+                try:
+                    await self._poll_task
+                except asyncio.CancelledError:
+                    pass
+                self._poll_task = None
+        finally:
+            if self._transport is not None:
+                self._transport.close()
+                self._transport = None
+            for queue in list(self._subscribers):
+                # a consumer that fell behind loses its oldest changes so the end is still delivered
+                while queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+            try:
+                if self._registry is not None:
+                    await self.__save_registry(True)
+            finally:
+                if self.archive is not None:
+                    self.archive.flush()
+
+    async def add_device(
+        self,
+        device_id: str,
+        password: str = None,
+        ip_address: str = "<broadcast>",
+        onchange=None,
+        poll_interval: float = None,
+    ) -> Device:
+        """Add a new device. If the device already exist the current one will
+        be returned.
+        The device status is polled every poll_interval seconds. Default is the
+        poll interval of the client"""
+        return self._add_device(device_id, password, ip_address, onchange, poll_interval)
+
+    async def search_devices(self, callback):
+        """Broadcast a search command. The callback is called with the device id
+        and the ip address of every device that responds"""
+        self._found_device_callback = callback
+        self.__send_search(self._search_addresses(None))
+
+    async def discover(self, timeout: float = 1.0, until_count: int = None, repeats: int = 3, interfaces=None) -> dict:
+        """Search the local network for devices for up to timeout seconds.
+        Returns early when until_count devices have answered.
+        Returns a dict of device id -> ip address"""
+        return {device_id: ip_address async for device_id, ip_address in self.discover_iter(timeout, until_count, repeats, interfaces)}
+
+    async def discover_iter(self, timeout: float = 1.0, until_count: int = None, repeats: int = 3, interfaces=None):
+        """Search the local network for devices for up to timeout seconds.
+        Yields (device id, ip address) for every device as soon as it answers.
+        The search is broadcast repeats times spread over the timeout as the
+        broadcast or the answers can be lost. Every device is yielded once.
+        The search is sent to the broadcast address of every interface in
+        interfaces, a list of CIDRs or NetworkInterface. Default is the
+        interfaces of the client. Use interface_of() to get the interface
+        a device answered on"""
+        addresses = self._search_addresses(interfaces)
+        found = asyncio.Queue()
+
+        def listener(device_id: str, ip_address: str):
+            found.put_nowait((device_id, ip_address))
+
+        seen = set()
+        self._add_search_listener(listener)
+        try:
+            start = time.monotonic()
+            deadline = start + timeout
+            repeats = max(1, repeats)
+            sent = 0
+            while until_count is None or len(seen) < until_count:
+                now = time.monotonic()
+                if now >= deadline:
+                    return
+                if sent < repeats and now >= start + sent * timeout / repeats:
+                    self.__send_search(addresses)
+                    sent += 1
+                    continue
+                wakeup = deadline if sent >= repeats else min(deadline, start + sent * timeout / repeats)
+                try:
+                    device_id, ip_address = await asyncio.wait_for(found.get(), max(0, wakeup - now))
+                except asyncio.TimeoutError:
+                    continue
+                if device_id not in seen:
+                    seen.add(device_id)
+                    yield device_id, ip_address
+        finally:
+            self._remove_search_listener(listener)
+
+    async def set_speed(self, device: Device, speed: int) -> Command:
+        """Set the speed of the specified device.
+        Returns the command, await it for the confirmed new speed"""
+        if device.speed == speed:
+            return Command.confirmed(device.device_id, {protocol.SPEED: speed}, "speed")
+        if speed == protocol.SPEED_OFF:
+            return await self.turn_off(device)
+        if device.speed is None or device.speed == protocol.SPEED_OFF:
+            await self.__wait_for_confirmation(await self.turn_on(device))
+
+        packet = VentoExpertPacket()
+        packet.initialize_speed_cmd(device, speed)
+        return self._send_command(device, packet.data, [protocol.SPEED], "speed")
+
+    async def set_manual_speed(self, device: Device, manualspeed: int) -> Command:
+        """Set the manual speed of the specified device.
+        Returns the command, await it for the confirmed new manual speed"""
+        if device.speed != protocol.SPEED_MANUAL:
+            await self.__wait_for_confirmation(await self.set_speed(device, protocol.SPEED_MANUAL))
+
+        packet = VentoExpertPacket()
+        packet.initialize_manualspeed_cmd(device, manualspeed)
+        return self._send_command(device, packet.data, [protocol.MANUAL_SPEED], "manualspeed")
+
+    async def turn_off(self, device: Device) -> Command:
+        """Turn off the specified device"""
+        if device.speed == protocol.SPEED_OFF:
+            return Command.confirmed(device.device_id, {protocol.ON_OFF: 0}, "off")
+        packet = VentoExpertPacket()
+        packet.initialize_off_cmd(device)
+        return self._send_command(device, packet.data, [protocol.ON_OFF], "off")
+
+    async def turn_on(self, device: Device) -> Command:
+        """Turn on the specified device"""
+        # the state of a device without a status yet is unknown, so the command is always sent
+        if device.speed is not None and device.speed != protocol.SPEED_OFF:
+            return Command.confirmed(device.device_id, {protocol.ON_OFF: 1}, "on")
+        packet = VentoExpertPacket()
+        packet.initialize_on_cmd(device)
+        return self._send_command(device, packet.data, [protocol.ON_OFF], "on")
+
+    async def set_mode(self, device: Device, mode: Mode) -> Command:
+        """Set the mode of the specified device"""
+        if device.mode == mode:
+            return Command.confirmed(device.device_id, {protocol.VENTILATION_MODE: mode}, "mode")
+        packet = VentoExpertPacket()
+        packet.initialize_mode_cmd(device, mode)
+        return self._send_command(device, packet.data, [protocol.VENTILATION_MODE], "mode")
+
+    async def apply(self, device: Device, on: bool = None, speed: int = None, manualspeed: int = None, mode: Mode = None,
+              reset_filter: bool = False) -> Command:
+        """Apply several settings in one packet, e.g. on at manual speed 150
+        in TWOWAY mode. A speed or manual speed also turns the device on.
+        The settings are written with WRITEREAD and the filter timer reset
+        with WRITE in the same packet.
+        Returns the command confirmed with the values written. Returns None if
+        only the filter timer is reset as the device does not answer that.
+        Raises ValueError for invalid settings before anything is sent"""
+        return self._apply(device, on, speed, manualspeed, mode, reset_filter)
+
+    async def read(self, device: Device, parameters) -> CommandGroup:
+        """Read any parameters from ventoProtocol. The parameters are packed
+        into as few packets as possible.
+        Returns the commands confirmed with the values read"""
+        return self._read(device, parameters)
+
+    async def write(self, device: Device, values: dict, function: int = protocol.WRITEREAD) -> CommandGroup:
+        """Write a dict of parameter -> value. The values are packed into as few
+        packets as possible.
+        Returns the commands confirmed with the values written. Returns None for
+        protocol.WRITE as the device does not answer that"""
+        return self._write(device, values, function)
+
+    async def reset_filter_alarm(self, device: Device):
+        """Reset the filter alarm"""
+        self._reset_filter_alarm(device)
+
+    async def validate_device(
+        self, device_id: str, password: str = None, ip_address: str = "<broadcast>", timeout: float = 4
+    ) -> Device:
+        """Validate if a device exist and repsonds.
+        Returns None if the device does not exist
+        Returns the Device object if it exist
+        """
+        device: Device = self.get_device(device_id)
+        # Is the device already added
+        if device is not None:
+            return device
+        device = await self.add_device(device_id, password, ip_address)
+        try:
+            self._send_status(device)
+            if await self.__wait_for(self._status_waiters, device_id, timeout):
+                return device
+            return None
+        finally:
+            self.remove_device(device_id)
+
+    async def validate_devices(self, candidates, timeout: float = 4, add: bool = False) -> dict:
+        """Validate many devices at once. candidates are (device id, password,
+        ip address) tuples. The status and firmware requests and a search are
+        sent to all of them and the answers are awaited until one deadline.
+        Returns a dict of device id -> "ok" if the device answered the status,
+        "wrong_password" if it only answered the search or "silent".
+        The devices that are ok stay added to the client if add is True.
+        Devices already added to the client are not removed"""
+        deadline = time.monotonic() + timeout
+        searched = set()
+
+        def listener(device_id: str, ip_address: str):
+            searched.add(device_id)
+
+        added = []
+        devices = {}
+        results = {}
+        self._add_search_listener(listener)
+        try:
+            for device_id, password, ip_address in candidates:
+                device = self.get_device(device_id)
+                if device is None:
+                    device = await self.add_device(device_id, password, ip_address or "<broadcast>")
+                    added.append(device_id)
+                devices[device_id] = device
+                self._send_status(device)
+            self.__send_search(list(dict.fromkeys(device.ip_address for device in devices.values())))
+            for device_id, device in devices.items():
+                # the status may have been received while waiting for an earlier device
+                answered = device.mode is not None or await self.__wait_for(self._status_waiters, device_id, max(0, deadline - time.monotonic()))
+                results[device_id] = self._validation_result(device_id, answered, searched)
+            return results
+        finally:
+            self._remove_search_listener(listener)
+            self._remove_validated(added, results, add)
+
+    async def wait_for_initialize(self, device: Device, timeout: float = 2) -> bool:
+        """Wait until the firmware version of the device is received. Returns False on timeout"""
+        if device.is_initialized():
+            return True
+        return await self.__wait_for(self._firmware_waiters, device.device_id, timeout)
+
+    async def __wait_for(self, waiters: dict, device_id: str, timeout: float) -> bool:
+        """Wait until update_device sets a future added to waiters. Returns False on timeout"""
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.setdefault(device_id, []).append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            pending = waiters.get(device_id, [])
+            if waiter in pending:
+                pending.remove(waiter)
+            if not pending:
+                waiters.pop(device_id, None)
+
+    async def changes(self, maxsize: int = 1000):
+        """Async iterator yielding a device every time one of its values change.
+        The iterator ends when the client is closed. If the consumer falls more
+        than maxsize changes behind the newest changes are dropped."""
+        queue = asyncio.Queue(maxsize)
+        self._subscribers.add(queue)
+        try:
+            while True:
+                device = await queue.get()
+                if device is None:
+                    return
+                yield device
+        finally:
+            self._subscribers.discard(queue)
+
+    def update_device(self, device: Device, ip_address: str, packet: ResponsePacket):
+        """Update the device with data recieved. Called by the AsyncVentoClient"""
+        haschange = self._update_device(device, ip_address, packet)
+        if device.mode is not None:
+            for waiter in self._status_waiters.pop(device.device_id, []):
+                if not waiter.done():
+                    waiter.set_result(device)
+        if device.firmware_version is not None:
+            for waiter in self._firmware_waiters.pop(device.device_id, []):
+                if not waiter.done():
+                    waiter.set_result(device)
+        if not haschange:
+            return
+        if device._changeevent is not None:
+            device._changeevent(device)
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(device)
+            except asyncio.QueueFull:
+                pass
+
+    def _datagram_received(self, data, addr):
+        """Handle a datagram received by the transport"""
+        self._handle_datagram(data, addr)
+
+    def _connection_lost(self):
+        """The transport was closed"""
+        self._transport = None
+
+    async def __poll_fn(self):
+        """Send the status commands when the devices are due and time out the
+        commands nobody awaits"""
+        while True:
+            deadline = self._scheduler.next_deadline()
+            for due in (self._commands.next_retry(), self._commands.next_deadline()):
+                if due is not None and (deadline is None or due < deadline):
+                    deadline = due
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                await asyncio.wait_for(self._pollwakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._pollwakeup.clear()
+            self._commands.expire()
+            self.__send_retries()
+            for device_id in self._scheduler.pop_due():
+                device: Device = self.get_device(device_id)
+                if device is not None and self._transport is not None:
+                    self._send_status(device)
+                    if not device.is_initialized():
+                        # e.g. a device restored from the registry without the firmware
+                        self._send_get_firmware(device)
+            if self._registry is not None:
+                await self.__save_registry(False)
+
+    async def __save_registry(self, force: bool):
+        """Update the registry with the devices and save it in a thread when it is due"""
+        if not force and not self._registry.save_due():
+            return
+        self._update_registry()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._registry.save)
+        except OSError:
+            # the registry is saved again at the next interval
+            pass
+
+    def __send_retries(self):
+        """Send the commands that are due for a retransmission"""
+        for command in self._commands.pop_retries():
+            device: Device = self.get_device(command.device_id)
+            if device is not None and self._transport is not None:
+                self._send_data(device, command.packet)
+                command._resent()
+                self.metrics.retransmitted(command)
+
+    async def __wait_for_confirmation(self, command: Command):
+        """Wait for a command a following command depends on. A missing
+        confirmation is not an error here, the following command will time
+        out by itself if the device does not respond"""
+        try:
+            await command
+        except TimeoutError:
+            pass
+
+    def _send_command(self, device: Device, data, parameters, name: str) -> Command:
+        command = super()._send_command(device, data, parameters, name)
+        # the poll task waits for the timeout of the command too
+        self._pollwakeup.set()
+        return command
+
+    def _send_data(self, device: Device, data):
+        """Send a data packet to a device"""
+        self.__sendto(data, device.ip_address)
+
+    def __send_search(self, addresses: list):
+        """Broadcast the search command to the addresses"""
+        packet = VentoExpertPacket()
+        packet.initialize_search_cmd()
+        for address in addresses:
+            self.__sendto(packet.data, address)
+
+    def __sendto(self, data, ip_address: str):
+        """Send a data packet. UDP sends never block so no lock is needed"""
+        if self._transport is None:
+            raise Exception("Client is not started")
+        self._transport.sendto(data, (ip_address, 4000))
+        self.metrics.packet_sent(data)
+
+    def __open_socket(self, bind_address: str, port: int):
+        """Open the socket and set the options on the socket"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+        sock.setsockopt(SOL_SOCKET, SO_RCVBUF, RECEIVE_BUFFER)
+        sock.bind((bind_address, port))
+        sock.setblocking(False)
+        return sock
@@ -0,0 +1,250 @@
+# Implements the logic shared by the VentoClient and the AsyncVentoClient.
+# The clients send the packets and wait for the answers in their own way,
+# everything else about the devices is done here.
+
+import threading
+
+from .command import Command, CommandGroup, CommandTracker
+from .device import Device, Mode
+from .metrics import MetricsRegistry
+from .network import find_interface, interfaces_from_cidrs
+from .registry import DeviceRegistry
+from .archive import TelemetryArchive
+from .telemetry import TelemetryRecorder
+from .telemetry import PARAMETERS as TELEMETRY_PARAMETERS
+from .ventoPacket import VentoExpertPacket
+from .responsepacket import ResponsePacket
+from .scheduler import PollScheduler
+from VentoExpertSDK import ventoProtocol as protocol
+
+
+class VentoClientBase:
+    """Base of the clients with the devices, the commands and the decoding
+    of the responses. A client sends a packet to a device in _send_data(),
+    calls _handle_datagram() for every datagram received and sets its
+    _pollwakeup event to poll a new device or retransmit a command"""
+
+    def __init__(
+        self,
+        command_timeout: float,
+        poll_interval: float,
+        interfaces,
+        registry: DeviceRegistry,
+        telemetry: TelemetryRecorder,
+        archive: TelemetryArchive,
+        metrics: MetricsRegistry,
+        retries: int,
+        retry_interval: float,
+    ):
+        self._devices = {}
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.telemetry = telemetry
+        self.archive = archive
+        self._interfaces = interfaces_from_cidrs(interfaces or [])
+        self._commands = CommandTracker()
+        self._command_timeout = command_timeout
+        self._retries = retries
+        self._retry_interval = retry_interval
+        self._scheduler = PollScheduler(poll_interval)
+        self._found_device_callback = None
+        self._search_listeners = []      # replaced, never changed in place, as the responses are handled while iterating it
+        self._listeners_lock = threading.Lock()
+        self._registry = registry
+        if registry is not None:
+            self._restore_devices()
+
+    def _send_data(self, device: Device, data):
+        """Send a data packet to a device. Implemented by the clients"""
+        raise NotImplementedError
+
+    def _add_device(self, device_id: str, password: str, ip_address: str, onchange, poll_interval: float) -> Device:
+        """Add a device or update the one already added and request its firmware"""
+        device: Device = self.get_device(device_id)
+        if device is None:
+            device = Device(device_id, password, ip_address, onchange)
+            self._devices[device_id] = device
+        elif onchange is not None:
+            # e.g. a device restored from the registry
+            device._changeevent = onchange
+        if device_id not in self._scheduler or poll_interval is not None:
+            self._scheduler.add(device_id, poll_interval)
+            self._pollwakeup.set()
+        self._send_get_firmware(device)
+        return device
+
+    def remove_device(self, device_id):
+        """Remove an existing device"""
+        device: Device = self.get_device(device_id)
+        if device is not None:
+            del self._devices[device_id]
+            self._scheduler.remove(device_id)
+            if self._registry is not None:
+                self._registry.remove(device_id)
+            if self.telemetry is not None:
+                self.telemetry.remove(device_id)
+            self.metrics.remove_device(device_id)
+        return device
+
+    def get_device(self, device_id: str) -> Device:
+        """Get a device by device id."""
+        return self._devices.get(device_id)
+
+    def get_device_count(self):
+        """Return the number of devices"""
+        return len(self._devices)
+
+    def interface_of(self, ip_address: str):
+        """Return the interface of the client with the network the ip address
+        is on. None if the client has no interfaces or none matches"""
+        return find_interface(self._interfaces, ip_address)
+
+    def _add_search_listener(self, listener):
+        with self._listeners_lock:
+            self._search_listeners = self._search_listeners + [listener]
+
+    def _remove_search_listener(self, listener):
+        with self._listeners_lock:
+            self._search_listeners = [item for item in self._search_listeners if item is not listener]
+
+    def _search_addresses(self, interfaces) -> list:
+        """Return the broadcast addresses to send the search command to"""
+        interfaces = self._interfaces if interfaces is None else interfaces_from_cidrs(interfaces)
+        if not interfaces:
+            return ["<broadcast>"]
+        return list(dict.fromkeys(interface.broadcast_address for interface in interfaces))
+
+    def _apply(self, device: Device, on: bool, speed: int, manualspeed: int, mode: Mode, reset_filter: bool) -> Command:
+        """Send the settings of apply() in one packet"""
+        values = VentoExpertPacket.settings_values(device, on, speed, manualspeed, mode)
+        writes = {protocol.RESET_FILTER_TIMER: 1} if reset_filter else None
+        packet = VentoExpertPacket()
+        if not values:
+            if writes is None:
+                raise ValueError("No settings to apply")
+            packet.initialize_write_cmd(device, writes, protocol.WRITE)
+            self._send_data(device, packet.data)
+            return None
+        packet.initialize_write_cmd(device, values, protocol.WRITEREAD, writes)
+        return self._send_command(device, packet.data, values, "apply")
+
+    def _read(self, device: Device, parameters) -> CommandGroup:
+        """Send the read packets of read()"""
+        return CommandGroup(
+            self._send_command(device, packet.data, group, "read")
+            for packet, group in VentoExpertPacket.read_packets(device, parameters)
+        )
+
+    def _write(self, device: Device, values: dict, function: int) -> CommandGroup:
+        """Send the write packets of write()"""
+        packets = VentoExpertPacket.write_packets(device, values, function)
+        if function == protocol.WRITE:
+            for packet, _ in packets:
+                self._send_data(device, packet.data)
+            return None
+        return CommandGroup(
+            self._send_command(device, packet.data, group, "write")
+            for packet, group in packets
+        )
+
+    def _reset_filter_alarm(self, device: Device):
+        packet = VentoExpertPacket()
+        packet.initialize_reset_filter_alarm_cmd(device)
+        self._send_data(device, packet.data)
+
+    @staticmethod
+    def _validation_result(device_id: str, answered: bool, searched: set) -> str:
+        """Return the result of validate_devices() for a device"""
+        if answered:
+            return "ok"
+        return "wrong_password" if device_id in searched else "silent"
+
+    def _remove_validated(self, added: list, results: dict, add: bool):
+        """Remove the devices added by validate_devices() that are not kept"""
+        for device_id in added:
+            if not add or results.get(device_id) != "ok":
+                self.remove_device(device_id)
+
+    def _send_status(self, device: Device):
+        """Send a status command to the device"""
+        packet = VentoExpertPacket()
+        packet.initialize_status_cmd(device)
+        self.metrics.poll_sent(device.device_id)
+        self._send_data(device, packet.data)
+
+    def _send_get_firmware(self, device: Device):
+        """Request the firmware version and unit type of the device"""
+        packet = VentoExpertPacket()
+        packet.initialize_get_firmware_cmd(device)
+        self._send_data(device, packet.data)
+
+    def _send_command(self, device: Device, data, parameters, name: str) -> Command:
+        """Send a data packet with a command to a device.
+        The command is registered before it is sent so the response can not
+        arrive before it is tracked"""
+        command = Command(device.device_id, parameters, self._command_timeout, name, self._retries, self._retry_interval)
+        command.packet = bytes(data)
+        command.add_done_callback(self.metrics.command_done)
+        self._commands.register(command)
+        command._sent()
+        self._send_data(device, data)
+        if command.max_retries:
+            # the poll loop sends the retransmissions
+            self._pollwakeup.set()
+        return command
+
+    def _handle_datagram(self, data: bytes, addr):
+        """Decode a datagram and apply it to the device it is from"""
+        packet = ResponsePacket.decode(data)
+        if packet is None:
+            reason = ResponsePacket.error(data)
+            # the search broadcast of the client itself is received as a READ packet
+            if reason != "function":
+                self.metrics.packet_error(reason)
+            return
+        self.metrics.packet_received(packet)
+        if packet.search_device_id is not None:
+            for listener in self._search_listeners:
+                listener(packet.search_device_id, addr[0])
+        device = self._devices.get(packet.device_id)
+        if device is None:
+            if (
+                packet.search_device_id is not None
+                and self._found_device_callback is not None
+            ):
+                self._found_device_callback(packet.search_device_id, addr[0])
+            return
+        if self._commands.duplicate(packet.device_id, packet.values):
+            # the values are still applied, only the answer is not counted or confirmed again
+            device.update_from_packet(addr[0], packet)
+            self.metrics.duplicate_response()
+            return
+        self.update_device(device, addr[0], packet)
+        self.metrics.poll_answered(packet.device_id, packet.values)
+        self._commands.resolve(packet.device_id, packet.values)
+
+    def _update_device(self, device: Device, ip_address: str, packet: ResponsePacket) -> bool:
+        """Update the device and record the telemetry of a status response.
+        Returns True if a value of the device changed"""
+        if self._interfaces and (device.interface is None or ip_address != device.ip_address):
+            device.interface = find_interface(self._interfaces, ip_address)
+        haschange = device.update_from_packet(ip_address, packet)
+        if (self.telemetry is not None or self.archive is not None) and not TELEMETRY_PARAMETERS.isdisjoint(packet.values):
+            if self.telemetry is not None:
+                self.telemetry.record(device)
+            if self.archive is not None:
+                # compressed and written by the writer thread of the archive
+                self.archive.record(device)
+        return haschange
+
+    def _restore_devices(self):
+        """Add the devices in the registry. They are validated by the status polls"""
+        for device_id, record in self._registry.records().items():
+            device = Device(device_id, record.get("password"), record.get("ip_address") or "<broadcast>")
+            device.restore(record)
+            self._devices[device_id] = device
+            self._scheduler.add(device_id)
+
+    def _update_registry(self):
+        """Update the registry with the devices before it is saved"""
+        for device in list(self._devices.values()):
+            self._registry.update(device)
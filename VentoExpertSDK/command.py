@@ -0,0 +1,320 @@
+# Implements tracking of commands waiting for the confirming response from a device
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+
+class Command:
+    """A command sent to a device.
+    The command is confirmed when the device answers with a RESPONSE packet
+    containing exactly the parameters of the command. result() returns the
+    confirmed values as a dict of parameter -> value and raises TimeoutError
+    if the device did not answer before the timeout.
+    The command can also be awaited from asyncio code.
+    A command with max_retries is sent again up to max_retries times when it
+    is not confirmed. The first retransmission is after retry_interval and
+    the interval is doubled for every retransmission until the deadline.
+    retries is the number of retransmissions actually sent.
+    """
+
+    def __init__(self, device_id: str, parameters, timeout: float = 2.0, name: str = None, max_retries: int = 0, retry_interval: float = 0.2):
+        self.device_id = device_id
+        self.parameters = frozenset(parameters)
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.retries = 0
+        self._attempts = 0          # retransmissions scheduled, for the backoff
+        self.packet = None          # the data sent, used for the retransmissions
+        self.sent_at = None
+        self.confirmed_at = None
+        self.deadline = time.monotonic() + timeout
+        self._values = None
+        self._error = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @classmethod
+    def confirmed(cls, device_id: str, values: dict, name: str = None):
+        """Return a command that is already confirmed with the values.
+        Used when the device already has the requested state"""
+        command = cls(device_id, values.keys(), 0, name)
+        command._confirm(values)
+        return command
+
+    @property
+    def latency(self) -> float:
+        """Return the time in seconds from the command was sent until it was
+        confirmed. None if it is not confirmed"""
+        if self.sent_at is None or self.confirmed_at is None:
+            return None
+        return self.confirmed_at - self.sent_at
+
+    def done(self) -> bool:
+        """Return True if the command is confirmed or has timed out"""
+        return self._event.is_set()
+
+    def result(self, timeout: float = None) -> dict:
+        """Wait for the confirmation and return the confirmed values.
+        Default is to wait until the command timeout"""
+        if timeout is None:
+            timeout = max(0, self.deadline - time.monotonic())
+        if not self._event.wait(timeout) and time.monotonic() >= self.deadline:
+            self._expire()
+        if not self._event.is_set():
+            raise TimeoutError(f"Timeout waiting for confirmation from {self.device_id}")
+        if self._error is not None:
+            raise self._error
+        return self._values
+
+    def add_done_callback(self, callback):
+        """Call the callback with the command when it is confirmed or timed out"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def __await__(self):
+        return self.__wait_async().__await__()
+
+    async def __wait_async(self):
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+
+        def wakeup(_):
+            if not waiter.done():
+                waiter.set_result(None)
+
+        def threadsafe_wakeup(command):
+            try:
+                loop.call_soon_threadsafe(wakeup, command)
+            except RuntimeError:
+                # the event loop is closed
+                pass
+
+        self.add_done_callback(threadsafe_wakeup)
+        try:
+            await asyncio.wait_for(waiter, max(0, self.deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self._expire()
+        return self.result(0)
+
+    def _sent(self):
+        """Mark the command as sent"""
+        self.sent_at = time.monotonic()
+
+    def _resent(self):
+        """Count a retransmission that was sent"""
+        self.retries += 1
+
+    def _confirm(self, values: dict) -> bool:
+        """Confirm the command. Returns False if it was already done"""
+        return self.__finish(values, None)
+
+    def _expire(self) -> bool:
+        """Time out the command. Returns False if it was already done"""
+        return self.__finish(None, TimeoutError(f"Timeout waiting for confirmation from {self.device_id}"))
+
+    def __finish(self, values, error) -> bool:
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self._values = values
+            self._error = error
+            if error is None:
+                self.confirmed_at = time.monotonic()
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+        return True
+
+
+class CommandTracker:
+    """Keeps the commands waiting for a response and matches the response
+    packets back to them by device id and parameter set.
+    It also schedules the retransmissions of the commands with max_retries.
+    When a retransmitted command is confirmed the device may still answer
+    the other transmissions. Those duplicate responses are recognized by
+    duplicate() until the deadline of the command, at most one per
+    retransmission sent, so they do not confirm a later command with the
+    same parameters. A new command with the same parameters ends that"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._deadlines = []
+        self._retries = []          # heap of (time of the next retransmission, sequence, command)
+        self._duplicates = {}       # device id -> [[parameters, values, expected duplicates, deadline]]
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(commands) for commands in self._pending.values())
+
+    def register(self, command: Command):
+        """Register a command before it is sent"""
+        self.expire()
+        with self._lock:
+            records = self._duplicates.get(command.device_id)
+            if records is not None:
+                # the answers to the new command are not duplicates
+                records[:] = [record for record in records if record[0] != command.parameters]
+                if not records:
+                    del self._duplicates[command.device_id]
+            self._pending.setdefault(command.device_id, []).append(command)
+            heapq.heappush(self._deadlines, (command.deadline, next(self._sequence), command))
+            if command.max_retries > 0:
+                retry_at = time.monotonic() + command.retry_interval
+                if retry_at < command.deadline:
+                    heapq.heappush(self._retries, (retry_at, next(self._sequence), command))
+
+    def resolve(self, device_id: str, values: dict) -> Command:
+        """Confirm the oldest command for the device with the same parameters
+        as the response. Returns the command or None if nothing matched"""
+        with self._lock:
+            pending = self._pending.get(device_id)
+            if not pending:
+                return None
+            for index, command in enumerate(pending):
+                if command.parameters == values.keys():
+                    del pending[index]
+                    if not pending:
+                        del self._pending[device_id]
+                    break
+            else:
+                return None
+            if command.retries:
+                self._duplicates.setdefault(device_id, []).append([command.parameters, values, command.retries, command.deadline])
+        command._confirm(values)
+        return command
+
+    def duplicate(self, device_id: str, values: dict) -> bool:
+        """Return True if the response is a duplicate answer to a retransmitted
+        command that is already confirmed. The response must not confirm
+        another command or be counted as an answer. A response matching a
+        command still waiting is never a duplicate"""
+        if not self._duplicates:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            records = self._duplicates.get(device_id)
+            if records is None:
+                return False
+            if any(command.parameters == values.keys() for command in self._pending.get(device_id, ())):
+                return False
+            found = False
+            for record in records:
+                if record[3] > now and record[0] == values.keys() and record[1] == values:
+                    record[2] -= 1
+                    found = True
+                    break
+            records[:] = [record for record in records if record[2] > 0 and record[3] > now]
+            if not records:
+                del self._duplicates[device_id]
+        return found
+
+    def next_deadline(self) -> float:
+        """Return the time.monotonic() of the next command timeout. None if no command is waiting"""
+        with self._lock:
+            while self._deadlines and self._deadlines[0][2].done():
+                heapq.heappop(self._deadlines)
+            return self._deadlines[0][0] if self._deadlines else None
+
+    def next_retry(self) -> float:
+        """Return the time.monotonic() of the next retransmission. None if there is none"""
+        with self._lock:
+            while self._retries and self._retries[0][2].done():
+                heapq.heappop(self._retries)
+            return self._retries[0][0] if self._retries else None
+
+    def pop_retries(self, now: float = None) -> list:
+        """Return the commands due for a retransmission and schedule the next
+        retransmission with the doubled interval. Call Command._resent() for
+        every retransmission that is sent"""
+        if now is None:
+            now = time.monotonic()
+        due = []
+        with self._lock:
+            while self._retries and self._retries[0][0] <= now:
+                command = heapq.heappop(self._retries)[2]
+                if command.done():
+                    continue
+                command._attempts += 1
+                due.append(command)
+                retry_at = now + command.retry_interval * 2 ** command._attempts
+                if command._attempts < command.max_retries and retry_at < command.deadline:
+                    heapq.heappush(self._retries, (retry_at, next(self._sequence), command))
+        return due
+
+    def expire(self, now: float = None):
+        """Time out all commands that have passed their deadline"""
+        if now is None:
+            now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                command = heapq.heappop(self._deadlines)[2]
+                if command.done():
+                    continue
+                pending = self._pending.get(command.device_id)
+                if pending is not None and command in pending:
+                    pending.remove(command)
+                    if not pending:
+                        del self._pending[command.device_id]
+                expired.append(command)
+            for device_id in [device_id for device_id, records in self._duplicates.items() if all(record[3] <= now for record in records)]:
+                del self._duplicates[device_id]
+        for command in expired:
+            command._expire()
+
+
+class CommandGroup:
+    """Commands sent together, e.g. a read that was split into several packets.
+    result() returns the confirmed values of all the commands merged into one dict.
+    The group can also be awaited from asyncio code.
+    """
+
+    def __init__(self, commands):
+        self.commands = list(commands)
+
+    @property
+    def latency(self) -> float:
+        """Return the latency of the slowest command. None if not all are confirmed"""
+        latencies = [command.latency for command in self.commands]
+        if None in latencies:
+            return None
+        return max(latencies, default=0)
+
+    @property
+    def retries(self) -> int:
+        """Return the retransmissions sent for all the commands"""
+        return sum(command.retries for command in self.commands)
+
+    def done(self) -> bool:
+        """Return True if all the commands are confirmed or have timed out"""
+        return all(command.done() for command in self.commands)
+
+    def result(self, timeout: float = None) -> dict:
+        """Wait for all the commands and return the merged confirmed values"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        values = {}
+        for command in self.commands:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            values.update(command.result(remaining))
+        return values
+
+    def __await__(self):
+        return self.__wait_async().__await__()
+
+    async def __wait_async(self):
+        values = {}
+        for command in self.commands:
+            values.update(await command)
+        return values
@@ -1,6 +1,8 @@
 """Implements the Blauberg Vento Expert device class """
+import threading
 import time
 from .mode import Mode
+from VentoExpertSDK import ventoProtocol as protocol
 
 
 class Device:
@@ -16,10 +18,12 @@ class Device:
         self._id = deviceid
         self._password = password
         self._ip_address = ip_address
+        self.interface = None       # NetworkInterface the device answered on when the client has interfaces
         self._speed = None
         self._mode: Mode = None
         self._manualspeed: int = None
         self._fan1rpm: int = None
+        self._fan2rpm: int = None
         self._humidity: int = None
         self._filter_alarm = False
         self._filter_timer = None
@@ -30,6 +34,21 @@ class Device:
         self.fan_rtc_date = None
         self.fan_rtc_time = None
         self.rtc_battery_voltage = None
+        self._parameters = {}       # parameter -> last value received from the device
+        self.last_seen = None       # time.time() of the last packet received from the device
+        self._status_received = threading.Event()       # set by the first response with the mode
+        self._firmware_received = threading.Event()     # set when the firmware version is known
+        # precompiled packet header with id and password and the checksum of
+        # the header bytes. Used by VentoExpertPacket to build the packets
+        password = self.password
+        self._packet_header = (
+            bytes((protocol.PACKET_START_CHARACTER, protocol.PACKET_START_CHARACTER, protocol.PROTOCOL_TYPE, len(deviceid)))
+            + deviceid.encode("ascii")
+            + bytes((len(password),))
+            + password.encode("ascii")
+        )
+        self._header_checksum = sum(self._packet_header[2:])
+        self._packets = {}      # cache of the packets built for the device
 
     @property
     def device_id(self) -> str:
@@ -63,6 +82,11 @@ class Device:
         """Return the fan1 rpm of the device"""
         return self._fan1rpm
 
+    @property
+    def fan2rpm(self) -> int:
+        """Return the fan2 rpm of the device"""
+        return self._fan2rpm
+
     @property
     def mode(self) -> Mode:
         """Return the mode of the device"""
@@ -97,6 +121,33 @@ class Device:
     def unit_type(self) -> int:
         return self._unit_type
 
+    @property
+    def parameters(self) -> dict:
+        """Return the last received value of every parameter as parameter -> value.
+        A parameter the device does not support has the value None"""
+        return self._parameters
+
+    def to_record(self) -> dict:
+        """Return the fields of the device kept in the device registry"""
+        return {
+            "ip_address": self._ip_address,
+            "password": self._password,
+            "firmware_version": self._firmware_version,
+            "firmware_date": self._firmware_date,
+            "unit_type": self._unit_type,
+            "last_seen": self.last_seen,
+        }
+
+    def restore(self, record: dict):
+        """Restore the fields of the device from a device registry record.
+        The values are replaced when the device answers"""
+        self._firmware_version = record.get("firmware_version")
+        self._firmware_date = record.get("firmware_date")
+        self._unit_type = record.get("unit_type")
+        self.last_seen = record.get("last_seen")
+        if self._firmware_version is not None:
+            self._firmware_received.set()
+
     def is_initialized(self):
         """Returns True if the device has initilized.
         The device is initialize once the get initial get firmware packet has been received.
@@ -104,7 +155,70 @@ class Device:
         """
         return self.firmware_version is not None
 
-    def wait_for_initialize(self):
-        timeout = time.time() + 2
-        while self.firmware_version is None and time.time() < timeout:
-            time.sleep(0.1)
+    def update_from_packet(self, ip_address: str, packet) -> bool:
+        """Update the device with the data from a response packet.
+        Returns True if any of the values that trigger a change event changed.
+        Called by the clients - you should not call this yourself
+        """
+        haschange = False
+        self.last_seen = time.time()
+        if self._ip_address is not None and ip_address != self._ip_address:
+            self._ip_address = ip_address
+            haschange = True
+        if packet.speed is not None and packet.speed != self._speed:
+            self._speed = packet.speed
+            haschange = True
+        if packet.manualspeed is not None and packet.manualspeed != self._manualspeed:
+            self._manualspeed = packet.manualspeed
+            haschange = True
+        if packet.mode is not None and packet.mode != self._mode:
+            self._mode = packet.mode
+            haschange = True
+            self._status_received.set()
+
+        if (
+            packet.filter_alarm is not None
+            and packet.filter_alarm != self._filter_alarm
+        ):
+            self._filter_alarm = packet.filter_alarm
+            haschange = True
+
+        if (
+            packet.filter_timer is not None
+            and packet.filter_timer != self._filter_timer
+        ):
+            self._filter_timer = packet.filter_timer
+            haschange = True
+
+        if packet.humidity is not None and packet.humidity != self._humidity:
+            self._humidity = packet.humidity
+            haschange = True
+        if packet.firmware_version is not None:
+            self._firmware_version = packet.firmware_version
+            self._firmware_received.set()
+        if packet.firmware_date is not None:
+            self._firmware_date = packet.firmware_date
+        if packet.unit_type is not None:
+            self._unit_type = packet.unit_type
+        # note we do not want the fan rpm to trigger change event because it
+        # changes all the time
+        if packet.fan1rpm is not None:
+            self._fan1rpm = packet.fan1rpm
+        if packet.fan2rpm is not None:
+            self._fan2rpm = packet.fan2rpm
+        if packet.rtc_battery_voltage is not None:
+            self.rtc_battery_voltage = packet.rtc_battery_voltage
+        if packet.rtc_time is not None:
+            self.fan_rtc_time = packet.rtc_time
+        if packet.rtc_date is not None:
+            self.fan_rtc_date = packet.rtc_date
+        self._parameters.update(packet.values)
+        return haschange
+
+    def wait_for_initialize(self, timeout: float = 2) -> bool:
+        """Wait until the firmware version is received. Returns False on timeout"""
+        return self._firmware_received.wait(timeout)
+
+    def wait_for_status(self, timeout: float = None) -> bool:
+        """Wait until the first status with the mode is received. Returns False on timeout"""
+        return self._status_received.wait(timeout)
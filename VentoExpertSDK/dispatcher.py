@@ -0,0 +1,122 @@
+# Implements the dispatching of change events off the UDP receive thread
+
+import collections
+import threading
+
+
+class ChangeDispatcher:
+    """Delivers the change events of the devices to the callbacks on worker
+    threads or an executor so a slow callback does not block the reception
+    of packets from the devices.
+    Events are keyed by device. If an event for a device is already waiting
+    it is replaced by the new one so only the latest state is delivered.
+    The events for one device are delivered in order and never concurrently.
+    At most maxsize devices can have an event waiting. Events for other
+    devices are dropped when the queue is full.
+    """
+
+    def __init__(self, workers: int = 1, maxsize: int = 1000, executor=None):
+        self.maxsize = maxsize
+        self._executor = executor
+        self._condition = threading.Condition()
+        self._pending = {}                  # key -> (callback, args) waiting to be delivered
+        self._ready = collections.deque()   # keys with an event waiting and not being delivered
+        self._running = set()               # keys being delivered
+        self._closed = False
+        self.submitted = 0
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self._workers = []
+        if executor is None:
+            for _ in range(max(1, workers)):
+                worker = threading.Thread(target=self.__worker_fn, daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    @property
+    def depth(self) -> int:
+        """Return the number of events waiting to be delivered"""
+        return len(self._pending)
+
+    def stats(self) -> dict:
+        """Return the counters of the dispatcher"""
+        with self._condition:
+            return {
+                "depth": len(self._pending),
+                "running": len(self._running),
+                "submitted": self.submitted,
+                "delivered": self.delivered,
+                "coalesced": self.coalesced,
+                "dropped": self.dropped,
+                "errors": self.errors,
+            }
+
+    def submit(self, key, callback, *args) -> bool:
+        """Deliver callback(*args) on a worker. An event already waiting for
+        the key is replaced. Returns False if the event was dropped"""
+        with self._condition:
+            if self._closed:
+                self.dropped += 1
+                return False
+            self.submitted += 1
+            if key in self._pending:
+                self.coalesced += 1
+                self._pending[key] = (callback, args)
+                return True
+            if len(self._pending) >= self.maxsize:
+                self.dropped += 1
+                return False
+            self._pending[key] = (callback, args)
+            if key not in self._running:
+                self.__schedule(key)
+            return True
+
+    def close(self, wait: bool = True):
+        """Stop the dispatcher. The events waiting are delivered before the
+        workers end. Wait for the workers if wait is True"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def __schedule(self, key):
+        """Schedule delivery of the event for the key. Must be called with the lock held"""
+        if self._executor is not None:
+            self._running.add(key)
+            self._executor.submit(self.__deliver, key)
+        else:
+            self._ready.append(key)
+            self._condition.notify()
+
+    def __worker_fn(self):
+        while True:
+            with self._condition:
+                while not self._ready and not self._closed:
+                    self._condition.wait()
+                if not self._ready:
+                    return
+                key = self._ready.popleft()
+                self._running.add(key)
+            self.__deliver(key)
+
+    def __deliver(self, key):
+        """Deliver the event waiting for the key. The key is marked as running"""
+        with self._condition:
+            callback, args = self._pending.pop(key)
+        try:
+            callback(*args)
+        except Exception as error:
+            with self._condition:
+                self.errors += 1
+                self.last_error = error
+        with self._condition:
+            self.delivered += 1
+            self._running.discard(key)
+            if key in self._pending:
+                # a new event arrived while this one was delivered
+                self.__schedule(key)
@@ -0,0 +1,215 @@
+# Implements the metrics of a client: counters and latency histograms
+
+import bisect
+import math
+import threading
+import time
+
+from VentoExpertSDK import ventoProtocol as protocol
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# name -> (type, help) of the metrics recorded by the clients
+METRICS = {
+    "vento_packets_sent_total": ("counter", "Packets sent to the devices by function"),
+    "vento_packets_received_total": ("counter", "Valid response packets received from the devices by function"),
+    "vento_packet_errors_total": ("counter", "Packets received that could not be decoded by reason"),
+    "vento_unknown_parameters_total": ("counter", "Parameters received that are not in the decoder table"),
+    "vento_socket_recreations_total": ("counter", "Times the socket was recreated after an error"),
+    "vento_polls_total": ("counter", "Status polls sent by device"),
+    "vento_polls_lost_total": ("counter", "Status polls not answered before the next poll by device"),
+    "vento_command_timeouts_total": ("counter", "Commands not confirmed before the timeout by device and command"),
+    "vento_retransmissions_total": ("counter", "Commands sent again as they were not confirmed by device and command"),
+    "vento_duplicate_responses_total": ("counter", "Duplicate responses to retransmitted commands ignored"),
+    "vento_latency_seconds": ("histogram", "Time from a request is sent until the response by device and command"),
+}
+
+# function number -> label of the packets sent and received
+FUNCTION_NAMES = {
+    protocol.READ: "read",
+    protocol.WRITE: "write",
+    protocol.WRITEREAD: "writeread",
+    protocol.INCREAD: "incread",
+    protocol.DECREAD: "decread",
+    protocol.RESPONSE: "response",
+}
+
+# the parameters of a status poll. A response with all of them answers the poll
+_STATUS_PARAMETERS = frozenset((
+    protocol.ON_OFF,
+    protocol.VENTILATION_MODE,
+    protocol.SPEED,
+    protocol.FAN1RPM,
+))
+
+
+def _labels_text(labels: tuple, extra: str = None) -> str:
+    parts = ['{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels]
+    if extra is not None:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number_text(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """Counters and histograms identified by a name and labels.
+    The clients record the packets sent and received, the decode errors and
+    the latency of the commands and status polls of every device. Read them
+    with snapshot() or as the Prometheus text format with prometheus().
+    Several clients can share a registry"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}     # (name, labels) -> value
+        self._histograms = {}   # (name, labels) -> [bucket counts, count, sum]
+        self._polls = {}        # device id -> time.monotonic() the unanswered status poll was sent
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        """Add amount to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        """Add a value to a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            histogram[0][index] += 1
+            histogram[1] += 1
+            histogram[2] += value
+
+    def packet_sent(self, data: bytes):
+        """Count a packet sent by a client"""
+        id_end = 4 + data[3]
+        function = data[id_end + 1 + data[id_end]]
+        self.increment("vento_packets_sent_total", function=FUNCTION_NAMES.get(function, str(function)))
+
+    def packet_received(self, packet):
+        """Count a valid response packet"""
+        # decode() only returns packets with the response function
+        self.increment("vento_packets_received_total", function=FUNCTION_NAMES[protocol.RESPONSE])
+        if packet.unknown:
+            self.increment("vento_unknown_parameters_total", packet.unknown)
+
+    def packet_error(self, reason: str):
+        """Count a packet that could not be decoded. reason is from ResponsePacket.error()"""
+        self.increment("vento_packet_errors_total", reason=reason)
+
+    def socket_recreated(self):
+        self.increment("vento_socket_recreations_total")
+
+    def poll_sent(self, device_id: str):
+        """Start timing a status poll. A poll that is still not answered when
+        the next one is sent is counted as lost"""
+        now = time.monotonic()
+        with self._lock:
+            lost = self._polls.get(device_id) is not None
+            self._polls[device_id] = now
+        if lost:
+            self.increment("vento_polls_lost_total", device=device_id)
+        self.increment("vento_polls_total", device=device_id)
+
+    def poll_answered(self, device_id: str, values: dict):
+        """Record the latency of the status poll if the values answer it"""
+        if not _STATUS_PARAMETERS <= values.keys():
+            return
+        with self._lock:
+            sent_at = self._polls.pop(device_id, None)
+        if sent_at is not None:
+            self.observe("vento_latency_seconds", time.monotonic() - sent_at, device=device_id, command="status")
+
+    def command_done(self, command):
+        """Record the latency or the timeout of a command. Used as the done callback of the commands"""
+        if command.latency is not None:
+            self.observe("vento_latency_seconds", command.latency, device=command.device_id, command=command.name)
+        else:
+            self.increment("vento_command_timeouts_total", device=command.device_id, command=command.name)
+
+    def retransmitted(self, command):
+        self.increment("vento_retransmissions_total", device=command.device_id, command=command.name)
+
+    def duplicate_response(self):
+        self.increment("vento_duplicate_responses_total")
+
+    def remove_device(self, device_id: str):
+        """Stop timing the polls of a removed device and drop its series"""
+        with self._lock:
+            self._polls.pop(device_id, None)
+            for series in (self._counters, self._histograms):
+                for key in [key for key in series if ("device", device_id) in key[1]]:
+                    del series[key]
+
+    def counter(self, name: str, **labels) -> float:
+        """Return the value of a counter. 0 if it was never incremented"""
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, name: str, **labels) -> dict:
+        """Return a histogram as {"count": ..., "sum": ..., "buckets": {upper bound: count}}
+        with the cumulative count of every bucket. None if nothing was observed"""
+        with self._lock:
+            histogram = self._histograms.get((name, tuple(sorted(labels.items()))))
+            if histogram is None:
+                return None
+            return self.__histogram_dict(histogram)
+
+    def snapshot(self) -> dict:
+        """Return all the metrics as name -> list of samples. A sample is
+        {"labels": {...}, "value": ...} for a counter and {"labels": {...},
+        "count": ..., "sum": ..., "buckets": {...}} for a histogram"""
+        result = {}
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                result.setdefault(name, []).append({"labels": dict(labels), "value": value})
+            for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                result.setdefault(name, []).append({"labels": dict(labels), **self.__histogram_dict(histogram)})
+        return result
+
+    def prometheus(self) -> str:
+        """Return all the metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(((key, (list(counts), count, total)) for key, (counts, count, total) in self._histograms.items()), key=lambda item: item[0])
+        described = set()
+        for (name, labels), value in counters:
+            self.__describe(lines, described, name, "counter")
+            lines.append(f"{name}{_labels_text(labels)} {_number_text(value)}")
+        for (name, labels), (counts, count, total) in histograms:
+            self.__describe(lines, described, name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                bucket = 'le="{}"'.format(_number_text(bound))
+                lines.append(f"{name}_bucket{_labels_text(labels, bucket)} {cumulative}")
+            lines.append(f"{name}_sum{_labels_text(labels)} {_number_text(total)}")
+            lines.append(f"{name}_count{_labels_text(labels)} {count}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def __histogram_dict(self, histogram: list) -> dict:
+        counts, count, total = histogram
+        buckets = {}
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+            cumulative += bucket_count
+            buckets[bound] = cumulative
+        return {"count": count, "sum": total, "buckets": buckets}
+
+    @staticmethod
+    def __describe(lines: list, described: set, name: str, kind: str):
+        if name in described:
+            return
+        described.add(name)
+        kind, text = METRICS.get(name, (kind, name))
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
@@ -0,0 +1,82 @@
+# Implements the network interfaces used to search for devices on several subnets
+
+import ipaddress
+import socket
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows. The interfaces must be given as CIDRs there
+    fcntl = None
+
+# ioctl requests from linux/sockios.h
+_SIOCGIFFLAGS = 0x8913
+_SIOCGIFADDR = 0x8915
+_SIOCGIFNETMASK = 0x891B
+_IFF_UP = 0x1
+_IFF_LOOPBACK = 0x8
+
+
+class NetworkInterface:
+    """An IPv4 network the devices are searched on.
+    The search is sent to the broadcast address of the network"""
+
+    def __init__(self, cidr: str, name: str = None):
+        self.interface = ipaddress.IPv4Interface(cidr)
+        self.name = name if name is not None else str(self.interface.network)
+
+    def __repr__(self):
+        return f"NetworkInterface({str(self.interface)!r}, {self.name!r})"
+
+    @property
+    def address(self) -> str:
+        """Return the local address on the network"""
+        return str(self.interface.ip)
+
+    @property
+    def broadcast_address(self) -> str:
+        """Return the subnet directed broadcast address of the network"""
+        return str(self.interface.network.broadcast_address)
+
+    def __contains__(self, ip_address) -> bool:
+        try:
+            return ipaddress.IPv4Address(ip_address) in self.interface.network
+        except ValueError:
+            return False
+
+
+def interfaces_from_cidrs(cidrs) -> list:
+    """Return the network interfaces for a list of CIDRs like "192.168.1.10/24".
+    NetworkInterface objects in the list are returned as they are"""
+    return [cidr if isinstance(cidr, NetworkInterface) else NetworkInterface(cidr) for cidr in cidrs]
+
+
+def local_interfaces() -> list:
+    """Return the IPv4 network interfaces of this host that are up,
+    except the loopback interface. Empty if the interfaces can not be read"""
+    if fcntl is None or not hasattr(socket, "if_nameindex"):
+        return []
+    interfaces = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for _, name in socket.if_nameindex():
+            request = struct.pack("256s", name.encode()[:15])
+            try:
+                flags = struct.unpack_from("H", fcntl.ioctl(sock.fileno(), _SIOCGIFFLAGS, request), 16)[0]
+                if not flags & _IFF_UP or flags & _IFF_LOOPBACK:
+                    continue
+                address = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), _SIOCGIFADDR, request)[20:24])
+                netmask = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), _SIOCGIFNETMASK, request)[20:24])
+            except OSError:
+                # the interface has no IPv4 address
+                continue
+            interfaces.append(NetworkInterface(f"{address}/{netmask}", name))
+    return interfaces
+
+
+def find_interface(interfaces, ip_address: str) -> NetworkInterface:
+    """Return the interface with the network the ip address is on. None if not found"""
+    for interface in interfaces:
+        if ip_address in interface:
+            return interface
+    return None
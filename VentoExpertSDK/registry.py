@@ -0,0 +1,98 @@
+# Implements a persistent registry of the devices known by a client
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+# the fields of a device kept in the registry
+RECORD_FIELDS = ("ip_address", "password", "firmware_version", "firmware_date", "unit_type", "last_seen")
+
+
+class DeviceRegistry:
+    """The devices known by a client stored in a JSON file.
+    A client given a registry adds the devices from the file when it starts
+    so they can be controlled at once. The devices are validated lazily by
+    the normal status polls and the file is updated when the devices answer.
+    The file is written to a temporary file and renamed so a crash never
+    leaves a partly written registry.
+    """
+
+    version = 1
+
+    def __init__(self, path: str, save_interval: float = 30.0):
+        self.path = path
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._records = {}
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self.load()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, device_id):
+        return device_id in self._records
+
+    def records(self) -> dict:
+        """Return a copy of the records as device id -> record"""
+        with self._lock:
+            return {device_id: dict(record) for device_id, record in self._records.items()}
+
+    def load(self):
+        """Load the records from the file. A missing or unreadable file gives an empty registry"""
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+            records = data.get("devices", {}) if data.get("version") == self.version else {}
+        except (OSError, ValueError, AttributeError):
+            records = {}
+        with self._lock:
+            self._records = {
+                device_id: {field: record.get(field) for field in RECORD_FIELDS}
+                for device_id, record in records.items()
+                if isinstance(record, dict)
+            }
+            self._dirty = False
+
+    def update(self, device):
+        """Store the fields of the device"""
+        record = device.to_record()
+        with self._lock:
+            if self._records.get(device.device_id) != record:
+                self._records[device.device_id] = record
+                self._dirty = True
+
+    def remove(self, device_id: str):
+        """Remove a device from the registry"""
+        with self._lock:
+            if self._records.pop(device_id, None) is not None:
+                self._dirty = True
+
+    def save(self, force: bool = False) -> bool:
+        """Write the registry to the file if it changed.
+        Returns True if the file was written"""
+        with self._lock:
+            if not self._dirty and not force:
+                return False
+            data = {"version": self.version, "devices": self._records}
+            directory = os.path.dirname(os.path.abspath(self.path))
+            handle, temporary = tempfile.mkstemp(prefix=".registry-", dir=directory)
+            try:
+                with os.fdopen(handle, "w") as file:
+                    json.dump(data, file, indent=1, sort_keys=True)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temporary, self.path)
+            except BaseException:
+                os.unlink(temporary)
+                raise
+            self._dirty = False
+            self._saved_at = time.monotonic()
+            return True
+
+    def save_due(self) -> bool:
+        """Return True if save_interval has passed since the last save"""
+        return time.monotonic() - self._saved_at >= self.save_interval
@@ -1,223 +1,485 @@
-# Implements a class for the UDP data packet
-from .mode import Mode
-from .ventoPacket import VentoExpertPacket
+# Implements a class for the UDP data packet received from the device
+import datetime
+import struct
+import zlib
+
 from VentoExpertSDK import ventoProtocol as protocol
-import traceback
-
-
-class ResponsePacket(VentoExpertPacket):
-    # A UDP data packet from the device
-
-    parameter_size = {
-        # see ventoProtocol.py for documentation to avoid duplicates here
-        # see Blauberg doc for packet lenghts and other detailed documentation
-        protocol.ON_OFF: 1,
-        protocol.SPEED: 1,
-        protocol.BOOST_MODE_STATUS: 1,
-        protocol.TIMER_MODE: 1,
-        protocol.TIMER_COUNTDOWN: 3,
-        protocol.HUMIDITY_SENSOR: 1,
-        protocol.RELAY_SENSOR: 1,
-        protocol.ZERO_10V_SENSOR: 1,
-        protocol.HUMIDITY_THRESHOLD_SETPOINT: 1,
-        protocol.CURRENT_RTC_BATTERY_VOLTAGE: 2,
-        protocol.CURRENT_HUMIDITY: 1,
-        protocol.CURRENT_ZERO_10V_SENSOR_VALUE: 1,
-        protocol.CURRENT_REALY_SENSOR_STATE: 1,
-        protocol.SUPPLY_FAN_SPEED1: 1,
-        protocol.EXHAUST_FAN_SPEED1: 1,
-        protocol.SUPPLY_FAN_SPEED2: 1,
-        protocol.EXHAUST_FAN_SPEED2: 1,
-        protocol.SUPPLY_FAN_SPEED3: 1,
-        protocol.EXHAUST_FAN_SPEED3: 1,
-        protocol.MANUAL_SPEED: 1,
-        protocol.FAN1RPM: 2,
-        protocol.FAN2RPM: 2,
-        protocol.FILTER_REPLACEMENT_TIME: 2,
-        protocol.FILTER_TIMER: 3,
-        protocol.RESET_FILTER_TIMER: 1,
-        protocol.BOST_MODE_DEACTIVATION_SETPOINT: 1,
-        protocol.RTC_TIME: 3,
-        protocol.RTC_CALENDAR: 4,
-        protocol.WEEKLY_SCHEDULE_MODE: 1,
-        protocol.SCHEDULE_SETUP: 6,
-        protocol.SEARCH: 16,
-        protocol.DEVICE_PASSWORD: 0,
-        protocol.MACHINE_HOURS: 4,
-        protocol.RESET_ALARMS: 1,
-        protocol.READ_ALARM: 1,
-        protocol.CLOUD_OPERATION: 1,
-        protocol.READ_FIRMWARE_VERSION: 6,
-        protocol.RESTORE_FACTORY_SETTINGS: 1,
-        protocol.FILTER_ALARM: 1,
-        protocol.WIFI_OPERATION_MODE: 1,
-        protocol.WIFI_CLIENT_NAME: 0,
-        protocol.WIFI_PASSWORD: 0,
-        protocol.WIFI_ENCRYPTION: 1,
-        protocol.WIFI_CHANNEL: 1,
-        protocol.WIFI_IP_MODE: 1,
-        protocol.ASSIGNED_IP_ADDRESS: 4,
-        protocol.ASSIGNED_IP_SUBNET_MASK: 4,
-        protocol.ASSIGNED_IP_GATEWAY: 4,
-        protocol.APPLY_QUIT_SETUP_MODE: 1,
-        protocol.DISCARD_QUIT_SETUP_MODE: 1,
-        protocol.CURRENT_IP_ADDRESS: 4,
-        protocol.VENTILATION_MODE: 1,
-        protocol.UNIT_TYPE: 2,
-        protocol.SC_CHANGE_FUNCTION_NUMBER: 1,  # Just dummy so all are in the list. Length will vary.
-        protocol.SC_PARAMETER_NOT_SUPPORTED: 1,
-        protocol.SC_CHANGE_VALUE_SIZE: 1,       # Just dummy so all are in the list. Length will vary.
-        protocol.SC_CHANGE_HIGH_BYTE: 1,
-        protocol.NIGHT_MODE_TIMER_SETPOINT: 3,
-        protocol.PARTY_MODE_TIMER_SETPOINT: 3,
-        protocol.HUMIDITY_SETPOINT_STATUS: 1,
-        protocol.ZERO_10V_SENSOR_STATUS: 1,
-    }
-
-    def __print_data(self, data):
-        """Print data in hex - for debugging purpose """
-        print(" ".join("{:02x}".format(x) for x in data), " in responsepacket")
+
+
+def _decode_int(value: memoryview) -> int:
+    """Little endian integer of any size"""
+    return int.from_bytes(value, "little")
+
+
+def _decode_text(value: memoryview) -> str:
+    return str(value, "ascii", "replace")
+
+
+def _decode_bytes(value: memoryview) -> bytes:
+    """The raw bytes of a parameter that is not in the decoder table"""
+    return bytes(value)
+
+
+def _rtc_time(seconds: int, minutes: int, hours: int) -> datetime.time:
+    """The time of the real time clock. None if the clock is not set"""
+    try:
+        return datetime.time(hours, minutes, seconds)
+    except ValueError:
+        return None
+
+
+def _rtc_date(day: int, month: int, year: int) -> datetime.date:
+    """The date of the real time clock. None if the clock is not set"""
+    try:
+        return datetime.date(2000 + year, month, day)
+    except ValueError:
+        return None
+
+
+def _decode_countdown(value: memoryview) -> int:
+    """Byte 1 - seconds, Byte 2 - minutes, Byte 3 - hours. Returned as seconds"""
+    return value[0] + value[1] * 60 + value[2] * 3600
+
+
+def _decode_filter_timer(value: memoryview) -> int:
+    """Byte 1 - minutes, Byte 2 - hours, Byte 3 - days. Returned as minutes"""
+    return value[0] + value[1] * 60 + value[2] * 1440
+
+
+def _decode_machine_hours(value: memoryview) -> int:
+    """Byte 1 - minutes, Byte 2 - hours, Byte 3 and 4 - days. Returned as minutes"""
+    return value[0] + value[1] * 60 + (value[2] + (value[3] << 8)) * 1440
+
+
+def _decode_timer_setpoint(value: memoryview) -> int:
+    """Byte 1 - minutes, Byte 2 - hours. Returned as minutes"""
+    return value[0] + value[1] * 60
+
+
+def _decode_rtc_time(value: memoryview) -> datetime.time:
+    """Byte 1 - seconds, Byte 2 - minutes, Byte 3 - hours"""
+    return _rtc_time(value[0], value[1], value[2])
+
+
+def _decode_rtc_calendar(value: memoryview) -> datetime.date:
+    """Byte 1 - day, Byte 2 - day of the week, Byte 3 - month, Byte 4 - year in the century"""
+    return _rtc_date(value[0], value[2], value[3])
+
+
+def _decode_ip_address(value: memoryview) -> str:
+    """IP address in dotted notation"""
+    return "%d.%d.%d.%d" % (value[0], value[1], value[2], value[3])
+
+
+def _decode_schedule(value: memoryview) -> tuple:
+    """The 6 bytes of a schedule setup. See the Blauberg documentation"""
+    return tuple(value)
+
+
+def _decode_firmware(value: memoryview) -> tuple:
+    """(major, minor, day, month, year)"""
+    return (value[0], value[1], value[2], value[3], value[4] + (value[5] << 8))
+
+
+# parameter -> decoder for the parameters that are not plain integers or text
+TYPED_DECODERS = {
+    protocol.TIMER_COUNTDOWN: _decode_countdown,
+    protocol.FILTER_TIMER: _decode_filter_timer,
+    protocol.RTC_TIME: _decode_rtc_time,
+    protocol.RTC_CALENDAR: _decode_rtc_calendar,
+    protocol.SCHEDULE_SETUP: _decode_schedule,
+    protocol.SEARCH: _decode_text,
+    protocol.MACHINE_HOURS: _decode_machine_hours,
+    protocol.READ_FIRMWARE_VERSION: _decode_firmware,
+    protocol.ASSIGNED_IP_ADDRESS: _decode_ip_address,
+    protocol.ASSIGNED_IP_SUBNET_MASK: _decode_ip_address,
+    protocol.ASSIGNED_IP_GATEWAY: _decode_ip_address,
+    protocol.CURRENT_IP_ADDRESS: _decode_ip_address,
+    protocol.NIGHT_MODE_TIMER_SETPOINT: _decode_timer_setpoint,
+    protocol.PARTY_MODE_TIMER_SETPOINT: _decode_timer_setpoint,
+}
+
+
+def _build_decoders(parameter_size: dict) -> dict:
+    """Build the table of parameter -> (size, decoder) from the parameter sizes.
+    A decoder of None is a single byte value"""
+    decoders = {}
+    for parameter, size in parameter_size.items():
+        if protocol.SC_CHANGE_FUNCTION_NUMBER <= parameter <= protocol.SC_CHANGE_HIGH_BYTE:
+            # the special commands are part of the packet structure and not values
+            continue
+        if parameter in TYPED_DECODERS:
+            decoders[parameter] = (size, TYPED_DECODERS[parameter])
+        elif size == 1:
+            decoders[parameter] = (size, None)
+        elif size == 0:
+            decoders[parameter] = (size, _decode_text)
+        else:
+            decoders[parameter] = (size, _decode_int)
+    return decoders
+
+
+# decoder -> raw bytes -> value of the values converted from the cached layouts.
+# The typed values like the filter timer and the firmware version rarely change
+_converted = {}
+MAX_CONVERTED = 1024
+
+
+def _convert(decoder, converted: dict, raw: bytes):
+    """Convert the raw bytes of a value and remember the value"""
+    if len(converted) >= MAX_CONVERTED:
+        converted.clear()
+    value = converted[raw] = decoder(raw)
+    return value
+
+
+# functions making the values of a layout with up to 8 values. A dict display
+# builds the few values of a packet about twice as fast as dict(zip())
+_DISPLAYS = (
+    lambda: lambda v: {},
+    lambda a: lambda v: {a: v[0]},
+    lambda a, b: lambda v: {a: v[0], b: v[1]},
+    lambda a, b, c: lambda v: {a: v[0], b: v[1], c: v[2]},
+    lambda a, b, c, d: lambda v: {a: v[0], b: v[1], c: v[2], d: v[3]},
+    lambda a, b, c, d, e: lambda v: {a: v[0], b: v[1], c: v[2], d: v[3], e: v[4]},
+    lambda a, b, c, d, e, f: lambda v: {a: v[0], b: v[1], c: v[2], d: v[3], e: v[4], f: v[5]},
+    lambda a, b, c, d, e, f, g: lambda v: {a: v[0], b: v[1], c: v[2], d: v[3], e: v[4], f: v[5], g: v[6]},
+    lambda a, b, c, d, e, f, g, h: lambda v: {a: v[0], b: v[1], c: v[2], d: v[3], e: v[4], f: v[5], g: v[6], h: v[7]},
+)
+
+
+def _zip_values(parameters: tuple):
+    """Function making the values of a layout with more values than the displays"""
+    return lambda unpacked: dict(zip(parameters, unpacked))
+
+
+class _Layout:
+    """The layout of a packet decoded before.
+    A packet from the same device with the same length and the same
+    parameter and special command bytes at the same offsets has the values
+    at the same offsets too. They are then unpacked in one struct call and
+    paired with the parameters in a dict display, instead of walking the
+    packet byte by byte.
+    The values that are not plain integers are unpacked as bytes and
+    converted by their decoder, or taken from the values converted before."""
+
+    __slots__ = ("size", "ids", "start", "check", "structure", "unpack", "make_values", "converters", "constants", "unknown")
+
+    def __init__(self, data, ids: tuple, start: int, end: int, structure_offsets: list, fields: list, constants: dict, unknown: int):
+        self.size = len(data)
+        self.ids = ids
+        self.unknown = unknown
+        self.start = start
+        # the parameter and special command bytes are unpacked in one struct call and compared
+        structure = "<"
+        pos = start
+        for offset in structure_offsets:
+            structure += "x" * (offset - pos) + "B"
+            pos = offset + 1
+        self.check = struct.Struct(structure).unpack_from
+        self.structure = self.check(data, start)
+        # fields are (offset, size, parameter, decoder) in offset order
+        fmt = "<"
+        pos = start
+        parameters = []
+        converters = []         # (parameter, index, decoder, converted values) of the values unpacked as bytes
+        for offset, size, parameter, decoder in fields:
+            fmt += "x" * (offset - pos)
+            if decoder in (None, _decode_int) and size in (1, 2, 4):
+                fmt += {1: "B", 2: "H", 4: "I"}[size]
+            else:
+                fmt += f"{size}s"
+                decoder = decoder or _decode_int
+                converters.append((parameter, len(parameters), decoder, _converted.setdefault(decoder, {})))
+            parameters.append(parameter)
+            pos = offset + size
+        fmt += "x" * (end - pos)
+        self.unpack = struct.Struct(fmt).unpack_from
+        if len(parameters) < len(_DISPLAYS):
+            self.make_values = _DISPLAYS[len(parameters)](*parameters)
+        else:
+            self.make_values = _zip_values(tuple(parameters))
+        self.converters = tuple(converters)
+        self.constants = constants
+
+
+class ResponsePacket:
+    """A UDP data packet received from the device.
+    The packet is decoded straight from the datagram through a table of
+    parameter -> (size, decoder) built from the parameter sizes and only
+    the parameters present in the packet are stored in values as parameter -> value.
+    The layout of every decoded packet is remembered so the next packet
+    with the same layout, e.g. the next status response from the device,
+    is decoded with a single struct unpack.
+    The properties give the values by name, None if not in the packet.
+    A parameter the device does not support has the value None.
+    A parameter that is not in the decoder table is stored as raw bytes when
+    the device gives its size and counted in unknown. Without the size the
+    rest of the packet can not be decoded and is skipped.
+    """
+
+    __slots__ = ("device_id", "device_password", "values", "unknown")
+
+    # see ventoProtocol.py for documentation to avoid duplicates here
+    parameter_size = protocol.PARAMETER_SIZE
+
+    # parameter -> (size, decoder). A decoder of None is a single byte value
+    decoders = _build_decoders(parameter_size)
+
+    # packet start up to the function, with the device id and password -> layouts of the packets decoded before
+    _layouts = {}
+    max_layouts = 8192
 
     def __init__(self):
-        super(ResponsePacket, self).__init__()
         self.device_id = None
         self.device_password = None
-        self.is_on = None
-        self.speed = None
-        self.boostModeStatus = None
-        self.timerMode = None
-        self.timerCountdown = None
-        self.humiditySensor = None
-        self.relaySensor = None
-        self.voltSensorMode = None
-        self.humidityThreshholdSetpoint = None
-        self.rtcBatteryVolt = None
-        self.humidity = None            # Current humidity
-        self.manualspeed = None
-        self.fan1rpm = None
-        self.fan2rpm = None
-        self.mode: Mode = None
-        self.filter_alarm = None
-        self.filter_timer_minutes = None    # interg representation
-        self.filter_timer_hours = None      # interg representation
-        self.filter_timer_days = None       # interg representation
-        self.filter_timer = None            # String with all parameters
-        self.search_device_id = None
-        self.firmware_version = None
-        self.firmware_date = None
-        self.unit_type = None
-        self.fan_rtc_date = None
-        self.fan_rtc_time = None
+        self.values = {}            # parameter -> value for all parameters in the packet
+        self.unknown = 0            # number of parameters not in the decoder table
+
+    @classmethod
+    def decode(cls, data):
+        """Decode a datagram received from the device.
+        Returns None if the data is not a valid response packet"""
+        if type(data) is not bytes:
+            data = bytes(data)
+        size = len(data)
+        try:
+            id_end = 4 + data[3]
+            pos = id_end + 1 + data[id_end]
+            # the start of the packet up to the function is the key of the layouts.
+            # A packet found with it has the packet start, protocol type and function of a response
+            layouts = cls._layouts.get(data[: pos + 1])
+        except IndexError:
+            return None
+        if layouts is not None:
+            for layout in layouts:
+                if layout.size == size and layout.check(data, layout.start) == layout.structure:
+                    # the checksum is the sum of the bytes after the packet start. The packet has
+                    # at most 256 bytes so the low half of adler32 is the plain sum of all its bytes,
+                    # the packet start 0x1FA and the checksum bytes included
+                    if zlib.adler32(data, 0) & 0xFFFF != 0x1FA + data[size - 2] * 2 + data[size - 1] * 257:
+                        return None
+                    packet = cls.__new__(cls)
+                    packet.device_id, packet.device_password = layout.ids
+                    unpacked = layout.unpack(data, layout.start)
+                    packet.values = values = layout.make_values(unpacked)
+                    for parameter, index, decoder, converted in layout.converters:
+                        raw = unpacked[index]
+                        try:
+                            values[parameter] = converted[raw]
+                        except KeyError:
+                            values[parameter] = _convert(decoder, converted, raw)
+                    if layout.constants:
+                        values.update(layout.constants)
+                    packet.unknown = layout.unknown
+                    return packet
+        if size < 8 or data[0] != 0xFD or data[1] != 0xFD or data[2] != protocol.PROTOCOL_TYPE:
+            return None
+        end = size - 2
+        # the low half of adler32 started from 0 is the sum of the bytes modulo 65521.
+        # That is the plain sum for up to 256 bytes as 256 * 255 < 65521
+        checksum = zlib.adler32(data[2: end], 0) & 0xFFFF if end <= 258 else sum(data[2: end]) & 0xFFFF
+        if checksum != data[end] + (data[end + 1] << 8):
+            return None
+        if id_end >= end or pos >= end:
+            return None
+        if data[pos] != protocol.RESPONSE:
+            # The search command sent out to "DEFAULT_DEVICEID" will be read here as it goes out as a broadcast and is received with type READ.
+            # That is not a fault. "DEFAULT_DEVICEID" is a special device ID that Blauberg VEnto uses to search for devices on the network.
+            return None
+        packet = cls.__new__(cls)
+        view = memoryview(data)
+        ids = (_decode_text(view[4: id_end]), _decode_text(view[id_end + 1: pos]))
+        packet.device_id, packet.device_password = ids
+        layout = packet.__read_parameters(data, view, ids, pos + 1, end)
+        if layout is None:
+            return None
+        if size > 256:
+            # the checksum of a cached layout is summed in one adler32 of the whole packet
+            return packet
+        if layouts is None:
+            if len(cls._layouts) < cls.max_layouts:
+                cls._layouts[data[: pos + 1]] = [layout]
+        elif len(layouts) < 16:
+            layouts.append(layout)
+        return packet
+
+    @classmethod
+    def error(cls, data) -> str:
+        """Return why decode() returns None for the data. None if the data is valid.
+        "header" for a packet without the packet start, protocol type or
+        device id and password, "checksum" for a wrong checksum, "function"
+        for a packet that is not a response, e.g. the search broadcast of the
+        client itself, and "parameters" for parameters that can not be read"""
+        data = bytes(data)
+        size = len(data)
+        if size < 8 or data[0] != 0xFD or data[1] != 0xFD or data[2] != protocol.PROTOCOL_TYPE:
+            return "header"
+        end = size - 2
+        if sum(data[2: end]) & 0xFFFF != data[end] + (data[end + 1] << 8):
+            return "checksum"
+        id_end = 4 + data[3]
+        if id_end >= end or id_end + 1 + data[id_end] >= end:
+            return "header"
+        if data[id_end + 1 + data[id_end]] != protocol.RESPONSE:
+            return "function"
+        return None if cls.decode(data) is not None else "parameters"
 
     def initialize_from_data(self, data) -> bool:
         """Initialize a packet from data received from the device
         Returns False if the data is invalid
         """
-        try:
-            self._data = data
-            # print(f"Initialize. Data: {self.__print_data(data)}")
-            size = len(data)
-            if size < 4 or not self.is_header_ok():
-                return False
-            checksum = self.calc_checksum(size - 2)
-            datachecksum = self._data[size - 2] + (self._data[size - 1] << 8)
-            if checksum != datachecksum:
-                return False
-            self.device_id = self.read_string()
-            self.device_password = self.read_string()
-            func = self.read_byte()
-            if func != protocol.RESPONSE:
-                # The search command sent out to "DEFAULT_DEVICEID" will be read here as it goes out as a broadcast and is received with type READ.
-                # That is not a fault. "DEFAULT_DEVICEID" is a special device ID that Blauberg VEnto uses to search for devices on the network.
-                return False
-            return self.read_parameters()
-        except Exception:
-            print("EXCEPTION in init data")
-            traceback.print_exc()
+        packet = self.decode(data)
+        if packet is None:
             return False
+        self.device_id = packet.device_id
+        self.device_password = packet.device_password
+        self.values = packet.values
+        self.unknown = packet.unknown
+        return True
 
-    def is_header_ok(self):
-        if self.read_byte() != 0xFD or self.read_byte() != 0xFD:
-            return False
-        return self.read_byte() == 0x02
-
-    def read_byte(self) -> int:
-        byte = self._data[self._pos]
-        self._pos = self._pos + 1
-        return byte
-
-    def read_string(self) -> str:
-        strlen = self.read_byte()
-        txt = ""
-        for i in range(self._pos, self._pos + strlen):
-            txt += chr(self._data[i])
-        self._pos += strlen
-        return txt
-
-    def read_parameters(self) -> bool:
-        # print(f"Read param. Data: {self.__print_data(self._data)}")
-        length_data = len(self._data)
-        while self._pos < (length_data - 3):
-            size = 1        # parameter size always one if it's not an extended parameter
-            parameters = self.read_byte()
-
-            # Special handling of parameters that has more than one byte package
-            if parameters == protocol.SC_CHANGE_VALUE_SIZE:
-                # print(f"FE Parameter to be processed: {hex(parameters)}")
-                size = self.read_byte()
-                parameters = self.read_byte()   # read the extended lenght parameter
-
-            # print(f"Parameter to be processed: {hex(parameters)}")
-            ''' The cases are not in alphabetical order, but the same oreder as in the Blauberg Vento protocol desription
-            for parameteres to make it easier to find the parameter in the list '''
-            match parameters:
-                case protocol.ON_OFF:
-                    self.is_on = self._data[self._pos] != 0
-                case protocol.SPEED:
-                    self.speed = self._data[self._pos]
-                case protocol.CURRENT_RTC_BATTERY_VOLTAGE:
-                    self.rtcBatteryVoltage = self._data[self._pos]
-                case protocol.CURRENT_HUMIDITY:
-                    self.humidity = self._data[self._pos]
-                case protocol.MANUAL_SPEED:
-                    self.manualspeed = self._data[self._pos]
-                case protocol.FAN1RPM:
-                    self.fan1rpm = self._data[self._pos] + (self._data[self._pos + 1] << 8)
-                case protocol.FAN2RPM:
-                    self.fan2rpm = self._data[self._pos] + (self._data[self._pos + 1] << 8)
-                case protocol.VENTILATION_MODE:
-                    self.mode = self._data[self._pos]
-                case protocol.READ_FIRMWARE_VERSION:
-                    major = self._data[self._pos]
-                    minor = self._data[self._pos + 1]
-                    self.firmware_version = f"{major}.{minor}"
-                    day = self._data[self._pos + 2]
-                    month = self._data[self._pos + 3]
-                    year = self._data[self._pos + 4] + (self._data[self._pos + 5] << 8)
-                    self.firmware_date = f"{day}-{month}-{year}"
-                case protocol.UNIT_TYPE:
-                    self.unit_type = self._data[self._pos]
-                case protocol.FILTER_ALARM:
-                    self.filter_alarm = self._data[self._pos]
-                case protocol.FILTER_TIMER:
-                    self.filter_timer_minutes = self._data[self._pos]
-                    self.filter_timer_hours = self._data[self._pos + 1]
-                    self.filter_timer_days = self._data[self._pos + 2]
-                    self.filter_timer = (str(self.filter_timer_days)+" days " +
-                                         str(self.filter_timer_hours)+" hours " +
-                                         str(self.filter_timer_minutes)+" minutes")
-                case protocol.SEARCH:
-                    self.search_device_id = ""
-                    for i in range(self._pos, self._pos + 16):
-                        self.search_device_id += chr(self._data[i])
-                case _:
-                    if parameters not in self.parameter_size:
-                        print(f"UNEXPECTE PARAMETER : {hex(parameters)}")
-                        return False
-                    size = self.parameter_size[parameters]
-
-            self._pos += size
-        if self.is_on is not None and not self.is_on:
-            self.speed = protocol.SPEED_OFF
+    def __read_parameters(self, data, view: memoryview, ids: tuple, pos: int, end: int) -> _Layout:
+        """Decode the parameters between pos and end through the decoder table.
+        Returns the layout of the packet or None if the packet is invalid"""
+        self.values = values = {}
+        self.unknown = 0
+        decoders = self.decoders
+        start = pos
+        structure_offsets = []
+        fields = []
+        constants = {}
+        page = 0            # high byte of the parameter numbers
+        while pos < end:
+            parameter = data[pos]
+            structure_offsets.append(pos)
+            pos += 1
+            size = None
+            if parameter >= protocol.SC_CHANGE_FUNCTION_NUMBER:
+                structure_offsets.append(pos)
+                if parameter == protocol.SC_CHANGE_VALUE_SIZE:
+                    size = data[pos]
+                    parameter = data[pos + 1]
+                    structure_offsets.append(pos + 1)
+                    pos += 2
+                elif parameter == protocol.SC_CHANGE_HIGH_BYTE:
+                    page = data[pos]
+                    pos += 1
+                    continue
+                elif parameter == protocol.SC_PARAMETER_NOT_SUPPORTED:
+                    # the following byte is the parameter the device does not support
+                    values[(page << 8) | data[pos]] = None
+                    constants[(page << 8) | data[pos]] = None
+                    pos += 1
+                    continue
+                else:
+                    # SC_CHANGE_FUNCTION_NUMBER followed by the function
+                    pos += 1
+                    continue
+            if page:
+                parameter |= page << 8
+            entry = decoders.get(parameter)
+            if entry is None:
+                self.unknown += 1
+                if size is None:
+                    # the size of the value is unknown so the parameters after it can not be found
+                    break
+                entry = (size, _decode_bytes)
+            expected_size, decoder = entry
+            if size is None:
+                size = expected_size
+            if pos + size > end:
+                return None
+            if decoder not in (_decode_text, _decode_bytes) and (decoder is None or size != expected_size):
+                # a typed value with another size than documented is read as an integer
+                decoder = None if size == 1 else _decode_int
+            values[parameter] = data[pos] if decoder is None else decoder(view[pos: pos + size])
+            fields.append((pos, size, parameter, decoder))
+            pos += size
+        return _Layout(data, ids, start, end, structure_offsets, fields, constants, self.unknown)
 
-        return True
+    @property
+    def is_on(self) -> bool:
+        value = self.values.get(protocol.ON_OFF)
+        return None if value is None else value != 0
+
+    @property
+    def speed(self) -> int:
+        """The speed. SPEED_OFF if the device is off"""
+        if self.values.get(protocol.ON_OFF) == 0:
+            return protocol.SPEED_OFF
+        return self.values.get(protocol.SPEED)
+
+    @property
+    def manualspeed(self) -> int:
+        return self.values.get(protocol.MANUAL_SPEED)
+
+    @property
+    def mode(self) -> int:
+        return self.values.get(protocol.VENTILATION_MODE)
+
+    @property
+    def humidity(self) -> int:
+        """Current humidity"""
+        return self.values.get(protocol.CURRENT_HUMIDITY)
+
+    @property
+    def fan1rpm(self) -> int:
+        return self.values.get(protocol.FAN1RPM)
+
+    @property
+    def fan2rpm(self) -> int:
+        return self.values.get(protocol.FAN2RPM)
+
+    @property
+    def filter_alarm(self) -> int:
+        return self.values.get(protocol.FILTER_ALARM)
+
+    @property
+    def filter_timer(self) -> str:
+        """Time to filter replacement as a string with days, hours and minutes"""
+        value = self.values.get(protocol.FILTER_TIMER)
+        if value is None:
+            return None
+        hours, minutes = divmod(value, 60)
+        days, hours = divmod(hours, 24)
+        return f"{days} days {hours} hours {minutes} minutes"
+
+    @property
+    def rtc_battery_voltage(self) -> int:
+        """Voltage of the real time clock battery in mV"""
+        return self.values.get(protocol.CURRENT_RTC_BATTERY_VOLTAGE)
+
+    @property
+    def rtc_time(self) -> datetime.time:
+        return self.values.get(protocol.RTC_TIME)
+
+    @property
+    def rtc_date(self) -> datetime.date:
+        return self.values.get(protocol.RTC_CALENDAR)
+
+    @property
+    def alarm(self) -> int:
+        """0 - no alarm, 1 - alarm, 2 - warning"""
+        return self.values.get(protocol.READ_ALARM)
+
+    @property
+    def search_device_id(self) -> str:
+        return self.values.get(protocol.SEARCH)
+
+    @property
+    def firmware_version(self) -> str:
+        value = self.values.get(protocol.READ_FIRMWARE_VERSION)
+        if not isinstance(value, tuple):
+            return None
+        return f"{value[0]}.{value[1]}"
+
+    @property
+    def firmware_date(self) -> str:
+        value = self.values.get(protocol.READ_FIRMWARE_VERSION)
+        if not isinstance(value, tuple):
+            return None
+        return f"{value[2]}-{value[3]}-{value[4]}"
+
+    @property
+    def unit_type(self) -> int:
+        return self.values.get(protocol.UNIT_TYPE)
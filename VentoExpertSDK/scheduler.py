@@ -0,0 +1,100 @@
+# Implements the scheduling of status polls for the devices
+
+import heapq
+import itertools
+import random
+import threading
+import time
+
+# The fractional part of the golden ratio. Multiples of it modulo 1 spread
+# the first deadlines evenly over the interval for any number of devices
+_GOLDEN_RATIO = 0.6180339887498949
+
+
+class PollScheduler:
+    """Schedules the status polls of the devices.
+    Every device has its own poll interval. The first deadline of a device is
+    offset into the interval so the polls of many devices are spread evenly
+    over the interval instead of being sent in one burst. Every deadline is
+    jittered by a small random amount so several clients do not poll in lock step.
+    The deadlines are kept in a priority queue keyed by the next due time.
+    """
+
+    def __init__(self, interval: float = 1.0, jitter: float = 0.05):
+        self.interval = interval
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self._heap = []
+        self._entries = {}
+        self._sequence = itertools.count()
+        self._slot = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, device_id):
+        return device_id in self._entries
+
+    def add(self, device_id: str, interval: float = None, now: float = None):
+        """Schedule polling of a device. If the device is already scheduled it
+        is rescheduled with the new interval"""
+        if interval is None:
+            interval = self.interval
+        if now is None:
+            now = time.monotonic()
+        offset = (next(self._slot) * _GOLDEN_RATIO) % 1.0
+        with self._lock:
+            self.__push(device_id, now + offset * interval, interval)
+
+    def remove(self, device_id: str):
+        """Stop polling a device"""
+        with self._lock:
+            # the heap entry is skipped when it is popped
+            self._entries.pop(device_id, None)
+
+    def interval_of(self, device_id: str) -> float:
+        """Return the poll interval of a device or None if it is not scheduled"""
+        entry = self._entries.get(device_id)
+        return entry[1] if entry is not None else None
+
+    def next_deadline(self) -> float:
+        """Return the time.monotonic() time of the next poll or None if no
+        device is scheduled"""
+        with self._lock:
+            self.__drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float = None) -> list:
+        """Return the device ids that are due for a poll and schedule their next poll"""
+        if now is None:
+            now = time.monotonic()
+        due = []
+        with self._lock:
+            while True:
+                self.__drop_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    return due
+                _, _, device_id = heapq.heappop(self._heap)
+                nominal, interval, _ = self._entries[device_id]
+                due.append(device_id)
+                nominal += interval
+                if nominal <= now:
+                    # we are behind. Skip the missed polls instead of sending them in a burst
+                    nominal += ((now - nominal) // interval + 1) * interval
+                self.__push(device_id, nominal, interval)
+
+    def __push(self, device_id: str, nominal: float, interval: float):
+        """Push the next deadline for a device. Must be called with the lock held"""
+        token = next(self._sequence)
+        self._entries[device_id] = (nominal, interval, token)
+        deadline = nominal + random.uniform(-self.jitter, self.jitter) * interval
+        heapq.heappush(self._heap, (deadline, token, device_id))
+
+    def __drop_stale(self):
+        """Remove heap entries for removed or rescheduled devices. Must be called with the lock held"""
+        while self._heap:
+            _, token, device_id = self._heap[0]
+            entry = self._entries.get(device_id)
+            if entry is not None and entry[2] == token:
+                return
+            heapq.heappop(self._heap)
@@ -0,0 +1,484 @@
+# Implements a simulator of Blauberg Vento Expert devices on the local host for testing and benchmarks
+
+import argparse
+import heapq
+import random
+import socket
+import threading
+import time
+
+from datetime import datetime
+
+from .ventoPacket import VentoExpertPacket
+from VentoExpertSDK import ventoProtocol as protocol
+
+# unit type -> the parameters of the unit type
+UNIT_TYPES = {
+    3: protocol.VENTO_EXPERT_A50_1_W_V2_PARAMETERS,
+    4: protocol.VENTO_EXPERT_DUO_A30_1_W_V2_PARAMETERS,
+    5: protocol.VENTO_EXPERT_A30_W_V2_PARAMETERS,
+}
+
+# the special commands are in the parameter lists but are not parameters
+_SPECIAL_COMMANDS = frozenset((
+    protocol.SC_CHANGE_FUNCTION_NUMBER,
+    protocol.SC_PARAMETER_NOT_SUPPORTED,
+    protocol.SC_CHANGE_VALUE_SIZE,
+    protocol.SC_CHANGE_HIGH_BYTE,
+))
+
+# parameters that can not be written
+_READ_ONLY = frozenset((
+    protocol.BOOST_MODE_STATUS,
+    protocol.TIMER_COUNTDOWN,
+    protocol.CURRENT_RTC_BATTERY_VOLTAGE,
+    protocol.CURRENT_HUMIDITY,
+    protocol.CURRENT_ZERO_10V_SENSOR_VALUE,
+    protocol.CURRENT_REALY_SENSOR_STATE,
+    protocol.FAN1RPM,
+    protocol.FAN2RPM,
+    protocol.FILTER_TIMER,
+    protocol.SEARCH,
+    protocol.MACHINE_HOURS,
+    protocol.READ_ALARM,
+    protocol.READ_FIRMWARE_VERSION,
+    protocol.FILTER_ALARM,
+    protocol.CURRENT_IP_ADDRESS,
+    protocol.UNIT_TYPE,
+    protocol.HUMIDITY_SETPOINT_STATUS,
+    protocol.ZERO_10V_SENSOR_STATUS,
+))
+
+# the values of a new fan that are not computed from the time
+_DEFAULTS = {
+    protocol.ON_OFF: 1,
+    protocol.SPEED: protocol.SPEED_LOW,
+    protocol.TIMER_MODE: 0,
+    protocol.HUMIDITY_SENSOR: 1,
+    protocol.HUMIDITY_THRESHOLD_SETPOINT: 60,
+    protocol.CURRENT_RTC_BATTERY_VOLTAGE: 3000,
+    protocol.MANUAL_SPEED: 128,
+    protocol.FILTER_REPLACEMENT_TIME: 90,
+    protocol.BOST_MODE_DEACTIVATION_SETPOINT: 30,
+    protocol.DEVICE_PASSWORD: "1111",
+    protocol.READ_FIRMWARE_VERSION: bytes((0, 11, 1, 3, 0xE6, 0x07)),     # 0.11 1-3-2022
+    protocol.WIFI_CLIENT_NAME: "simulator",
+    protocol.WIFI_PASSWORD: "",
+    protocol.ASSIGNED_IP_SUBNET_MASK: bytes((255, 255, 255, 0)),
+    protocol.VENTILATION_MODE: 0,
+    protocol.ZERO_10V_SENSOR_THRESHOLD: 50,
+    protocol.NIGHT_MODE_TIMER_SETPOINT: bytes((0, 8)),
+    protocol.PARTY_MODE_TIMER_SETPOINT: bytes((0, 4)),
+}
+
+# rpm of the fan at each speed
+_SPEED_RPM = {protocol.SPEED_LOW: 900, protocol.SPEED_MEDIUM: 1300, protocol.SPEED_HIGH: 1800}
+
+
+class VirtualFan:
+    """A simulated device with the parameters of its unit type.
+    The values that change by themselves (rpm, humidity, filter timer,
+    machine hours and the clock) are computed from the time when they are read"""
+
+    def __init__(self, device_id: str, password: str = "1111", unit_type: int = 3, ip_address: str = None, drift: float = 1.0, seed=None):
+        self.device_id = device_id
+        self.unit_type = unit_type
+        self.parameters = frozenset(UNIT_TYPES[unit_type]) - _SPECIAL_COMMANDS
+        self.drift = drift
+        self._random = random.Random(seed if seed is not None else device_id)
+        self._started = time.time()
+        self._humidity = 40 + self._random.randint(0, 20)
+        self._humidity_at = self._started
+        self._filter_minutes = 90 * 24 * 60
+        self._filter_reset_at = self._started
+        self._clock_offset = 0.0
+        self.values = {}        # parameter -> value bytes of the parameters that are not computed
+        for parameter, value in _DEFAULTS.items():
+            if parameter in self.parameters:
+                self.values[parameter] = VentoExpertPacket.encode_value(parameter, value)
+        self.values[protocol.UNIT_TYPE] = VentoExpertPacket.encode_value(protocol.UNIT_TYPE, unit_type)
+        self.password = password
+        if ip_address is not None:
+            self.values[protocol.CURRENT_IP_ADDRESS] = socket.inet_aton(ip_address)
+
+    @property
+    def password(self) -> str:
+        return self.values[protocol.DEVICE_PASSWORD].decode("ascii")
+
+    @password.setter
+    def password(self, password: str):
+        self.values[protocol.DEVICE_PASSWORD] = password.encode("ascii")
+
+    def value(self, parameter: int) -> int:
+        """Return the value of a parameter as an integer"""
+        return int.from_bytes(self.read(parameter), "little")
+
+    def read(self, parameter: int) -> bytes:
+        """Return the value bytes of a parameter. None if it is not supported"""
+        if parameter not in self.parameters:
+            return None
+        if parameter == protocol.FAN1RPM:
+            return self.__rpm(1.0)
+        if parameter == protocol.FAN2RPM:
+            # only the duo has a second fan
+            return self.__rpm(1.0 if self.unit_type == 4 else 0.0)
+        if parameter == protocol.CURRENT_HUMIDITY:
+            return bytes((self.__humidity(),))
+        if parameter == protocol.FILTER_TIMER:
+            minutes = max(0, self._filter_minutes - int((time.time() - self._filter_reset_at) // 60))
+            return bytes((minutes % 60, minutes // 60 % 24, min(255, minutes // 1440)))
+        if parameter == protocol.FILTER_ALARM:
+            return bytes((int(time.time() - self._filter_reset_at >= self._filter_minutes * 60),))
+        if parameter == protocol.MACHINE_HOURS:
+            minutes = int((time.time() - self._started) // 60)
+            return bytes((minutes % 60, minutes // 60 % 24)) + (minutes // 1440).to_bytes(2, "little")
+        if parameter == protocol.RTC_TIME:
+            clock = datetime.fromtimestamp(time.time() + self._clock_offset)
+            return bytes((clock.second, clock.minute, clock.hour))
+        if parameter == protocol.RTC_CALENDAR:
+            clock = datetime.fromtimestamp(time.time() + self._clock_offset)
+            return bytes((clock.day, clock.isoweekday(), clock.month, clock.year % 100))
+        if parameter == protocol.SEARCH:
+            return self.device_id.encode("ascii")
+        value = self.values.get(parameter)
+        if value is None:
+            size = protocol.PARAMETER_SIZE.get(parameter) or 1
+            value = bytes(size)
+        return value
+
+    def write(self, parameter: int, value: bytes, function: int = protocol.WRITE) -> bool:
+        """Write a parameter. function is WRITE, INCREAD or DECREAD.
+        Returns False if the parameter is not supported"""
+        if parameter not in self.parameters:
+            return False
+        if parameter in _READ_ONLY:
+            return True
+        if function in (protocol.INCREAD, protocol.DECREAD):
+            current = self.value(parameter)
+            step = 1 if function == protocol.INCREAD else -1
+            size = len(self.read(parameter))
+            value = max(0, min(current + step, (1 << (8 * size)) - 1)).to_bytes(size, "little")
+        elif parameter == protocol.ON_OFF and value == b"\x02":
+            # invert
+            value = bytes((1 - self.value(protocol.ON_OFF),))
+        if parameter == protocol.RESET_FILTER_TIMER:
+            self._filter_reset_at = time.time()
+            return True
+        if parameter == protocol.RTC_TIME or parameter == protocol.RTC_CALENDAR:
+            self.__set_clock(parameter, value)
+            return True
+        self.values[parameter] = bytes(value)
+        return True
+
+    def __rpm(self, factor: float) -> bytes:
+        if self.value(protocol.ON_OFF) == 0 or factor == 0:
+            return bytes(2)
+        speed = self.value(protocol.SPEED)
+        rpm = _SPEED_RPM.get(speed) or 500 + self.value(protocol.MANUAL_SPEED) * 1300 // 255
+        rpm = int(rpm * factor + self._random.gauss(0, 10) * self.drift)
+        return max(0, min(5000, rpm)).to_bytes(2, "little")
+
+    def __humidity(self) -> int:
+        """A random walk of a step a minute"""
+        now = time.time()
+        steps = int((now - self._humidity_at) // 60) if self.drift else 0
+        if steps:
+            self._humidity_at += steps * 60
+            for _ in range(min(steps, 1000)):
+                self._humidity = max(20, min(90, self._humidity + self._random.choice((-1, 0, 1))))
+        return self._humidity
+
+    def __set_clock(self, parameter: int, value: bytes):
+        """Keep the clock as an offset to the time of the host"""
+        clock = datetime.fromtimestamp(time.time() + self._clock_offset)
+        try:
+            if parameter == protocol.RTC_TIME:
+                clock = clock.replace(hour=value[2], minute=value[1], second=value[0])
+            else:
+                clock = clock.replace(year=2000 + value[3], month=value[2], day=value[0])
+        except (IndexError, ValueError):
+            return
+        self._clock_offset = clock.timestamp() - time.time()
+
+
+def parse_request(data: bytes) -> tuple:
+    """Return (device id, password, [(function, parameter, value bytes)]) of a
+    request packet. The value is None for a read. None if the packet is invalid"""
+    size = len(data)
+    if size < 8 or data[0] != protocol.PACKET_START_CHARACTER or data[1] != protocol.PACKET_START_CHARACTER or data[2] != protocol.PROTOCOL_TYPE:
+        return None
+    end = size - 2
+    if sum(data[2: end]) & 0xFFFF != data[end] + (data[end + 1] << 8):
+        return None
+    id_end = 4 + data[3]
+    if id_end >= end:
+        return None
+    pos = id_end + 1 + data[id_end]
+    if pos >= end:
+        return None
+    device_id = data[4: id_end].decode("ascii", "replace")
+    password = data[id_end + 1: pos].decode("ascii", "replace")
+    function = data[pos]
+    pos += 1
+    page = 0
+    requests = []
+    while pos < end:
+        byte = data[pos]
+        if byte == protocol.SC_CHANGE_HIGH_BYTE:
+            page = data[pos + 1] if pos + 1 < end else 0
+            pos += 2
+            continue
+        if byte == protocol.SC_CHANGE_FUNCTION_NUMBER:
+            function = data[pos + 1] if pos + 1 < end else function
+            pos += 2
+            continue
+        size = 1
+        if byte == protocol.SC_CHANGE_VALUE_SIZE:
+            if pos + 2 >= end:
+                return None
+            size = data[pos + 1]
+            pos += 2
+        parameter = (page << 8) | data[pos]
+        pos += 1
+        value = None
+        if function != protocol.READ:
+            if function in (protocol.INCREAD, protocol.DECREAD) and byte != protocol.SC_CHANGE_VALUE_SIZE:
+                # increment and decrement have no value
+                size = 0
+            if pos + size > end:
+                # the value is cut off by the checksum
+                return None
+            value = data[pos: pos + size]
+            pos += size
+        requests.append((function, parameter, value))
+    return device_id, password, requests
+
+
+def build_response(device_id: str, password: str, values) -> bytes:
+    """Return a response packet for a list of (parameter, value bytes).
+    A value of None is a parameter that is not supported"""
+    data = bytearray((protocol.PACKET_START_CHARACTER, protocol.PACKET_START_CHARACTER, protocol.PROTOCOL_TYPE, len(device_id)))
+    data += device_id.encode("ascii")
+    data.append(len(password))
+    data += password.encode("ascii")
+    data.append(protocol.RESPONSE)
+    page = 0
+    for parameter, value in values:
+        if parameter >> 8 != page:
+            page = parameter >> 8
+            data += bytes((protocol.SC_CHANGE_HIGH_BYTE, page))
+        if value is None:
+            data += bytes((protocol.SC_PARAMETER_NOT_SUPPORTED, parameter & 0xFF))
+            continue
+        if len(value) != 1:
+            data += bytes((protocol.SC_CHANGE_VALUE_SIZE, len(value)))
+        data.append(parameter & 0xFF)
+        data += value
+    checksum = sum(data[2:]) & 0xFFFF
+    data += bytes((checksum & 0xFF, checksum >> 8))
+    return bytes(data)
+
+
+class FanSimulator:
+    """Simulates any number of devices behind one UDP socket.
+    The requests are answered like the devices do: the search broadcast by
+    every fan, READ, WRITEREAD, INCREAD and DECREAD with a response and
+    WRITE without one. A request with a wrong password is not answered.
+    The responses can be delayed by latency plus a random jitter and a
+    response is lost with the probability loss. The answers to a search are
+    spread over search_window seconds like the answers of real devices.
+    The simulator listens on host, so a client on the same host sends to
+    host as the ip address of the devices. Search with
+    client.discover(interfaces=[simulator.host + "/32"]) as the broadcast of
+    the client is not received by a socket bound to one address.
+
+        with FanSimulator(count=1000) as simulator:
+            client = VentoClient()
+            for device_id in simulator.fans:
+                client.add_device(device_id, ip_address=simulator.host)
+    """
+
+    def __init__(
+        self,
+        count: int = 0,
+        host: str = "127.0.0.2",
+        port: int = 4000,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        loss: float = 0.0,
+        search_window: float = 0.2,
+        unit_types=(3,),
+        drift: float = 1.0,
+        seed=None,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.search_window = search_window
+        self.drift = drift
+        self.fans = {}          # device id -> VirtualFan
+        self.requests = 0
+        self.responses = 0
+        self.lost = 0
+        self._random = random.Random(seed)
+        self._sock = None
+        self._running = False
+        self._thread = None
+        self._delayed = []      # heap of (time to send, sequence, data, address)
+        self._sequence = 0
+        self._delayed_wakeup = threading.Condition()
+        self._sender = None
+        self.add_fans(count, unit_types)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add_fan(self, device_id: str, password: str = "1111", unit_type: int = 3) -> VirtualFan:
+        """Add a fan. Returns the fan"""
+        fan = VirtualFan(device_id, password, unit_type, self.host, self.drift, seed=self._random.random())
+        self.fans[device_id] = fan
+        return fan
+
+    def add_fans(self, count: int, unit_types=(3,), first: int = None) -> list:
+        """Add count fans with the ids following the fans already added or
+        numbered from first. The unit types are used in turn. Returns the fans"""
+        if first is None:
+            first = len(self.fans)
+        unit_types = tuple(unit_types)
+        return [
+            self.add_fan(f"{number:016X}", unit_type=unit_types[number % len(unit_types)])
+            for number in range(first, first + count)
+        ]
+
+    def start(self):
+        """Open the socket and answer the requests in a thread"""
+        if self._running:
+            return
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 21)
+        self._sock.bind((self.host, self.port))
+        self._sock.settimeout(0.2)
+        self._running = True
+        self._thread = threading.Thread(target=self.__receive_fn, daemon=True)
+        self._thread.start()
+        self._sender = threading.Thread(target=self.__delayed_fn, daemon=True)
+        self._sender.start()
+
+    def close(self):
+        """Stop answering and close the socket"""
+        if not self._running:
+            return
+        self._running = False
+        with self._delayed_wakeup:
+            self._delayed_wakeup.notify()
+        self._thread.join()
+        self._sender.join()
+        self._sock.close()
+
+    def handle(self, data: bytes) -> list:
+        """Return the response packets for a request packet"""
+        request = parse_request(data)
+        if request is None:
+            return []
+        device_id, password, requests = request
+        if device_id == "DEFAULT_DEVICEID":
+            # the search is answered by every fan
+            return [build_response(fan.device_id, "", [(protocol.SEARCH, fan.read(protocol.SEARCH))]) for fan in self.fans.values()]
+        fan = self.fans.get(device_id)
+        if fan is None or password != fan.password:
+            return []
+        values = []
+        answer = False
+        for function, parameter, value in requests:
+            if function != protocol.READ:
+                supported = fan.write(parameter, value, function)
+                if function == protocol.WRITE:
+                    continue
+                values.append((parameter, fan.read(parameter) if supported else None))
+            else:
+                values.append((parameter, fan.read(parameter)))
+            answer = True
+        if not answer:
+            return []
+        return [build_response(fan.device_id, fan.password, values)]
+
+    def __receive_fn(self):
+        while self._running:
+            try:
+                data, address = self._sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.requests += 1
+            responses = self.handle(data)
+            spread = self.search_window if len(responses) > 1 else 0.0
+            for response in responses:
+                if self.loss and self._random.random() < self.loss:
+                    self.lost += 1
+                    continue
+                delay = self.latency + self._random.random() * (self.jitter + spread)
+                if delay > 0:
+                    self.__send_later(time.monotonic() + delay, response, address)
+                else:
+                    self.__send(response, address)
+
+    def __send(self, data: bytes, address):
+        try:
+            self._sock.sendto(data, address)
+            self.responses += 1
+        except OSError:
+            # e.g. the client closed its socket
+            pass
+
+    def __send_later(self, when: float, data: bytes, address):
+        with self._delayed_wakeup:
+            self._sequence += 1
+            heapq.heappush(self._delayed, (when, self._sequence, data, address))
+            if self._delayed[0][1] == self._sequence:
+                self._delayed_wakeup.notify()
+
+    def __delayed_fn(self):
+        """Send the delayed responses when they are due"""
+        while self._running:
+            with self._delayed_wakeup:
+                while self._running and (not self._delayed or self._delayed[0][0] > time.monotonic()):
+                    self._delayed_wakeup.wait(None if not self._delayed else self._delayed[0][0] - time.monotonic())
+                due = []
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    due.append(heapq.heappop(self._delayed))
+            for _, _, data, address in due:
+                self.__send(data, address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate Blauberg Vento Expert devices")
+    parser.add_argument("--fans", type=int, default=100)
+    parser.add_argument("--host", default="127.0.0.2")
+    parser.add_argument("--first", type=int, default=0, help="number of the id of the first fan")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds")
+    parser.add_argument("--loss", type=float, default=0.0, help="probability of losing a response")
+    arguments = parser.parse_args()
+    simulator = FanSimulator(0, arguments.host, latency=arguments.latency, jitter=arguments.jitter, loss=arguments.loss)
+    simulator.add_fans(arguments.fans, UNIT_TYPES, arguments.first)
+    with simulator:
+        print(f"Simulating {len(simulator.fans)} fans on {simulator.host}:{simulator.port}. The password is 1111", flush=True)
+        try:
+            while True:
+                time.sleep(10)
+                print(f"requests: {simulator.requests} responses: {simulator.responses} lost: {simulator.lost}")
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
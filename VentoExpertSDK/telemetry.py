@@ -0,0 +1,169 @@
+# Implements recording of the telemetry from the devices in fixed size ring buffers
+
+import bisect
+import math
+import threading
+import time
+
+from array import array
+
+from VentoExpertSDK import ventoProtocol as protocol
+
+# field name -> function returning the value of the field from a device
+FIELDS = {
+    "speed": lambda device: device.speed,
+    "manualspeed": lambda device: device.manualspeed,
+    "fan1rpm": lambda device: device.fan1rpm,
+    "fan2rpm": lambda device: device.fan2rpm,
+    "humidity": lambda device: device.humidity,
+    "filter_timer": lambda device: device.parameters.get(protocol.FILTER_TIMER),    # minutes
+}
+
+# the parameters a packet must have for a sample to be recorded
+PARAMETERS = frozenset((
+    protocol.ON_OFF,
+    protocol.SPEED,
+    protocol.MANUAL_SPEED,
+    protocol.FAN1RPM,
+    protocol.FAN2RPM,
+    protocol.CURRENT_HUMIDITY,
+    protocol.FILTER_TIMER,
+))
+
+
+class TelemetrySeries:
+    """The samples of one device in ring buffers of doubles, so the values
+    are returned as floats. A missing value is stored as NaN. When the buffers are full the oldest
+    sample is overwritten so the memory used never grows"""
+
+    def __init__(self, capacity: int, fields):
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self.times = array("d", [math.nan]) * capacity
+        self.values = {field: array("d", [math.nan]) * capacity for field in self.fields}
+        self.count = 0          # number of samples written since the start
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp: float, values: dict):
+        """Append a sample. values is field -> value, None for a missing value"""
+        index = self.count % self.capacity
+        self.times[index] = timestamp
+        for field in self.fields:
+            value = values.get(field)
+            self.values[field][index] = math.nan if value is None else value
+        self.count += 1
+
+    def ordered(self, field: str = None) -> array:
+        """Return the times, or the values of the field, oldest first"""
+        data = self.times if field is None else self.values[field]
+        if self.count <= self.capacity:
+            return data[:self.count]
+        head = self.count % self.capacity
+        return data[head:] + data[:head]
+
+
+class TelemetryRecorder:
+    """Records the telemetry of the devices of a client.
+    Every device has ring buffers with room for capacity samples, so the
+    memory used is fixed no matter how long the client runs.
+    Give the recorder to the client and a sample is recorded every time a
+    status response is received from a device.
+    """
+
+    def __init__(self, capacity: int = 3600, fields=tuple(FIELDS)):
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def __contains__(self, device_id):
+        return device_id in self._series
+
+    def device_ids(self) -> list:
+        """Return the ids of the devices with samples"""
+        with self._lock:
+            return list(self._series)
+
+    def record(self, device, timestamp: float = None):
+        """Record a sample with the current values of the device"""
+        if timestamp is None:
+            timestamp = time.time()
+        values = {field: FIELDS[field](device) for field in self.fields}
+        with self._lock:
+            series = self._series.get(device.device_id)
+            if series is None:
+                series = self._series[device.device_id] = TelemetrySeries(self.capacity, self.fields)
+            series.append(timestamp, values)
+
+    def remove(self, device_id: str):
+        """Remove the samples of a device"""
+        with self._lock:
+            self._series.pop(device_id, None)
+
+    def samples(self, device_id: str, start: float = None, end: float = None) -> dict:
+        """Return the samples of a device with a time from start up to but not
+        including end as {"time": [...], field: [...]}. None is a missing value"""
+        with self._lock:
+            series = self._series.get(device_id)
+            if series is None:
+                return {"time": [], **{field: [] for field in self.fields}}
+            times = series.ordered()
+            first, last = self.__window(times, start, end)
+            result = {"time": list(times[first:last])}
+            for field in self.fields:
+                result[field] = [None if math.isnan(value) else value for value in series.ordered(field)[first:last]]
+        return result
+
+    def latest(self, device_id: str) -> dict:
+        """Return the last sample of a device as {"time": ..., field: ...}. None if no samples"""
+        with self._lock:
+            series = self._series.get(device_id)
+            if series is None or series.count == 0:
+                return None
+            index = (series.count - 1) % series.capacity
+            sample = {"time": series.times[index]}
+            for field in self.fields:
+                value = series.values[field][index]
+                sample[field] = None if math.isnan(value) else value
+        return sample
+
+    def downsample(self, device_id: str, field: str, interval: float, start: float = None, end: float = None) -> list:
+        """Return the samples of a field in buckets of interval seconds from start
+        up to end as a list of (bucket start, min, max, mean, count).
+        Buckets without values are left out"""
+        with self._lock:
+            series = self._series.get(device_id)
+            if series is None:
+                return []
+            times = series.ordered()
+            first, last = self.__window(times, start, end)
+            times = times[first:last]
+            values = series.ordered(field)[first:last]
+        if not times:
+            return []
+        origin = times[0] if start is None else start
+        buckets = []
+        bucket = None
+        for timestamp, value in zip(times, values):
+            if math.isnan(value):
+                continue
+            number = int((timestamp - origin) // interval)
+            if bucket is None or bucket[0] != number:
+                bucket = [number, value, value, 0.0, 0]
+                buckets.append(bucket)
+            if value < bucket[1]:
+                bucket[1] = value
+            if value > bucket[2]:
+                bucket[2] = value
+            bucket[3] += value
+            bucket[4] += 1
+        return [(origin + number * interval, low, high, total / count, count) for number, low, high, total, count in buckets]
+
+    @staticmethod
+    def __window(times: array, start: float, end: float) -> tuple:
+        """Return the first and last index of the times in the window"""
+        first = 0 if start is None else bisect.bisect_left(times, start)
+        last = len(times) if end is None else bisect.bisect_left(times, end)
+        return first, last
@@ -1,38 +1,106 @@
 # Implements a client for making a UDP connection to the Blauberg Vento Expert devices
 
+import queue
+import select
+import selectors
 import socket
 import threading
 import time
 
-from socket import SOL_SOCKET, SO_REUSEADDR, SO_BROADCAST
+from socket import SOL_SOCKET, SO_REUSEADDR, SO_BROADCAST, SO_RCVBUF
 
+from .clientbase import VentoClientBase
+from .command import Command, CommandGroup
 from .device import Device, Mode
+from .dispatcher import ChangeDispatcher
+from .metrics import MetricsRegistry
+from .registry import DeviceRegistry
+from .archive import TelemetryArchive
+from .telemetry import TelemetryRecorder
 from .ventoPacket import VentoExpertPacket
 from .responsepacket import ResponsePacket
 from VentoExpertSDK import ventoProtocol as protocol
 
+# datagrams read from a socket per wakeup before the command timeouts are checked again
+RECEIVE_BATCH = 256
+# receive buffer in bytes, room for the answers of many devices at once e.g. to validate_devices()
+RECEIVE_BUFFER = 1 << 20
 
-class VentoClient:
+
+class VentoClient(VentoClientBase):
     """ Client object for making connection to the Blauberg Vento Expert devices """
 
     _mutex = threading.Lock()
 
-    def __init__(self):
-        self._devices = {}
+    def __init__(
+        self,
+        command_timeout: float = 2.0,
+        poll_interval: float = 1.0,
+        dispatcher: ChangeDispatcher = None,
+        interfaces=None,
+        registry: DeviceRegistry = None,
+        telemetry: TelemetryRecorder = None,
+        archive: TelemetryArchive = None,
+        metrics: MetricsRegistry = None,
+        retries: int = 0,
+        retry_interval: float = 0.2,
+    ):
+        """The onchange callbacks of the devices are called by the dispatcher.
+        Default is a dispatcher with one worker thread.
+        interfaces is a list of CIDRs or NetworkInterface to search for devices
+        on, e.g. network.local_interfaces(). Default is the broadcast on the
+        default interface.
+        The devices in the registry are added at once and the registry is
+        updated with the devices of the client while it runs.
+        The telemetry recorder and the archive record a sample for every status response.
+        The packets, errors and latencies are counted in metrics. Default is a
+        new MetricsRegistry.
+        A command that is not confirmed is sent again up to retries times,
+        first after retry_interval and then with a doubled interval until
+        the command timeout. Default is no retransmissions
+        The responses are decoded and applied in order by the notify thread"""
+        super().__init__(command_timeout, poll_interval, interfaces, registry, telemetry, archive, metrics, retries, retry_interval)
+        self._owns_dispatcher = dispatcher is None
+        self.dispatcher = dispatcher if dispatcher is not None else ChangeDispatcher()
         self._sock = None
-        self._socket_listening = False
+        self._socket_listening = threading.Event()     # set while the socket is open
+        self._selector = selectors.DefaultSelector()
+        # a byte written to the wakeup socket ends the receive loop. It is never read
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
 
-        self._notifyrunning = False
+        self._notifyrunning = True
         self._notifythread = threading.Thread(target=self.__notify_fn)
         self._notifythread.start()
-        self._found_device_callback = None
+        self._pollrunning = True
+        self._pollwakeup = threading.Event()
+        self._pollthread = threading.Thread(target=self.__poll_fn)
+        self._pollthread.start()
         self._speed = None
 
     def close(self):
-        """Close the client and end the notify thread to end. Wait for the
-        thread to end."""
+        """Close the client and end the notify and poll threads. Wait for the
+        threads to end."""
+        self._pollrunning = False
+        self._pollwakeup.set()
+        self._pollthread.join()
         self._notifyrunning = False
+        self._wakeup_writer.send(b"\0")
         self._notifythread.join()
+        self._selector.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+        try:
+            if self._registry is not None:
+                self.__save_registry(True)
+        finally:
+            try:
+                if self.archive is not None:
+                    self.archive.flush()
+            finally:
+                # the change threads end even if the samples can not be written
+                if self._owns_dispatcher:
+                    self.dispatcher.close()
 
     def add_device(
         self,
@@ -40,104 +108,143 @@ class VentoClient:
         password: str = None,
         ip_address: str = "<broadcast>",
         onchange=None,
+        poll_interval: float = None,
     ) -> Device:
         """Add a new device. If the device already exist the current one will
-        be returned"""
-        device: Device = self.get_device(device_id)
-        if device is None:
-            device = Device(device_id, password, ip_address, onchange)
-            self._devices[device_id] = device
-        packet = VentoExpertPacket()
-        packet.initialize_get_firmware_cmd(device)
-        self.__send_data(device, packet.data)
-        return device
-
-    def remove_device(self, device_id):
-        """Remove an existing device"""
-        device: Device = self.get_device(device_id)
-        if device is not None:
-            del self._devices[device_id]
-        return device
-
-    def get_device(self, device_id: str) -> Device:
-        """Get a device by device id."""
-        if device_id not in self._devices:
-            return None
-        return self._devices[device_id]
-
-    def get_device_count(self):
-        """Return the number of devices"""
-        return len(self._devices)
+        be returned.
+        The device status is polled every poll_interval seconds. Default is the
+        poll interval of the client"""
+        return self._add_device(device_id, password, ip_address, onchange, poll_interval)
 
     ''' Searches the local network for Blauberg compatible devices
     def get_device_commands(self, device_id: str):'''
     def search_devices(self, callback):
         self._found_device_callback = callback
-        packet = VentoExpertPacket()
-        packet.initialize_search_cmd()
-        self.__wait_for_socket()
-        with VentoClient._mutex:
-            self._sock.sendto(packet.data, ("<broadcast>", 4000))
+        self.__send_search(self._search_addresses(None))
+
+    def discover(self, timeout: float = 1.0, until_count: int = None, repeats: int = 3, interfaces=None) -> dict:
+        """Search the local network for devices for up to timeout seconds.
+        Returns early when until_count devices have answered.
+        Returns a dict of device id -> ip address"""
+        return dict(self.discover_iter(timeout, until_count, repeats, interfaces))
+
+    def discover_iter(self, timeout: float = 1.0, until_count: int = None, repeats: int = 3, interfaces=None):
+        """Search the local network for devices for up to timeout seconds.
+        Yields (device id, ip address) for every device as soon as it answers.
+        The search is broadcast repeats times spread over the timeout as the
+        broadcast or the answers can be lost. Every device is yielded once.
+        The search is sent to the broadcast address of every interface in
+        interfaces, a list of CIDRs or NetworkInterface. Default is the
+        interfaces of the client. Use interface_of() to get the interface
+        a device answered on"""
+        addresses = self._search_addresses(interfaces)
+        found = queue.SimpleQueue()
+
+        def listener(device_id: str, ip_address: str):
+            found.put((device_id, ip_address))
+
+        seen = set()
+        self._add_search_listener(listener)
+        try:
+            start = time.monotonic()
+            deadline = start + timeout
+            repeats = max(1, repeats)
+            sent = 0
+            while until_count is None or len(seen) < until_count:
+                now = time.monotonic()
+                if now >= deadline:
+                    return
+                if sent < repeats and now >= start + sent * timeout / repeats:
+                    self.__send_search(addresses)
+                    sent += 1
+                    continue
+                wakeup = deadline if sent >= repeats else min(deadline, start + sent * timeout / repeats)
+                try:
+                    device_id, ip_address = found.get(timeout=max(0, wakeup - now))
+                except queue.Empty:
+                    continue
+                if device_id not in seen:
+                    seen.add(device_id)
+                    yield device_id, ip_address
+        finally:
+            self._remove_search_listener(listener)
 
-    def set_speed(self, device: Device, speed: int):
-        """Set the speed of the specified device"""
+    def set_speed(self, device: Device, speed: int) -> Command:
+        """Set the speed of the specified device.
+        Returns the command confirmed with the new speed"""
         if device.speed == speed:
-            return
+            return Command.confirmed(device.device_id, {protocol.SPEED: speed}, "speed")
         if speed == protocol.SPEED_OFF:
-            self.turn_off(device)
-            return
-        if device.speed == protocol.SPEED_OFF:
-            self.turn_on(device)
-            time.sleep(0.2)
+            return self.turn_off(device)
+        if device.speed is None or device.speed == protocol.SPEED_OFF:
+            self.__wait_for_confirmation(self.turn_on(device))
 
         packet = VentoExpertPacket()
         packet.initialize_speed_cmd(device, speed)
-        data = packet.data
-        self.__send_data(device, data)
+        return self._send_command(device, packet.data, [protocol.SPEED], "speed")
 
-    def set_manual_speed(self, device: Device, manualspeed: int):
-        """Set the manual speed of the specified device"""
-        if device.speed != protocol.MANUAL:
-            self.set_speed(device, protocol.MANUAL)
-            time.sleep(0.2)
+    def set_manual_speed(self, device: Device, manualspeed: int) -> Command:
+        """Set the manual speed of the specified device.
+        Returns the command confirmed with the new manual speed"""
+        if device.speed != protocol.SPEED_MANUAL:
+            self.__wait_for_confirmation(self.set_speed(device, protocol.SPEED_MANUAL))
 
         packet = VentoExpertPacket()
         packet.initialize_manualspeed_cmd(device, manualspeed)
-        data = packet.data
-        self.__send_data(device, data)
+        return self._send_command(device, packet.data, [protocol.MANUAL_SPEED], "manualspeed")
 
-    def turn_off(self, device: Device):
+    def turn_off(self, device: Device) -> Command:
         """Turn off the specified device"""
         if device.speed == protocol.SPEED_OFF:
-            return
+            return Command.confirmed(device.device_id, {protocol.ON_OFF: 0}, "off")
         packet = VentoExpertPacket()
         packet.initialize_off_cmd(device)
-        data = packet.data
-        self.__send_data(device, data)
+        return self._send_command(device, packet.data, [protocol.ON_OFF], "off")
 
-    def turn_on(self, device: Device):
+    def turn_on(self, device: Device) -> Command:
         """Turn on the specified device"""
-        if device.speed != protocol.SPEED_OFF:
-            return
+        # the state of a device without a status yet is unknown, so the command is always sent
+        if device.speed is not None and device.speed != protocol.SPEED_OFF:
+            return Command.confirmed(device.device_id, {protocol.ON_OFF: 1}, "on")
         packet = VentoExpertPacket()
         packet.initialize_on_cmd(device)
-        data = packet.data
-        self.__send_data(device, data)
+        return self._send_command(device, packet.data, [protocol.ON_OFF], "on")
 
-    def set_mode(self, device: Device, mode: Mode):
+    def set_mode(self, device: Device, mode: Mode) -> Command:
         """Set the mode of the specified device"""
-        if device.mode == Mode:
-            return
+        if device.mode == mode:
+            return Command.confirmed(device.device_id, {protocol.VENTILATION_MODE: mode}, "mode")
         packet = VentoExpertPacket()
         packet.initialize_mode_cmd(device, mode)
-        data = packet.data
-        self.__send_data(device, data)
+        return self._send_command(device, packet.data, [protocol.VENTILATION_MODE], "mode")
+
+    def apply(self, device: Device, on: bool = None, speed: int = None, manualspeed: int = None, mode: Mode = None,
+              reset_filter: bool = False) -> Command:
+        """Apply several settings in one packet, e.g. on at manual speed 150
+        in TWOWAY mode. A speed or manual speed also turns the device on.
+        The settings are written with WRITEREAD and the filter timer reset
+        with WRITE in the same packet.
+        Returns the command confirmed with the values written. Returns None if
+        only the filter timer is reset as the device does not answer that.
+        Raises ValueError for invalid settings before anything is sent"""
+        return self._apply(device, on, speed, manualspeed, mode, reset_filter)
+
+    def read(self, device: Device, parameters) -> CommandGroup:
+        """Read any parameters from ventoProtocol. The parameters are packed
+        into as few packets as possible.
+        Returns the commands confirmed with the values read"""
+        return self._read(device, parameters)
+
+    def write(self, device: Device, values: dict, function: int = protocol.WRITEREAD) -> CommandGroup:
+        """Write a dict of parameter -> value. The values are packed into as few
+        packets as possible.
+        Returns the commands confirmed with the values written. Returns None for
+        protocol.WRITE as the device does not answer that"""
+        return self._write(device, values, function)
 
     def reset_filter_alarm(self, device: Device):
         """Reset the filter alarm"""
-        packet = VentoExpertPacket()
-        packet.initialize_reset_filter_alarm_cmd(device)
-        self.__send_data(device, packet.data)
+        self._reset_filter_alarm(device)
 
     def validate_device(self, device_id: str, password: str = None, ip_address: str = "<broadcast>") -> Device:
         """Validate if a device exist and repsonds.
@@ -150,52 +257,93 @@ class VentoClient:
             return device
         device = self.add_device(device_id, password, ip_address)
         try:
-            self.__update_device_status(device)
+            self._send_status(device)
             # 4 sec timeout
-            timeout = time.time() + 4
-            while True:
-                if device.mode is not None:
-                    return device
-                if time.time() > timeout:
-                    break
-                time.sleep(0.1)
+            if device.wait_for_status(4):
+                return device
             return None
         finally:
             self.remove_device(device.device_id)
 
-    def __update_device_status(self, device: Device):
-        """Update the device status from the VentoClient
-        You should not call this youself
-        """
-        packet = VentoExpertPacket()
-        packet.initialize_status_cmd(device)
-        data = packet.data
-        self.__send_data(device, data)
-
-    def __update_all_device_status(self):
-        """Send an update command to all devices"""
-        for device_id in self._devices:
-            self.__update_device_status(self._devices[device_id])
+    def validate_devices(self, candidates, timeout: float = 4, add: bool = False) -> dict:
+        """Validate many devices at once. candidates are (device id, password,
+        ip address) tuples. The status and firmware requests and a search are
+        sent to all of them and the answers are awaited until one deadline.
+        Returns a dict of device id -> "ok" if the device answered the status,
+        "wrong_password" if it only answered the search or "silent".
+        The devices that are ok stay added to the client if add is True.
+        Devices already added to the client are not removed"""
+        deadline = time.monotonic() + timeout
+        searched = set()
+
+        def listener(device_id: str, ip_address: str):
+            searched.add(device_id)
+
+        added = []
+        devices = {}
+        results = {}
+        self._add_search_listener(listener)
+        try:
+            for device_id, password, ip_address in candidates:
+                device = self.get_device(device_id)
+                if device is None:
+                    device = self.add_device(device_id, password, ip_address or "<broadcast>")
+                    added.append(device_id)
+                devices[device_id] = device
+                self._send_status(device)
+            self.__send_search(list(dict.fromkeys(device.ip_address for device in devices.values())))
+            for device_id, device in devices.items():
+                answered = device.wait_for_status(max(0, deadline - time.monotonic()))
+                results[device_id] = self._validation_result(device_id, answered, searched)
+            return results
+        finally:
+            self._remove_search_listener(listener)
+            self._remove_validated(added, results, add)
 
-    def __send_data(self, device: Device, data):
+    def _send_data(self, device: Device, data):
         """Send a data packet to a device.
         Protect it with a mutex to prevent multiple threads doint it at the
         same time"""
         self.__wait_for_socket()
         with VentoClient._mutex:
-            self._sock.sendto(data, (device.ip_address, 4000))
+            self.__sendto(data, (device.ip_address, 4000))
+        self.metrics.packet_sent(data)
+
+    def __wait_for_confirmation(self, command: Command):
+        """Wait for a command a following command depends on. A missing
+        confirmation is not an error here, the following command will time
+        out by itself if the device does not respond"""
+        try:
+            command.result()
+        except TimeoutError:
+            pass
+
+    def __send_search(self, addresses: list):
+        """Broadcast the search command to the addresses"""
+        packet = VentoExpertPacket()
+        packet.initialize_search_cmd()
+        self.__wait_for_socket()
+        with VentoClient._mutex:
+            for address in addresses:
+                try:
+                    self.__sendto(packet.data, (address, 4000))
+                except OSError:
+                    # the interface of the address is down. Search the others
+                    continue
+                self.metrics.packet_sent(packet.data)
+
+    def __sendto(self, data, address):
+        """Send on the non-blocking socket. Wait for room if the send buffer is full"""
+        try:
+            self._sock.sendto(data, address)
+        except BlockingIOError:
+            select.select([], [self._sock], [], 1.0)
+            self._sock.sendto(data, address)
 
     def __wait_for_socket(self):
         """Wait for notify thread to create socket """
-        if self._socket_listening:
-            return
-        timeout = time.time() + 3
-        while True:
-            time.sleep(0.1)
-            if self._socket_listening:
-                return
-            if time.time() > timeout:
-                raise Exception("Timeout waiting for socket connection")
+        if not self._socket_listening.wait(3):
+            raise Exception("Timeout waiting for socket connection")
 
     def __print_data(self, data):
         """Print data in hex - for debugging purpose """
@@ -206,13 +354,20 @@ class VentoClient:
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self._sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
         self._sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+        self._sock.setsockopt(SOL_SOCKET, SO_RCVBUF, RECEIVE_BUFFER)
         self._sock.bind(("0.0.0.0", 4000))
-        self._sock.settimeout(1.0)
-        self._socket_listening = True
+        self._sock.setblocking(False)
+        self._selector.register(self._sock, selectors.EVENT_READ)
+        self._socket_listening.set()
 
     def __close_socket(self):
         """Close the socket"""
-        self._socket_listening = False
+        self._socket_listening.clear()
+        try:
+            self._selector.unregister(self._sock)
+        except (KeyError, ValueError):
+            # not registered or the socket was not created
+            pass
         try:
             self._sock.close()
             # pylint: disable=bare-except
@@ -224,108 +379,117 @@ class VentoClient:
         """Open the socket and retry with 1 sec interval in case of errors
         Skip if notify thread is not running.
         """
-        while self._notifyrunning and not self._socket_listening:
+        while self._notifyrunning and not self._socket_listening.is_set():
             try:
                 self.__open_socket()
             except OSError:
                 self.__close_socket()
                 # wait 1 sec and try again
-                time.sleep(1)
+                self.__pause(1)
+
+    def __pause(self, seconds: float):
+        """Sleep for seconds or until the client is closed"""
+        select.select([self._wakeup_reader], [], [], seconds)
 
     def __notify_fn(self):
         """Notify thread listening for responses from fan devices.
+        It waits for the socket with a selector and reads all the datagrams
+        queued at every wakeup. The commands time out at their deadlines.
         This will handle recreating of the socket in case of network errors
         """
-        self._notifyrunning = True
         try:
             while self._notifyrunning:
                 self.__open_socket_with_retry()
-                data, addr = self.__receive_data()
-                if data is None:
-                    continue
-                # print(''.join('{:02x}'.format(x) for x in data))
-                packet = ResponsePacket()
-                if not packet.initialize_from_data(data):
+                if not self._socket_listening.is_set():
                     continue
-                if packet.device_id not in self._devices:
-                    if (
-                        packet.search_device_id is not None
-                        and self._found_device_callback is not None
-                    ):
-                        self._found_device_callback(packet.search_device_id, addr[0])
-                    continue
-                device: Device = self._devices[packet.device_id]
-                ip_address = addr[0]
-                self.update_device(device, ip_address, packet)
+                for key, _ in self._selector.select(self.__select_timeout()):
+                    if key.fileobj is self._sock and not self.__receive_batch(self._sock):
+                        # recreate socket on error
+                        self.__close_socket()
+                        self.metrics.socket_recreated()
+                self._commands.expire()
         finally:
             self.__close_socket()
             self._notifyrunning = False
 
-    def __receive_data(self):
-        """Receive data from the socket.
-        If there is a timeout. Send an update command the the devices.
-        Return (None, None) where there is no data to process
-        """
-        try:
-            data, addr = self._sock.recvfrom(1024)
-            return (data, addr)
-        except socket.timeout:
+    def __select_timeout(self) -> float:
+        """Return the seconds until the next command times out. A command
+        sent while waiting has a deadline at least the command timeout later,
+        so the wait is never longer than that"""
+        deadline = self._commands.next_deadline()
+        if deadline is None:
+            return self._command_timeout
+        return min(max(0, deadline - time.monotonic()), self._command_timeout)
+
+    def __receive_batch(self, sock) -> bool:
+        """Handle the datagrams queued on the non-blocking socket, at most
+        RECEIVE_BATCH of them. Returns False on a socket error"""
+        for _ in range(RECEIVE_BATCH):
             try:
-                self.__update_all_device_status()
-            except socket.error:
-                # recreate soket on error
-                self.__close_socket()
-        except socket.error:
-            # recreate soket on error
-            self.__close_socket()
-        return (None, None)
+                data, addr = sock.recvfrom(1024)
+            except BlockingIOError:
+                return True
+            except OSError:
+                return False
+            self._handle_datagram(data, addr)
+        return True
+
+    def __poll_fn(self):
+        """Poll thread sending the status commands when the devices are due.
+        Polling is independent of the traffic on the socket"""
+        while self._pollrunning:
+            deadline = self._scheduler.next_deadline()
+            retry = self._commands.next_retry()
+            if retry is not None and (deadline is None or retry < deadline):
+                deadline = retry
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            self._pollwakeup.wait(timeout)
+            self._pollwakeup.clear()
+            if not self._pollrunning:
+                break
+            self.__send_retries()
+            for device_id in self._scheduler.pop_due():
+                device: Device = self.get_device(device_id)
+                if device is None or not self._socket_listening.is_set():
+                    # polls due while the socket is recreated are skipped
+                    continue
+                try:
+                    self._send_status(device)
+                    if not device.is_initialized():
+                        # e.g. a device restored from the registry without the firmware
+                        self._send_get_firmware(device)
+                except OSError:
+                    # the notify thread recreates the socket
+                    break
+            if self._registry is not None:
+                self.__save_registry(False)
+
+    def __send_retries(self):
+        """Send the commands that are due for a retransmission"""
+        for command in self._commands.pop_retries():
+            device: Device = self.get_device(command.device_id)
+            if device is None or not self._socket_listening.is_set():
+                continue
+            try:
+                self._send_data(device, command.packet)
+            except OSError:
+                # the notify thread recreates the socket
+                break
+            command._resent()
+            self.metrics.retransmitted(command)
+
+    def __save_registry(self, force: bool):
+        """Update the registry with the devices and save it when it is due"""
+        try:
+            if force or self._registry.save_due():
+                self._update_registry()
+                self._registry.save()
+        except OSError:
+            # the registry is saved again at the next interval
+            pass
 
     def update_device(self, device, ip_address: str, packet: ResponsePacket):
         """Update the device with data recieved. Called by the ventoClient"""
-        haschange = False
-        if device._ip_address is not None and ip_address != device._ip_address:
-            self._ip_address = ip_address
-            haschange = True
-        if packet.speed is not None and packet.speed != device._speed:
-            device._speed = packet.speed
-            haschange = True
-        if packet.manualspeed is not None and packet.manualspeed != device._manualspeed:
-            device._manualspeed = packet.manualspeed
-            haschange = True
-        if packet.mode is not None and packet.mode != device._mode:
-            device._mode = packet.mode
-            haschange = True
-
-        if (
-            packet.filter_alarm is not None
-            and packet.filter_alarm != device._filter_alarm
-        ):
-            device._filter_alarm = packet.filter_alarm
-            haschange = True
-
-        if (
-            packet.filter_timer is not None
-            and packet.filter_timer != device._filter_timer
-        ):
-            device._filter_timer = packet.filter_timer
-            haschange = True
-
-        if packet.humidity is not None and packet.humidity != device._humidity:
-            device._humidity = packet.humidity
-            haschange = True
-        if packet.firmware_version is not None:
-            device._firmware_version = packet.firmware_version
-        if packet.firmware_date is not None:
-            device._firmware_date = packet.firmware_date
-        if packet.unit_type is not None:
-            device._unit_type = packet.unit_type
-        if packet.fan1rpm is not None:
-            device._fan1rpm = packet.fan1rpm
-        if packet.fan2rpm is not None:
-            device._fan2rpm = packet.fan2rpm
+        haschange = self._update_device(device, ip_address, packet)
         if haschange and device._changeevent is not None:
-            device._changeevent(device)
-        # note we do not want the fan rpm to trigger change event because it
-        # changes all the time
-
-        return
+            self.dispatcher.submit(device.device_id, device._changeevent, device)
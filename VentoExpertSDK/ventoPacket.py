@@ -9,6 +9,20 @@ class VentoExpertPacket:
     """ building the UDP data packet to/from the device
     Packet: 0xFD 0xFD TYPE SIZE_ID ID SIZE PWD PWD FUNC DATA(parameter or parameter-value) Chksum_L Chksum_H"""
 
+    # the parameters read by the status command
+    STATUS_PARAMETERS = (
+        protocol.ON_OFF,
+        protocol.VENTILATION_MODE,
+        protocol.SPEED,
+        protocol.MANUAL_SPEED,
+        protocol.FAN1RPM,
+        protocol.FILTER_ALARM,
+        protocol.FILTER_TIMER,
+        protocol.CURRENT_HUMIDITY,
+    )
+
+    _search_packet = None
+
     def __init__(self):
         self._data = None
         self._pos = 0
@@ -19,89 +33,192 @@ class VentoExpertPacket:
         """Initialize a search command packet usingf the string "DEFAULT_DEVICEID" as the device ID
         "DEFAULT_DEVICEID" is a special device ID that Blauberg VEnto uses to search for devices on the network.
         The search is done by broadcasting the search command to the network on 255.255.255.255"""
-        self.__build_data("DEFAULT_DEVICEID", "")
-        self.__add_byte(protocol.READ)
-        self.__add_byte(protocol.SEARCH)
-        self.__add_checksum()
+        if VentoExpertPacket._search_packet is None:
+            self.__build_data("DEFAULT_DEVICEID", "")
+            self.__add_byte(protocol.READ)
+            self.__add_byte(protocol.SEARCH)
+            self.__add_checksum()
+            VentoExpertPacket._search_packet = bytes(self.data)
+        self.__use(VentoExpertPacket._search_packet)
 
     def initialize_speed_cmd(self, device: Device, speed: int):
         """Initialize a speed command packet to be sent to a device"""
-        self.__build_data(device.device_id, device.password)
-        self.__add_byte(protocol.WRITEREAD)
-        self.__add_byte(protocol.SPEED)
-        self.__add_byte(speed)
-        self.__add_checksum()
+        self.__use_template(device, protocol.WRITEREAD, protocol.SPEED, speed)
 
     def initialize_manualspeed_cmd(self, device: Device, manualspeed: int):
         """Initialize a manual speed command packet to be sent to a device
         The manuals speed is in the interval 0-255
         """
-        self.__build_data(device.device_id, device.password)
-        self.__add_byte(protocol.WRITEREAD)
-        self.__add_byte(protocol.MANUAL_SPEED)
-        self.__add_byte(manualspeed)
-        self.__add_checksum()
+        self.__use_template(device, protocol.WRITEREAD, protocol.MANUAL_SPEED, manualspeed)
 
     def initialize_mode_cmd(self, device: Device, mode: Mode):
         """Intialize a mode command packet to be sent to a device"""
-        self.__build_data(device.device_id, device.password)
-        self.__add_byte(protocol.WRITEREAD)
-        self.__add_byte(protocol.VENTILATION_MODE)
-        self.__add_byte(mode)
-        self.__add_checksum()
+        self.__use_template(device, protocol.WRITEREAD, protocol.VENTILATION_MODE, mode)
 
     def initialize_on_cmd(self, device: Device):
         """Initialize a ON command packet to be sent to a device"""
-        self.__build_data(device.device_id, device.password)
-        self.__add_byte(protocol.WRITEREAD)
-        self.__add_byte(protocol.ON_OFF)
-        self.__add_byte(0x01)
-        self.__add_checksum()
+        self.__use_cached(device, (protocol.WRITEREAD, protocol.ON_OFF, 0x01))
 
     def initialize_off_cmd(self, device: Device):
         """Initialize a Off command packet to be sent to a device"""
-        self.__build_data(device.device_id, device.password)
-        self.__add_byte(protocol.WRITEREAD)
-        self.__add_byte(protocol.ON_OFF)
-        self.__add_byte(0x00)
-        self.__add_checksum()
+        self.__use_cached(device, (protocol.WRITEREAD, protocol.ON_OFF, 0x00))
 
     def initialize_status_cmd(self, device: Device):
         """Initialize a status command packet to be sent to a device"""
-        self.__build_data(device.device_id, device.password)
-        self.__add_byte(protocol.READ)
-        self.__add_byte(protocol.ON_OFF)
-        self.__add_byte(protocol.VENTILATION_MODE)
-        self.__add_byte(protocol.SPEED)
-        self.__add_byte(protocol.MANUAL_SPEED)
-        self.__add_byte(protocol.FAN1RPM)
-        self.__add_byte(protocol.FILTER_ALARM)
-        self.__add_byte(protocol.FILTER_TIMER)
-        self.__add_byte(protocol.CURRENT_HUMIDITY)
-        self.__add_checksum()
+        self.__use_cached(device, (protocol.READ,) + self.STATUS_PARAMETERS)
 
     def initialize_reset_filter_alarm_cmd(self, device: Device):
         """Initialize a reset filter alarm command packet to be sent to a
         device"""
-        self.__build_data(device.device_id, device.password)
-        self.__add_byte(protocol.WRITE)
-        self.__add_byte(protocol.RESET_FILTER_TIMER)
-        self.__add_checksum()
+        self.__use_cached(device, (protocol.WRITE, protocol.RESET_FILTER_TIMER))
 
     def initialize_get_firmware_cmd(self, device: Device):
         """Initialize a get firmware and unit type command packet to be sent to a
         device"""
-        self.__build_data(device.device_id, device.password)
+        self.__use_cached(device, (protocol.READ, protocol.READ_FIRMWARE_VERSION, protocol.UNIT_TYPE))
+
+    def initialize_read_cmd(self, device: Device, parameters):
+        """Initialize a read command packet for any parameters from ventoProtocol.
+        The parameters must fit in one packet. Use read_packets to split them
+        into as few packets as possible"""
+        self.__build_device_data(device)
         self.__add_byte(protocol.READ)
-        self.__add_byte(protocol.READ_FIRMWARE_VERSION)
-        self.__add_byte(protocol.UNIT_TYPE)
+        for parameter_bytes, _ in self.__encode(sorted(set(parameters)), None):
+            self.__add_bytes(parameter_bytes)
         self.__add_checksum()
 
+    def initialize_write_cmd(self, device: Device, values: dict, function: int = protocol.WRITEREAD, writes: dict = None):
+        """Initialize a write command packet for a dict of parameter -> value.
+        Values can be int, str, bytes or a list of byte values. The values must
+        fit in one packet. Use write_packets to split them into as few packets
+        as possible.
+        writes is a dict of parameter -> value written with protocol.WRITE
+        after the values. The function is switched with SC_CHANGE_FUNCTION_NUMBER
+        so the device does not answer them"""
+        self.__build_device_data(device)
+        self.__add_byte(function)
+        for parameter_bytes, value_bytes in self.__encode(sorted(values), values):
+            self.__add_bytes(parameter_bytes)
+            self.__add_bytes(value_bytes)
+        if writes:
+            self.__add_byte(protocol.SC_CHANGE_FUNCTION_NUMBER)
+            self.__add_byte(protocol.WRITE)
+            for parameter_bytes, value_bytes in self.__encode(sorted(writes), writes, max(values, default=0) >> 8):
+                self.__add_bytes(parameter_bytes)
+                self.__add_bytes(value_bytes)
+        self.__add_checksum()
+
+    @staticmethod
+    def settings_values(device: Device, on: bool = None, speed: int = None, manualspeed: int = None, mode: Mode = None) -> dict:
+        """Return the parameter -> value to write for the settings. A speed or
+        manual speed turns the device on and a manual speed selects SPEED_MANUAL.
+        SPEED_OFF turns the device off. Raises ValueError for invalid settings"""
+        values = {}
+        if speed == protocol.SPEED_OFF:
+            if on:
+                raise ValueError("Speed off and on at the same time")
+            speed = None
+            on = False
+        if manualspeed is not None:
+            if not isinstance(manualspeed, int) or not 0 <= manualspeed <= 255:
+                raise ValueError("Manual speed must be 0-255")
+            if speed not in (None, protocol.SPEED_MANUAL):
+                raise ValueError("Manual speed needs speed SPEED_MANUAL")
+            speed = protocol.SPEED_MANUAL
+            values[protocol.MANUAL_SPEED] = manualspeed
+        if speed is not None:
+            if speed not in (protocol.SPEED_LOW, protocol.SPEED_MEDIUM, protocol.SPEED_HIGH, protocol.SPEED_MANUAL):
+                raise ValueError(f"Invalid speed {speed}")
+            if on is None:
+                on = True
+            values[protocol.SPEED] = speed
+        if on is not None:
+            values[protocol.ON_OFF] = 1 if on else 0
+        if mode is not None:
+            values[protocol.VENTILATION_MODE] = int(Mode(mode))
+        return values
+
+    @classmethod
+    def read_packets(cls, device: Device, parameters) -> list:
+        """Build the fewest read packets for the parameters.
+        Returns a list of (packet, parameters in the packet)"""
+        packets = []
+        for group in cls().__split(device, sorted(set(parameters)), None):
+            packet = cls()
+            packet.initialize_read_cmd(device, group)
+            packets.append((packet, group))
+        return packets
+
+    @classmethod
+    def write_packets(cls, device: Device, values: dict, function: int = protocol.WRITEREAD) -> list:
+        """Build the fewest write packets for the dict of parameter -> value.
+        Returns a list of (packet, parameters in the packet)"""
+        packets = []
+        for group in cls().__split(device, sorted(values), values):
+            packet = cls()
+            packet.initialize_write_cmd(device, {parameter: values[parameter] for parameter in group}, function)
+            packets.append((packet, group))
+        return packets
+
+    @staticmethod
+    def encode_value(parameter: int, value) -> bytes:
+        """Return the bytes for the value of a parameter.
+        Raises ValueError for an integer that does not fit the parameter size"""
+        if isinstance(value, (bytes, bytearray)):
+            return bytes(value)
+        if isinstance(value, str):
+            return value.encode("ascii")
+        if isinstance(value, (list, tuple)):
+            return bytes(value)
+        value = int(value)
+        size = protocol.PARAMETER_SIZE.get(parameter) or max(1, (value.bit_length() + 7) // 8)
+        if value < 0 or value.bit_length() > size * 8:
+            raise ValueError(f"Value {value} out of range for the {size} byte parameter 0x{parameter:02X}")
+        return value.to_bytes(size, "little")
+
     @property
     def data(self):
         """Return the data for the packet"""
         return self._data[0: self._pos]
 
+    def __use(self, data: bytes):
+        """Use the already built data for the packet"""
+        self._data = data
+        self._pos = len(data)
+
+    def __use_cached(self, device: Device, command: tuple):
+        """Use the packet cached on the device for a static command. The
+        command is the function followed by the parameter bytes"""
+        data = device._packets.get(command)
+        if data is None:
+            self.__build_device_data(device)
+            for byte in command:
+                self.__add_byte(byte)
+            self.__add_checksum()
+            data = bytes(self.data)
+            device._packets[command] = data
+        self.__use(data)
+
+    def __use_template(self, device: Device, function: int, parameter: int, value: int):
+        """Build a packet with a one byte value from the template cached on the
+        device. The template has the value 0 so the value byte is patched in
+        and added to the checksum"""
+        template = device._packets.get((function, parameter))
+        if template is None:
+            self.__build_device_data(device)
+            self.__add_byte(function)
+            self.__add_byte(parameter)
+            self.__add_byte(0)
+            self.__add_checksum()
+            template = bytes(self.data)
+            device._packets[(function, parameter)] = template
+        data = bytearray(template)
+        checksum = (data[-2] + (data[-1] << 8) + value) & 0xFFFF
+        data[-3] = value
+        data[-2] = checksum & 0xFF
+        data[-1] = checksum >> 8
+        self.__use(data)
+
     def __add_byte(self, byte: int):
         """Add a byte to the packet"""
         self._data[self._pos] = byte
@@ -111,6 +228,8 @@ class VentoExpertPacket:
         """Build a packet header with start characters, ID and password"""
         self._data = bytearray(self.maxsize)
         self._pos = 0
+        self._checksum_start = 2
+        self._checksum_base = 0
         self.__add_byte(protocol.PACKET_START_CHARACTER)
         self.__add_byte(protocol.PACKET_START_CHARACTER)
         self.__add_byte(protocol.PROTOCOL_TYPE)
@@ -121,13 +240,78 @@ class VentoExpertPacket:
         for char in password:
             self.__add_byte(ord(char))
 
-    def __add_parameter(self, parameter: int, value):
-        self.__add_byte(parameter)
-        self.__add_byte(value)
+    def __build_device_data(self, device: Device):
+        """Build a packet header from the header precompiled for the device"""
+        header = device._packet_header
+        self._data = bytearray(self.maxsize)
+        self._data[0: len(header)] = header
+        self._pos = len(header)
+        # only the bytes after the header are summed for the checksum
+        self._checksum_start = len(header)
+        self._checksum_base = device._header_checksum
+
+    def __add_bytes(self, data: bytes):
+        """Add several bytes to the packet"""
+        self._data[self._pos: self._pos + len(data)] = data
+        self._pos += len(data)
+
+    def __encode(self, parameters, values, page: int = 0):
+        """Yield the (parameter bytes, value bytes) for the sorted parameters.
+        The parameter bytes include the SC_CHANGE_HIGH_BYTE when the high byte
+        of the parameter number changes from page and the SC_CHANGE_VALUE_SIZE
+        when the value is not a single byte"""
+        for parameter in parameters:
+            prefix = bytearray()
+            if parameter >> 8 != page:
+                page = parameter >> 8
+                prefix += bytes((protocol.SC_CHANGE_HIGH_BYTE, page))
+            value = None
+            if values is not None:
+                value = self.encode_value(parameter, values[parameter])
+                if len(value) != 1:
+                    prefix += bytes((protocol.SC_CHANGE_VALUE_SIZE, len(value)))
+            prefix.append(parameter & 0xFF)
+            yield prefix, value
+
+    def __split(self, device: Device, parameters, values) -> list:
+        """Split the sorted parameters into groups that each fit in a packet.
+        The response must also fit, so a read is split on the size of the values
+        the device will answer with"""
+        budget = self.maxsize - (8 + len(device.device_id) + len(device.password))
+        groups = []
+        group = []
+        page = 0
+        request_size = 0
+        response_size = 0
+        for parameter in parameters:
+            if values is not None:
+                value_size = len(self.encode_value(parameter, values[parameter]))
+            else:
+                # text parameters are up to 32 bytes
+                value_size = protocol.PARAMETER_SIZE.get(parameter, 1) or 32
+            response = (2 if value_size != 1 else 0) + 1 + value_size
+            request = response if values is not None else 1
+            page_size = 2 if parameter >> 8 != page else 0
+            if group and (
+                request_size + page_size + request > budget
+                or response_size + page_size + response > budget
+            ):
+                groups.append(group)
+                group = []
+                request_size = 0
+                response_size = 0
+                page_size = 2 if parameter >> 8 != 0 else 0
+            group.append(parameter)
+            page = parameter >> 8
+            request_size += page_size + request
+            response_size += page_size + response
+        if group:
+            groups.append(group)
+        return groups
 
     def __add_checksum(self):
         """Divides the checksum into two sepparate bytes and adds the checksum bytes to the data packet"""
-        checksum = self.calc_checksum(self._pos)
+        checksum = (self._checksum_base + sum(self._data[self._checksum_start: self._pos])) & 0xFFFF
         checksumLowByte = (checksum & 0xFF)
         checksumHighByte = (checksum >> 8)
         self.__add_byte(checksumLowByte)
@@ -135,7 +319,4 @@ class VentoExpertPacket:
 
     def calc_checksum(self, size) -> int:
         """Calculates the sum of data in the packet from Type to the final Data bloc and masks it down to two bytes"""
-        checksum: int = 0
-        for i in range(2, size):
-            checksum += self._data[i]
-        return (checksum & 0xFFFF)
+        return sum(self._data[2: size]) & 0xFFFF
@@ -108,6 +108,74 @@ PARTY_MODE_TIMER_SETPOINT = 0x303   # R/W/RW    Byte 1 – minutes (0…59), Byt
 HUMIDITY_SETPOINT_STATUS = 0x304    # R         0 – below setpoint, 1 – over setpoint
 ZERO_10V_SENSOR_STATUS = 0x305      # R         0 – below setpoint, 1 – over setpoint
 
+"""Size in bytes of the value of the parameters"""
+PARAMETER_SIZE = {
+    # see Blauberg doc for packet lenghts and other detailed documentation
+    # 0 is used for text parameters where the size varies
+    ON_OFF: 1,
+    SPEED: 1,
+    BOOST_MODE_STATUS: 1,
+    TIMER_MODE: 1,
+    TIMER_COUNTDOWN: 3,
+    HUMIDITY_SENSOR: 1,
+    RELAY_SENSOR: 1,
+    ZERO_10V_SENSOR: 1,
+    HUMIDITY_THRESHOLD_SETPOINT: 1,
+    CURRENT_RTC_BATTERY_VOLTAGE: 2,
+    CURRENT_HUMIDITY: 1,
+    CURRENT_ZERO_10V_SENSOR_VALUE: 1,
+    CURRENT_REALY_SENSOR_STATE: 1,
+    SUPPLY_FAN_SPEED1: 1,
+    EXHAUST_FAN_SPEED1: 1,
+    SUPPLY_FAN_SPEED2: 1,
+    EXHAUST_FAN_SPEED2: 1,
+    SUPPLY_FAN_SPEED3: 1,
+    EXHAUST_FAN_SPEED3: 1,
+    MANUAL_SPEED: 1,
+    FAN1RPM: 2,
+    FAN2RPM: 2,
+    FILTER_REPLACEMENT_TIME: 2,
+    FILTER_TIMER: 3,
+    RESET_FILTER_TIMER: 1,
+    BOST_MODE_DEACTIVATION_SETPOINT: 1,
+    RTC_TIME: 3,
+    RTC_CALENDAR: 4,
+    WEEKLY_SCHEDULE_MODE: 1,
+    SCHEDULE_SETUP: 6,
+    SEARCH: 16,
+    DEVICE_PASSWORD: 0,
+    MACHINE_HOURS: 4,
+    RESET_ALARMS: 1,
+    READ_ALARM: 1,
+    CLOUD_OPERATION: 1,
+    READ_FIRMWARE_VERSION: 6,
+    RESTORE_FACTORY_SETTINGS: 1,
+    FILTER_ALARM: 1,
+    WIFI_OPERATION_MODE: 1,
+    WIFI_CLIENT_NAME: 0,
+    WIFI_PASSWORD: 0,
+    WIFI_ENCRYPTION: 1,
+    WIFI_CHANNEL: 1,
+    WIFI_IP_MODE: 1,
+    ASSIGNED_IP_ADDRESS: 4,
+    ASSIGNED_IP_SUBNET_MASK: 4,
+    ASSIGNED_IP_GATEWAY: 4,
+    APPLY_QUIT_SETUP_MODE: 1,
+    DISCARD_QUIT_SETUP_MODE: 1,
+    CURRENT_IP_ADDRESS: 4,
+    VENTILATION_MODE: 1,
+    ZERO_10V_SENSOR_THRESHOLD: 1,
+    UNIT_TYPE: 2,
+    SC_CHANGE_FUNCTION_NUMBER: 1,  # Just dummy so all are in the list. Length will vary.
+    SC_PARAMETER_NOT_SUPPORTED: 1,
+    SC_CHANGE_VALUE_SIZE: 1,       # Just dummy so all are in the list. Length will vary.
+    SC_CHANGE_HIGH_BYTE: 1,
+    NIGHT_MODE_TIMER_SETPOINT: 2,
+    PARTY_MODE_TIMER_SETPOINT: 2,
+    HUMIDITY_SETPOINT_STATUS: 1,
+    ZERO_10V_SENSOR_STATUS: 1,
+}
+
 
 """Constants determening ventilation speed mode for the fan device"""
 SPEED_OFF = 0
@@ -0,0 +1,94 @@
+# Benchmark of the telemetry archive. Measures the samples per second written
+# and the latency of range queries over one second samples of many fans.
+# Run from the repository root with: python -m benchmarks.bench_archive
+# The default is a day for 10 fans. A year for 100 fans is:
+#   python -m benchmarks.bench_archive --fans 100 --days 365
+# which writes about 3 billion samples and takes hours.
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from VentoExpertSDK.archive import TelemetryArchive, TelemetryArchiveReader
+
+START = 1700000000.0
+
+
+def fan_id(number: int) -> str:
+    return f"{number:016X}"
+
+
+def ingest(archive: TelemetryArchive, fans: int, seconds: int) -> int:
+    """Write a sample per second for every fan. Returns the number of samples"""
+    rng = random.Random(1)
+    state = [{"speed": 2, "manualspeed": 128, "fan1rpm": 1300, "fan2rpm": None, "humidity": 45, "filter_timer": 200000}
+             for _ in range(fans)]
+    for second in range(seconds):
+        timestamp = START + second + rng.random() * 0.01
+        for number in range(fans):
+            values = state[number]
+            values["fan1rpm"] = 1300 + rng.randint(-15, 15)
+            if second % 60 == 0:
+                values["filter_timer"] -= 1
+                values["humidity"] = max(0, min(100, values["humidity"] + rng.randint(-1, 1)))
+            archive.append(fan_id(number), timestamp, values)
+    archive.flush()
+    return fans * seconds
+
+
+def directory_size(directory: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def query_latency(directory: str, fans: int, seconds: int, window: int, repeats: int) -> float:
+    """Return the median time in seconds to query a window of fan1rpm"""
+    rng = random.Random(2)
+    reader = TelemetryArchiveReader(directory)
+    latencies = []
+    for _ in range(repeats):
+        start = START + rng.randint(0, max(0, seconds - window))
+        device_id = fan_id(rng.randrange(fans))
+        began = time.perf_counter()
+        times, _ = reader.query(device_id, "fan1rpm", start, start + window)
+        latencies.append(time.perf_counter() - began)
+        assert len(times) == min(window, seconds)
+    reader.close()
+    return statistics.median(latencies)
+
+
+def run_benchmarks(fans: int = 10, days: float = 1, repeats: int = 20) -> dict:
+    """Run the benchmarks and return the results"""
+    seconds = int(days * 86400)
+    with tempfile.TemporaryDirectory() as directory:
+        archive = TelemetryArchive(directory)
+        began = time.perf_counter()
+        samples = ingest(archive, fans, seconds)
+        elapsed = time.perf_counter() - began
+        archive.close()
+        size = directory_size(directory)
+        results = {
+            "samples": samples,
+            "samples_per_second": samples / elapsed,
+            "bytes_per_sample": size / samples,
+        }
+        for name, window in (("query_hour_ms", 3600), ("query_day_ms", 86400)):
+            if window <= seconds:
+                results[name] = query_latency(directory, fans, seconds, window, repeats) * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fans", type=int, default=10)
+    parser.add_argument("--days", type=float, default=1)
+    parser.add_argument("--repeats", type=int, default=20)
+    arguments = parser.parse_args()
+    for name, value in run_benchmarks(arguments.fans, arguments.days, arguments.repeats).items():
+        print(f"{name:<20} {value:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# Benchmarks of the client: applying decoded responses to the devices and the
+# round trips to fans simulated on the local host.
+# Run from the repository root with: python -m benchmarks.bench_client
+# The fans are simulated on 127.0.0.2:4000 and the client binds port 4000,
+# so no other client may run on the host at the same time.
+# python -m benchmarks.bench_client --saturation measures the responses the
+# client applies per second when it can not keep up with the polls. Its fans
+# are simulated in separate processes on 127.0.0.2 and the following addresses.
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from VentoExpertSDK import ventoProtocol as protocol
+from VentoExpertSDK.device import Device
+from VentoExpertSDK.responsepacket import ResponsePacket
+from VentoExpertSDK.simulator import FanSimulator
+from VentoExpertSDK.ventoClient import VentoClient
+from benchmarks.bench_response import DEVICE_ID, PASSWORD, STATUS_RESPONSE, build_response
+
+DEVICE_COUNTS = (10, 100, 1000)
+
+
+def update_throughput(client: VentoClient, number: int = 50000) -> float:
+    """Return the status responses applied per second by update_device.
+    Every other response changes the speed so the change events are dispatched too"""
+    device = Device(DEVICE_ID, PASSWORD, "127.0.0.1", onchange=lambda device: None)
+    packets = [ResponsePacket.decode(STATUS_RESPONSE), ResponsePacket.decode(build_response([protocol.ON_OFF, 0x01, protocol.SPEED, 0x03]))]
+    began = time.perf_counter()
+    for index in range(number):
+        client.update_device(device, "127.0.0.1", packets[index & 1])
+    return number / (time.perf_counter() - began)
+
+
+def status_polls(client: VentoClient) -> tuple:
+    """Return the status polls answered and lost so far"""
+    snapshot = client.metrics.snapshot()
+    answered = sum(sample["count"] for sample in snapshot.get("vento_latency_seconds", []) if sample["labels"]["command"] == "status")
+    lost = sum(sample["value"] for sample in snapshot.get("vento_polls_lost_total", []))
+    return answered, lost
+
+
+def round_trips(client: VentoClient, count: int, seconds: float = 3.0, samples: int = 100) -> dict:
+    """Poll count simulated fans for seconds and then time commands to them"""
+    with FanSimulator(count=count) as simulator:
+        devices = [client.add_device(device_id, ip_address=simulator.host) for device_id in simulator.fans]
+        deadline = time.monotonic() + 10
+        for device in devices:
+            device.wait_for_initialize(max(0, deadline - time.monotonic()))
+        answered, lost = status_polls(client)
+        time.sleep(seconds)
+        answered_after, lost_after = status_polls(client)
+        latencies = []
+        timeouts = 0
+        for index in range(samples):
+            command = client.read(devices[index * count // samples], [protocol.MANUAL_SPEED])
+            try:
+                command.result()
+                latencies.append(command.latency)
+            except TimeoutError:
+                timeouts += 1
+        for device in devices:
+            client.remove_device(device.device_id)
+    latencies.sort()
+    return {
+        "devices": count,
+        "polls_per_second": (answered_after - answered) / seconds,
+        "polls_lost": lost_after - lost,
+        "command_latency_ms_median": statistics.median(latencies) * 1000 if latencies else None,
+        "command_latency_ms_p95": latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else None,
+        "command_timeouts": timeouts,
+    }
+
+
+def start_simulators(count: int, hosts: int) -> list:
+    """Simulate count fans split over hosts processes on 127.0.0.2 and the
+    following addresses. Returns the processes and the (device id, address) of the fans"""
+    processes = []
+    fans = []
+    share = count // hosts
+    for index in range(hosts):
+        host = f"127.0.0.{2 + index}"
+        process = subprocess.Popen([sys.executable, "-m", "VentoExpertSDK.simulator", "--fans", str(share), "--host", host, "--first", str(index * share)],
+                                   stdout=subprocess.PIPE, text=True)
+        processes.append(process)
+        process.stdout.readline()
+        fans += [(f"{number:016X}", host) for number in range(index * share, (index + 1) * share)]
+    return processes, fans
+
+
+def saturation(count: int = 1000, hosts: int = 4, poll_interval: float = 0.02, seconds: float = 3.0) -> dict:
+    """Return the responses per second applied by a client polling count fans
+    fast enough to saturate its notify thread, which decodes and applies every
+    response. The simulators run in their own processes so they do not compete
+    with the client for the GIL"""
+    processes, fans = start_simulators(count, hosts)
+    client = VentoClient(poll_interval=poll_interval)
+    try:
+        devices = [client.add_device(device_id, ip_address=host) for device_id, host in fans]
+        deadline = time.monotonic() + 10
+        for device in devices:
+            device.wait_for_initialize(max(0, deadline - time.monotonic()))
+        received = client.metrics.counter("vento_packets_received_total", function="response")
+        _, lost = status_polls(client)
+        time.sleep(seconds)
+        _, lost_after = status_polls(client)
+        return {
+            "devices": count,
+            "responses_per_second": (client.metrics.counter("vento_packets_received_total", function="response") - received) / seconds,
+            "polls_lost": lost_after - lost,
+        }
+    finally:
+        client.close()
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+def run_benchmarks(device_counts=DEVICE_COUNTS, poll_interval: float = 0.5, seconds: float = 3.0) -> dict:
+    """Run the benchmarks and return the results"""
+    client = VentoClient(poll_interval=poll_interval)
+    try:
+        results = {"update_device_per_second": update_throughput(client)}
+        for count in device_counts:
+            results[f"round_trip_{count}"] = round_trips(client, count, seconds)
+    finally:
+        client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, nargs="+", default=list(DEVICE_COUNTS))
+    parser.add_argument("--poll-interval", type=float, help="default 0.5 and 0.02 with --saturation")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--saturation", action="store_true", help="measure the responses applied per second when the client can not keep up")
+    arguments = parser.parse_args()
+    if arguments.saturation:
+        result = saturation(max(arguments.devices), poll_interval=arguments.poll_interval or 0.02, seconds=arguments.seconds)
+        print(f"{result['devices']} devices {result['responses_per_second']:.0f} responses/s {result['polls_lost']} lost")
+        return
+    results = run_benchmarks(arguments.devices, arguments.poll_interval or 0.5, arguments.seconds)
+    print(f"update_device      {results.pop('update_device_per_second'):>12.0f} /s")
+    print(f"{'devices':>8} {'polls/s':>10} {'lost':>6} {'median ms':>10} {'p95 ms':>8} {'timeouts':>9}")
+    for result in results.values():
+        print(f"{result['devices']:>8} {result['polls_per_second']:>10.0f} {result['polls_lost']:>6} "
+              f"{result['command_latency_ms_median'] or 0:>10.3f} {result['command_latency_ms_p95'] or 0:>8.3f} {result['command_timeouts']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Microbenchmark of building the command packets sent to the devices.
+# Compares the cached and precompiled packets with the original builder.
+# Run from the repository root with: python -m benchmarks.bench_packet
+
+import timeit
+
+from VentoExpertSDK.device import Device
+from VentoExpertSDK.ventoPacket import VentoExpertPacket
+from benchmarks.legacy import LegacyPacket
+
+COMMANDS = {
+    "status": lambda packet, device: packet.initialize_status_cmd(device),
+    "firmware": lambda packet, device: packet.initialize_get_firmware_cmd(device),
+    "on": lambda packet, device: packet.initialize_on_cmd(device),
+    "speed": lambda packet, device: packet.initialize_speed_cmd(device, 2),
+    "manualspeed": lambda packet, device: packet.initialize_manualspeed_cmd(device, 150),
+}
+
+
+def measure(packet_class, build, device, number: int) -> float:
+    """Return the time in nanoseconds to build one packet"""
+
+    def run():
+        packet = packet_class()
+        build(packet, device)
+        return packet.data
+
+    # the packets must be byte for byte identical to the original builder
+    legacy = LegacyPacket()
+    build(legacy, device)
+    assert bytes(run()) == bytes(legacy.data)
+    return min(timeit.repeat(run, number=number, repeat=5)) / number * 1e9
+
+
+def checksum_benchmark(number: int = 200000) -> float:
+    """Return the time in nanoseconds of calc_checksum over a status packet"""
+    packet = VentoExpertPacket()
+    packet.initialize_status_cmd(Device("0123456789ABCDEF", "1111"))
+    size = len(packet.data) - 2
+    return min(timeit.repeat(lambda: packet.calc_checksum(size), number=number, repeat=5)) / number * 1e9
+
+
+def run_benchmarks(number: int = 20000) -> dict:
+    """Run the benchmarks and return the result per command"""
+    device = Device("0123456789ABCDEF", "1111")
+    results = {}
+    for name, build in COMMANDS.items():
+        before = measure(LegacyPacket, build, device, number)
+        after = measure(VentoExpertPacket, build, device, number)
+        results[name] = {"before_ns": before, "after_ns": after, "speedup": before / after}
+    return results
+
+
+def main():
+    print(f"{'command':<12} {'before ns':>10} {'after ns':>10} {'speedup':>8}")
+    for name, result in run_benchmarks().items():
+        print(f"{name:<12} {result['before_ns']:>10.0f} {result['after_ns']:>10.0f} {result['speedup']:>7.1f}x")
+    print(f"calc_checksum {checksum_benchmark():.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Runs all the benchmarks and writes the results to a JSON file so the
+# results of two releases can be compared.
+# Run from the repository root with:
+#   python -m benchmarks.run --output results.json
+#   python -m benchmarks.run --output new.json --compare old.json
+# The client benchmarks bind port 4000, see bench_client.py.
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+
+from benchmarks import bench_archive, bench_client, bench_packet, bench_response
+
+FORMAT = 1
+
+
+def git_revision() -> str:
+    """Return the commit of the working tree. None if it is not a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(suites) -> dict:
+    """Run the suites and return the results with a description of the host"""
+    results = {}
+    for suite in suites:
+        print(f"running {suite}", file=sys.stderr)
+        if suite == "packet":
+            results[suite] = bench_packet.run_benchmarks()
+            results[suite]["calc_checksum_ns"] = bench_packet.checksum_benchmark()
+        elif suite == "response":
+            results[suite] = bench_response.run_benchmarks()
+        elif suite == "archive":
+            results[suite] = bench_archive.run_benchmarks(fans=10, days=0.25)
+        elif suite == "client":
+            results[suite] = bench_client.run_benchmarks()
+        elif suite == "saturation":
+            results[suite] = bench_client.saturation()
+    return {
+        "format": FORMAT,
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    """Return the numbers in the nested results as "suite.name.key" -> number"""
+    numbers = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            numbers.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            numbers[prefix + key] = value
+    return numbers
+
+
+def compare(old: dict, new: dict):
+    """Print the numbers of two result files side by side"""
+    old_numbers = flatten(old["results"])
+    new_numbers = flatten(new["results"])
+    print(f"{old.get('revision')} -> {new.get('revision')}")
+    for name, value in new_numbers.items():
+        before = old_numbers.get(name)
+        if before is None:
+            print(f"{name:<50} {'':>12} {value:>12.3f}")
+        else:
+            change = f"{value / before:>7.2f}x" if before else ""
+            print(f"{name:<50} {before:>12.3f} {value:>12.3f} {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--suites", nargs="+", default=["packet", "response", "archive", "client"],
+                        choices=["packet", "response", "archive", "client", "saturation"])
+    parser.add_argument("--compare", help="a result file of an earlier run to compare with")
+    arguments = parser.parse_args()
+    report = run_benchmarks(arguments.suites)
+    with open(arguments.output, "w") as file:
+        json.dump(report, file, indent=1)
+    print(f"results written to {arguments.output}", file=sys.stderr)
+    if arguments.compare:
+        with open(arguments.compare, "r") as file:
+            compare(json.load(file), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 # This program can view trhe data from the Blauberg Vento compatible fans on the networ. Blauberg, Vents, Duka.
 import sys
-import time
 from VentoExpertSDK.ventoClient import VentoClient, Device, Mode
 
 deviceAdressList = []
@@ -25,23 +24,6 @@ def onchange(device: Device):
           )
 
 
-def newdevice_callback(deviceid: str, ip_addr: str):
-    duplicateDevice = False
-    dataPair = (deviceid, ip_addr)
-    if not deviceAdressList:
-        deviceAdressList.append(dataPair)
-    else:
-        for i in range(0, len(deviceAdressList)):
-            # deviceToCompare = deviceAdressList[i]
-            if deviceAdressList[i][0] == deviceid:
-                duplicateDevice = True
-                print("Duplicate found ", i, deviceid)
-                continue
-
-        if not duplicateDevice:
-            deviceAdressList.append(dataPair)
-
-
 def showDiscoveredFans():
     print("Discoverd devises on the network :")
     for i in range(0, len(deviceAdressList)):
@@ -60,8 +42,8 @@ def shutdown(fanClient=None):
 def main():
     # Main
     fanClient: VentoClient = VentoClient()
-    fanClient.search_devices(newdevice_callback)
-    time.sleep(3)       # Give fans time to respond to the search command
+    # the fans that respond within a second are listed
+    deviceAdressList.extend(fanClient.discover(timeout=1.0).items())
 
     showDiscoveredFans()
 
@@ -3,7 +3,6 @@
 # You can see the device id in the respective mobile phone apps for the relvant supplier of the fans. Blauberg, Vents, Duka.
 
 import sys
-import time
 
 from VentoExpertSDK.ventoClient import VentoClient, Device, Mode
 # from VentoExpertSDK.device import Device, Mode
@@ -27,19 +26,11 @@ def onchange(device: Device):
     )
 
 
-def newdevice_callback(deviceid: str):
-    print("New device id: " + deviceid)
-
-
 def main():
     # Main example
     fanClient: VentoClient = VentoClient()
-    fanClient.search_devices(newdevice_callback)
-    print("3")
-    time.sleep(1)       # Give fans time to respond to the search command
-    print("2")
-    time.sleep(1)
-    print("1")
+    for deviceid, ip_address in fanClient.discover_iter(timeout=1.0):
+        print(f"New device id: {deviceid} ip: {ip_address}")
 
     # read the device id from fileq
     with open(".deviceid.txt", "r") as file:
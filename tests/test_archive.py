@@ -0,0 +1,106 @@
+# Tests of the telemetry archive: writing and reading the column files and the recovery of chunks that were cut off.
+# Run from the repository root with: python -m unittest discover tests
+
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+from VentoExpertSDK.archive import TelemetryArchive, TelemetryArchiveReader
+from benchmarks.bench_response import DEVICE_ID
+
+FIELDS = ("speed", "fan1rpm", "humidity")
+
+
+class TelemetryArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # the chunks are only written by flush() so the tests do not race the writer thread
+        self.archive = TelemetryArchive(self.directory, chunk_size=100000, fields=FIELDS)
+        self.reader = TelemetryArchiveReader(self.directory)
+
+    def tearDown(self):
+        self.reader.close()
+        self.archive.close()
+        shutil.rmtree(self.directory)
+
+    def append(self, start: int, count: int):
+        """Add count samples a second apart with the speed and rpm of the sample number"""
+        for number in range(start, start + count):
+            humidity = None if number % 7 == 0 else 40 + number % 3
+            self.archive.append(DEVICE_ID, 1700000000 + number, {"speed": number % 4, "fan1rpm": number * 10, "humidity": humidity})
+
+    def column(self, field: str) -> str:
+        return os.path.join(self.directory, DEVICE_ID, field + ".col")
+
+    def test_round_trip(self):
+        for start in range(0, 250, 100):
+            self.append(start, min(100, 250 - start))
+            self.archive.flush()
+        self.assertEqual(self.reader.device_ids(), [DEVICE_ID])
+        times, values = self.reader.query(DEVICE_ID, "fan1rpm")
+        self.assertEqual(list(times), [1700000000 + number for number in range(250)])
+        self.assertEqual(list(values), [number * 10 for number in range(250)])
+        times, values = self.reader.query(DEVICE_ID, "humidity")
+        for number, value in enumerate(values):
+            if number % 7 == 0:
+                self.assertTrue(math.isnan(value))
+            else:
+                self.assertEqual(value, 40 + number % 3)
+        # a range across the chunks, the end not included
+        times, values = self.reader.query(DEVICE_ID, "speed", 1700000095, 1700000205)
+        self.assertEqual(list(times), [1700000000 + number for number in range(95, 205)])
+        self.assertEqual(list(values), [number % 4 for number in range(95, 205)])
+        self.assertEqual(self.reader.query(DEVICE_ID, "speed", 1800000000), (times[:0], values[:0]))
+        self.assertEqual(len(self.reader.query("FEDCBA9876543210", "speed")[0]), 0)
+
+    def test_chunk_being_written(self):
+        self.append(0, 50)
+        self.archive.flush()
+        with open(self.column("speed"), "rb") as file:
+            chunk = file.read()
+        # half of the next chunk is in the file
+        with open(self.column("speed"), "ab") as file:
+            file.write(chunk[: len(chunk) // 2])
+        times, values = self.reader.query(DEVICE_ID, "speed")
+        self.assertEqual(len(times), 50)
+        self.assertEqual(list(values), [number % 4 for number in range(50)])
+
+    def test_failed_write_cut_back(self):
+        # the last column can not be written
+        os.makedirs(self.column("humidity"))
+        self.append(0, 40)
+        self.assertRaises(OSError, self.archive.flush)
+        for field in ("time",) + FIELDS[:-1]:
+            self.assertEqual(os.path.getsize(self.column(field)), 0, field)
+        self.assertEqual(len(self.reader.query(DEVICE_ID, "speed")[0]), 0)
+        # the chunk is kept and written when the file can be written again
+        os.rmdir(self.column("humidity"))
+        self.append(40, 30)
+        self.archive.flush()
+        for field in FIELDS:
+            times, values = self.reader.query(DEVICE_ID, field)
+            self.assertEqual(list(times), [1700000000 + number for number in range(70)], field)
+        self.assertEqual(list(values[1:7]), [40 + number % 3 for number in range(1, 7)])
+
+    def test_file_shrunk(self):
+        self.append(0, 100)
+        self.archive.flush()
+        sizes = {field: os.path.getsize(self.column(field)) for field in ("time",) + FIELDS}
+        self.append(100, 100)
+        self.archive.flush()
+        self.assertEqual(len(self.reader.query(DEVICE_ID, "fan1rpm")[0]), 200)
+        # the last chunk is cut off again and another one written in its place
+        for field, size in sizes.items():
+            os.truncate(self.column(field), size)
+        self.append(300, 10)
+        self.archive.flush()
+        times, values = self.reader.query(DEVICE_ID, "fan1rpm")
+        self.assertEqual(list(times), [1700000000 + number for number in list(range(100)) + list(range(300, 310))])
+        self.assertEqual(list(values), [number * 10 for number in list(range(100)) + list(range(300, 310))])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+# Tests of the AsyncVentoClient against a device that does not answer.
+# Run from the repository root with: python -m unittest discover tests
+
+import asyncio
+import unittest
+
+from VentoExpertSDK import ventoProtocol as protocol
+from VentoExpertSDK.asyncVentoClient import AsyncVentoClient
+from benchmarks.bench_response import DEVICE_ID, PASSWORD
+
+
+class AsyncVentoClientTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_command_not_awaited_times_out(self):
+        # the polls are far apart so only the timeout of the command wakes the poll task
+        client = AsyncVentoClient(poll_interval=60, command_timeout=0.1)
+        await client.start("127.0.0.1", 0)
+        try:
+            device = await client.add_device(DEVICE_ID, PASSWORD, ip_address="127.0.0.1")
+            group = await client.read(device, [protocol.SPEED])
+            await asyncio.sleep(0.3)
+            self.assertTrue(group.done())
+            self.assertEqual(len(client._commands), 0)
+            self.assertEqual(client.metrics.counter("vento_command_timeouts_total", device=DEVICE_ID, command="read"), 1)
+        finally:
+            await client.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
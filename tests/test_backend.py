@@ -0,0 +1,96 @@
+# Tests of the backend against simulated fans: the ETags of the fan documents and the bulk commands.
+# Run from the repository root with: python -m unittest discover tests
+
+import unittest
+
+from VentoExpertSDK import ventoProtocol as protocol
+from VentoExpertSDK.simulator import FanSimulator
+
+try:
+    import flask
+except ImportError:
+    flask = None
+
+
+@unittest.skipUnless(flask, "flask is not installed")
+class BackendTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # the backend starts its client and the search of the fans when it is imported
+        import ventoManagerBack
+        cls.backend = ventoManagerBack
+        cls.simulator = FanSimulator(count=3, host="127.0.0.3", seed=1)
+        cls.simulator.start()
+        cls.device_ids = sorted(cls.simulator.fans)
+        for device_id in cls.device_ids:
+            # not polled during the tests so the documents only change with the commands
+            device = ventoManagerBack.fanClient.add_device(device_id, ip_address=cls.simulator.host, onchange=ventoManagerBack.fleet.update, poll_interval=1000)
+            device.wait_for_initialize(5)
+            ventoManagerBack.fleet.update(device)
+        cls.client = ventoManagerBack.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.backend.monitor.close()
+        cls.backend.fanClient.close()
+        cls.simulator.close()
+
+    def test_fans_not_modified(self):
+        response = self.client.get("/fans")
+        self.assertEqual(response.status_code, 200)
+        etag = response.get_etag()[0]
+        self.assertEqual(sorted(fan["device_id"] for fan in response.get_json()), self.device_ids)
+        response = self.client.get("/fans", headers={"If-None-Match": f'"{etag}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.get_etag()[0], etag)
+        response = self.client.get("/fans", headers={"If-None-Match": '"other"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_fan_etag_changes(self):
+        device_id = self.device_ids[0]
+        response = self.client.get(f"/fans/{device_id}")
+        self.assertEqual(response.status_code, 200)
+        etag = response.get_etag()[0]
+        self.assertEqual(self.client.get(f"/fans/{device_id}", headers={"If-None-Match": f'"{etag}"'}).status_code, 304)
+        response = self.client.put(f"/fans/{device_id}/tags", json={"tags": ["etag"]})
+        self.assertEqual(response.status_code, 200)
+        # the document changed, so the old ETag gets the new document
+        response = self.client.get(f"/fans/{device_id}", headers={"If-None-Match": f'"{etag}"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_etag()[0], etag)
+        self.assertEqual(response.get_json()["tags"], ["etag"])
+        self.assertEqual(self.client.get("/fans/FFFFFFFFFFFFFFFF").status_code, 404)
+
+    def test_bulk_command(self):
+        response = self.client.post("/fans/commands", json={"command": "speed", "devices": self.device_ids + ["FFFFFFFFFFFFFFFF"], "speed": protocol.SPEED_MEDIUM})
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()["results"]
+        self.assertEqual(results.pop("FFFFFFFFFFFFFFFF"), {"error": "Fan not found"})
+        self.assertEqual(sorted(results), self.device_ids)
+        for device_id, result in results.items():
+            self.assertEqual(result["status"], "success", device_id)
+            self.assertEqual(result["fan"]["speed"], protocol.SPEED_MEDIUM)
+            self.assertEqual(self.simulator.fans[device_id].read(protocol.SPEED), bytes((protocol.SPEED_MEDIUM,)))
+
+    def test_bulk_command_selector(self):
+        self.client.put(f"/fans/{self.device_ids[1]}/tags", json={"tags": ["kitchen"]})
+        response = self.client.post("/fans/commands", json={"command": "off", "select": {"tag": "kitchen"}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.get_json()["results"]), [self.device_ids[1]])
+        response = self.client.post("/fans/commands", json={"command": "on", "select": "all"})
+        self.assertEqual(sorted(response.get_json()["results"]), self.device_ids)
+
+    def test_bulk_command_invalid(self):
+        for body in (
+            {"command": "unknown", "select": "all"},
+            {"command": "speed", "select": "all", "speed": 7},
+            {"command": "on", "select": "some"},
+            {"command": "on", "devices": self.device_ids[0]},
+        ):
+            self.assertEqual(self.client.post("/fans/commands", json=body).status_code, 400, body)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+# Tests of the command tracking: confirmation, retransmissions and duplicate responses.
+# Run from the repository root with: python -m unittest discover tests
+
+import threading
+import time
+import unittest
+
+from VentoExpertSDK import ventoProtocol as protocol
+from VentoExpertSDK.clientbase import VentoClientBase
+from VentoExpertSDK.command import Command, CommandGroup, CommandTracker
+from benchmarks.bench_response import DEVICE_ID, PASSWORD, build_response
+
+SPEED = frozenset([protocol.SPEED])
+
+
+def speed_command(timeout: float = 2.0, max_retries: int = 0, retry_interval: float = 0.2) -> Command:
+    return Command(DEVICE_ID, SPEED, timeout, "speed", max_retries, retry_interval)
+
+
+def retransmit(tracker: CommandTracker, now: float) -> list:
+    """Send the retransmissions due at now"""
+    commands = tracker.pop_retries(now)
+    for command in commands:
+        command._resent()
+    return commands
+
+
+class CommandTrackerTest(unittest.TestCase):
+
+    def test_resolve(self):
+        tracker = CommandTracker()
+        first = speed_command()
+        second = speed_command()
+        tracker.register(first)
+        tracker.register(second)
+        self.assertIsNone(tracker.resolve(DEVICE_ID, {protocol.ON_OFF: 1}))
+        self.assertIsNone(tracker.resolve("FEDCBA9876543210", {protocol.SPEED: 1}))
+        # the oldest command with the parameters is confirmed first
+        self.assertIs(tracker.resolve(DEVICE_ID, {protocol.SPEED: 1}), first)
+        self.assertEqual(first.result(0), {protocol.SPEED: 1})
+        self.assertFalse(second.done())
+        self.assertIs(tracker.resolve(DEVICE_ID, {protocol.SPEED: 2}), second)
+        self.assertEqual(len(tracker), 0)
+
+    def test_expire(self):
+        tracker = CommandTracker()
+        command = speed_command(timeout=0.5)
+        tracker.register(command)
+        self.assertEqual(tracker.next_deadline(), command.deadline)
+        tracker.expire(command.deadline - 0.1)
+        self.assertFalse(command.done())
+        tracker.expire(command.deadline)
+        self.assertTrue(command.done())
+        self.assertRaises(TimeoutError, command.result, 0)
+        self.assertIsNone(tracker.next_deadline())
+        self.assertIsNone(tracker.resolve(DEVICE_ID, {protocol.SPEED: 1}))
+
+    def test_retries_backoff(self):
+        tracker = CommandTracker()
+        command = speed_command(timeout=10, max_retries=3, retry_interval=0.2)
+        registered = time.monotonic()
+        tracker.register(command)
+        start = tracker.next_retry()
+        self.assertAlmostEqual(start - registered, 0.2, delta=0.05)
+        self.assertEqual(tracker.pop_retries(start - 0.01), [])
+        self.assertEqual(retransmit(tracker, start), [command])
+        # the interval is doubled for every retransmission
+        self.assertAlmostEqual(tracker.next_retry() - start, 0.4)
+        self.assertEqual(retransmit(tracker, start + 0.4), [command])
+        self.assertAlmostEqual(tracker.next_retry() - start, 0.4 + 0.8)
+        self.assertEqual(retransmit(tracker, start + 1.2), [command])
+        # max_retries reached
+        self.assertIsNone(tracker.next_retry())
+        self.assertEqual(command.retries, 3)
+
+    def test_retries_end_at_deadline(self):
+        tracker = CommandTracker()
+        command = speed_command(timeout=0.5, max_retries=5, retry_interval=0.2)
+        tracker.register(command)
+        retransmit(tracker, tracker.next_retry())
+        # the next retransmission would be after the deadline
+        self.assertIsNone(tracker.next_retry())
+
+    def test_no_retries_when_confirmed(self):
+        tracker = CommandTracker()
+        command = speed_command(max_retries=2)
+        tracker.register(command)
+        tracker.resolve(DEVICE_ID, {protocol.SPEED: 1})
+        self.assertIsNone(tracker.next_retry())
+        self.assertEqual(tracker.pop_retries(time.monotonic() + 1), [])
+
+    def test_duplicates_of_retransmissions(self):
+        tracker = CommandTracker()
+        command = speed_command(max_retries=2)
+        tracker.register(command)
+        retransmit(tracker, tracker.next_retry())
+        retransmit(tracker, tracker.next_retry())
+        tracker.resolve(DEVICE_ID, {protocol.SPEED: 1})
+        # one duplicate per retransmission sent
+        self.assertFalse(tracker.duplicate(DEVICE_ID, {protocol.SPEED: 2}))
+        self.assertTrue(tracker.duplicate(DEVICE_ID, {protocol.SPEED: 1}))
+        self.assertTrue(tracker.duplicate(DEVICE_ID, {protocol.SPEED: 1}))
+        self.assertFalse(tracker.duplicate(DEVICE_ID, {protocol.SPEED: 1}))
+
+    def test_no_duplicates_without_retransmissions_sent(self):
+        tracker = CommandTracker()
+        command = speed_command(max_retries=2)
+        tracker.register(command)
+        # due, but not sent e.g. while the socket is recreated
+        tracker.pop_retries(tracker.next_retry())
+        tracker.resolve(DEVICE_ID, {protocol.SPEED: 1})
+        self.assertEqual(command.retries, 0)
+        self.assertFalse(tracker.duplicate(DEVICE_ID, {protocol.SPEED: 1}))
+
+    def test_new_command_ends_duplicates(self):
+        # speed 1 with lost retransmission answers, then 2, 3 and 1 again
+        tracker = CommandTracker()
+        first = speed_command(max_retries=2)
+        tracker.register(first)
+        retransmit(tracker, tracker.next_retry())
+        retransmit(tracker, tracker.next_retry())
+        tracker.resolve(DEVICE_ID, {protocol.SPEED: 1})
+        for speed in (2, 3, 1):
+            command = speed_command()
+            tracker.register(command)
+            self.assertFalse(tracker.duplicate(DEVICE_ID, {protocol.SPEED: speed}))
+            self.assertIs(tracker.resolve(DEVICE_ID, {protocol.SPEED: speed}), command)
+            self.assertEqual(command.result(0), {protocol.SPEED: speed})
+
+    def test_pending_command_is_never_duplicate(self):
+        tracker = CommandTracker()
+        first = speed_command(max_retries=1)
+        tracker.register(first)
+        retransmit(tracker, tracker.next_retry())
+        tracker.resolve(DEVICE_ID, {protocol.SPEED: 1})
+        # a command registered outside register()'s cleanup, e.g. by another
+        # thread between the checks, is still matched first
+        second = speed_command()
+        tracker._pending.setdefault(DEVICE_ID, []).append(second)
+        self.assertFalse(tracker.duplicate(DEVICE_ID, {protocol.SPEED: 1}))
+
+    def test_duplicates_end_at_deadline(self):
+        tracker = CommandTracker()
+        command = speed_command(timeout=0.05, max_retries=1, retry_interval=0.01)
+        tracker.register(command)
+        retransmit(tracker, tracker.next_retry())
+        tracker.resolve(DEVICE_ID, {protocol.SPEED: 1})
+        time.sleep(0.06)
+        tracker.expire()
+        self.assertFalse(tracker.duplicate(DEVICE_ID, {protocol.SPEED: 1}))
+
+    def test_group(self):
+        tracker = CommandTracker()
+        commands = [Command(DEVICE_ID, [protocol.SPEED]), Command(DEVICE_ID, [protocol.ON_OFF])]
+        for command in commands:
+            tracker.register(command)
+        group = CommandGroup(commands)
+        tracker.resolve(DEVICE_ID, {protocol.ON_OFF: 1})
+        self.assertFalse(group.done())
+        tracker.resolve(DEVICE_ID, {protocol.SPEED: 3})
+        self.assertEqual(group.result(0), {protocol.SPEED: 3, protocol.ON_OFF: 1})
+
+    def test_confirmed(self):
+        command = Command.confirmed(DEVICE_ID, {protocol.ON_OFF: 1}, "on")
+        self.assertTrue(command.done())
+        self.assertEqual(command.result(0), {protocol.ON_OFF: 1})
+
+
+class _Client(VentoClientBase):
+    """A client that keeps the packets instead of sending them"""
+
+    def __init__(self):
+        super().__init__(2.0, 1.0, None, None, None, None, None, 0, 0.2)
+        self._pollwakeup = threading.Event()
+        self.sent = []
+        self.changes = []
+
+    def _send_data(self, device, data):
+        self.sent.append(bytes(data))
+
+    def update_device(self, device, ip_address, packet):
+        if self._update_device(device, ip_address, packet):
+            self.changes.append(device)
+
+
+class DuplicateResponseTest(unittest.TestCase):
+
+    def test_duplicate_updates_device(self):
+        client = _Client()
+        device = client._add_device(DEVICE_ID, PASSWORD, "127.0.0.1", None, None)
+        command = client._send_command(device, b"", [protocol.SPEED], "speed")
+        command._resent()
+        response = build_response([protocol.SPEED, 0x01])
+        client._handle_datagram(response, ("127.0.0.1", 4000))
+        self.assertEqual(command.result(0), {protocol.SPEED: 1})
+        self.assertEqual(device.speed, 1)
+        # the device changes by the panel before the duplicate arrives late
+        client._handle_datagram(build_response([protocol.SPEED, 0x03]), ("127.0.0.1", 4000))
+        changes = len(client.changes)
+        client._handle_datagram(response, ("127.0.0.1", 4000))
+        self.assertEqual(client.metrics.counter("vento_duplicate_responses_total"), 1)
+        self.assertEqual(device.speed, 1)
+        self.assertEqual(len(client.changes), changes)
+
+
+if __name__ == "__main__":
+    unittest.main()
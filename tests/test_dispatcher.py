@@ -0,0 +1,116 @@
+# Tests of the change dispatcher: coalescing, ordering and the bounded queue.
+# Run from the repository root with: python -m unittest discover tests
+
+import threading
+import time
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from VentoExpertSDK.dispatcher import ChangeDispatcher
+
+
+class _Blocking:
+    """A callback that blocks until released and records its calls"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+        self.active = 0
+        self.overlapped = False
+        self._lock = threading.Lock()
+
+    def __call__(self, key, value):
+        with self._lock:
+            self.active += 1
+            self.overlapped = self.overlapped or self.active > 1
+        self.started.set()
+        self.release.wait(5)
+        with self._lock:
+            self.calls.append((key, value))
+            self.active -= 1
+
+
+class ChangeDispatcherTest(unittest.TestCase):
+
+    def test_coalesce(self):
+        dispatcher = ChangeDispatcher(workers=2)
+        callback = _Blocking()
+        dispatcher.submit("fan", callback, "fan", 0)
+        self.assertTrue(callback.started.wait(5))
+        # the first event is being delivered, the next ones replace each other
+        for value in range(1, 6):
+            self.assertTrue(dispatcher.submit("fan", callback, "fan", value))
+        self.assertEqual(dispatcher.depth, 1)
+        callback.release.set()
+        dispatcher.close()
+        self.assertEqual(callback.calls, [("fan", 0), ("fan", 5)])
+        self.assertFalse(callback.overlapped)
+        stats = dispatcher.stats()
+        self.assertEqual((stats["submitted"], stats["delivered"], stats["coalesced"], stats["dropped"]), (6, 2, 4, 0))
+
+    def test_devices_in_parallel(self):
+        dispatcher = ChangeDispatcher(workers=2)
+        first = _Blocking()
+        second = _Blocking()
+        dispatcher.submit("a", first, "a", 1)
+        dispatcher.submit("b", second, "b", 1)
+        # a slow callback of one device does not hold up the other
+        self.assertTrue(first.started.wait(5))
+        self.assertTrue(second.started.wait(5))
+        first.release.set()
+        second.release.set()
+        dispatcher.close()
+        self.assertEqual(first.calls + second.calls, [("a", 1), ("b", 1)])
+
+    def test_full(self):
+        dispatcher = ChangeDispatcher(workers=1, maxsize=2)
+        callback = _Blocking()
+        dispatcher.submit("a", callback, "a", 1)
+        self.assertTrue(callback.started.wait(5))
+        self.assertTrue(dispatcher.submit("b", callback, "b", 1))
+        self.assertTrue(dispatcher.submit("c", callback, "c", 1))
+        self.assertFalse(dispatcher.submit("d", callback, "d", 1))
+        # a device with an event waiting is still updated
+        self.assertTrue(dispatcher.submit("b", callback, "b", 2))
+        callback.release.set()
+        dispatcher.close()
+        self.assertEqual(sorted(callback.calls), [("a", 1), ("b", 2), ("c", 1)])
+        self.assertEqual(dispatcher.stats()["dropped"], 1)
+        self.assertFalse(dispatcher.submit("a", callback, "a", 2))
+
+    def test_errors(self):
+        dispatcher = ChangeDispatcher()
+        calls = []
+
+        def failing(value):
+            calls.append(value)
+            raise RuntimeError("callback failed")
+
+        dispatcher.submit("fan", failing, 1)
+        dispatcher.submit("other", calls.append, 2)
+        dispatcher.close()
+        self.assertEqual(sorted(calls), [1, 2])
+        self.assertEqual(dispatcher.errors, 1)
+        self.assertIsInstance(dispatcher.last_error, RuntimeError)
+
+    def test_executor(self):
+        with ThreadPoolExecutor(4) as executor:
+            dispatcher = ChangeDispatcher(executor=executor)
+            callback = _Blocking()
+            dispatcher.submit("fan", callback, "fan", 0)
+            self.assertTrue(callback.started.wait(5))
+            dispatcher.submit("fan", callback, "fan", 1)
+            dispatcher.submit("fan", callback, "fan", 2)
+            callback.release.set()
+            # the second event is submitted to the executor by the first delivery
+            deadline = time.monotonic() + 5
+            while dispatcher.stats()["delivered"] < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(callback.calls, [("fan", 0), ("fan", 2)])
+        self.assertFalse(callback.overlapped)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+# Tests of the metrics registry: the labels of the packets and the series of removed devices.
+# Run from the repository root with: python -m unittest discover tests
+
+import unittest
+
+from VentoExpertSDK.command import Command
+from VentoExpertSDK.metrics import MetricsRegistry
+from VentoExpertSDK.responsepacket import ResponsePacket
+from benchmarks.bench_response import DEVICE_ID, STATUS_RESPONSE
+
+OTHER_ID = "FEDCBA9876543210"
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def test_packet_received_function(self):
+        metrics = MetricsRegistry()
+        metrics.packet_received(ResponsePacket.decode(STATUS_RESPONSE))
+        self.assertEqual(metrics.counter("vento_packets_received_total", function="response"), 1)
+        self.assertIn('vento_packets_received_total{function="response"} 1', metrics.prometheus())
+
+    def test_remove_device(self):
+        metrics = MetricsRegistry()
+        for device_id in (DEVICE_ID, OTHER_ID):
+            metrics.poll_sent(device_id)
+            metrics.poll_sent(device_id)
+            command = Command(device_id, [1], name="speed")
+            metrics.retransmitted(command)
+            metrics.command_done(command)
+            metrics.observe("vento_latency_seconds", 0.01, device=device_id, command="status")
+        metrics.duplicate_response()
+        metrics.remove_device(DEVICE_ID)
+        for name, samples in metrics.snapshot().items():
+            for sample in samples:
+                self.assertNotEqual(sample["labels"].get("device"), DEVICE_ID, name)
+        self.assertEqual(metrics.counter("vento_polls_total", device=OTHER_ID), 2)
+        self.assertEqual(metrics.counter("vento_polls_lost_total", device=OTHER_ID), 1)
+        self.assertEqual(metrics.counter("vento_retransmissions_total", device=OTHER_ID, command="speed"), 1)
+        self.assertEqual(metrics.histogram("vento_latency_seconds", device=OTHER_ID, command="status")["count"], 1)
+        self.assertEqual(metrics.counter("vento_duplicate_responses_total"), 1)
+        # the polls of the device are no longer timed
+        metrics.poll_sent(DEVICE_ID)
+        self.assertEqual(metrics.counter("vento_polls_lost_total", device=DEVICE_ID), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+# Tests of the request packets: splitting reads and writes into packets, the high byte
+# of the parameter numbers, the encoding of the values and the settings of apply().
+# Run from the repository root with: python -m unittest discover tests
+
+import unittest
+
+from VentoExpertSDK import ventoProtocol as protocol
+from VentoExpertSDK.device import Device
+from VentoExpertSDK.mode import Mode
+from VentoExpertSDK.simulator import parse_request
+from VentoExpertSDK.ventoPacket import VentoExpertPacket
+from benchmarks.bench_response import DEVICE_ID, PASSWORD
+
+# the parameters that can be read, without the special commands
+PARAMETERS = sorted(
+    parameter for parameter in protocol.PARAMETER_SIZE
+    if not protocol.SC_CHANGE_FUNCTION_NUMBER <= parameter <= protocol.SC_CHANGE_HIGH_BYTE
+)
+
+
+def parse(packet: VentoExpertPacket) -> list:
+    """Return the [(function, parameter, value bytes)] of a request packet"""
+    request = parse_request(bytes(packet.data))
+    return request[2]
+
+
+class VentoExpertPacketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device = Device(DEVICE_ID, PASSWORD, "127.0.0.1")
+
+    def test_read_split(self):
+        packets = VentoExpertPacket.read_packets(self.device, PARAMETERS * 2)
+        self.assertGreater(len(packets), 1)
+        read = []
+        for packet, group in packets:
+            self.assertLessEqual(len(packet.data), packet.maxsize)
+            requests = parse(packet)
+            self.assertEqual([(function, parameter) for function, parameter, _ in requests], [(protocol.READ, parameter) for parameter in group])
+            # the response has the values, it must fit too. A value that is not
+            # a single byte has the SC_CHANGE_VALUE_SIZE and its size before the parameter
+            sizes = [protocol.PARAMETER_SIZE[parameter] or 32 for parameter in group]
+            response = 8 + len(DEVICE_ID) + len(PASSWORD) + 2 * len({parameter >> 8 for parameter in group} - {0})
+            response += sum(1 + size + (2 if size != 1 else 0) for size in sizes)
+            self.assertLessEqual(response, packet.maxsize)
+            read += group
+        self.assertEqual(read, PARAMETERS)
+
+    def test_read_one_packet(self):
+        packets = VentoExpertPacket.read_packets(self.device, [protocol.SPEED, protocol.ON_OFF, protocol.SPEED])
+        self.assertEqual(len(packets), 1)
+        self.assertEqual(packets[0][1], [protocol.ON_OFF, protocol.SPEED])
+
+    def test_write_split(self):
+        values = {parameter: bytes(range(40)) for parameter in range(0x80, 0x88)}
+        values[protocol.SPEED] = 2
+        packets = VentoExpertPacket.write_packets(self.device, values)
+        self.assertGreater(len(packets), 1)
+        written = {}
+        for packet, group in packets:
+            self.assertLessEqual(len(packet.data), packet.maxsize)
+            for function, parameter, value in parse(packet):
+                self.assertEqual(function, protocol.WRITEREAD)
+                self.assertIn(parameter, group)
+                written[parameter] = value
+        self.assertEqual(written, {parameter: VentoExpertPacket.encode_value(parameter, value) for parameter, value in values.items()})
+
+    def test_high_byte(self):
+        values = {
+            protocol.SPEED: 3,
+            protocol.NIGHT_MODE_TIMER_SETPOINT: [30, 8],
+            protocol.PARTY_MODE_TIMER_SETPOINT: [0, 1],
+        }
+        (packet, group), = VentoExpertPacket.write_packets(self.device, values)
+        data = bytes(packet.data)
+        # the high byte is changed once, before the first 0x3xx parameter
+        self.assertEqual(data.count(bytes((protocol.SC_CHANGE_HIGH_BYTE, 0x03))), 1)
+        self.assertIn(bytes((protocol.SC_CHANGE_VALUE_SIZE, 2, protocol.NIGHT_MODE_TIMER_SETPOINT & 0xFF, 30, 8)), data)
+        self.assertEqual(parse(packet), [
+            (protocol.WRITEREAD, protocol.SPEED, b"\x03"),
+            (protocol.WRITEREAD, protocol.NIGHT_MODE_TIMER_SETPOINT, bytes((30, 8))),
+            (protocol.WRITEREAD, protocol.PARTY_MODE_TIMER_SETPOINT, bytes((0, 1))),
+        ])
+
+    def test_high_byte_after_split(self):
+        # the packets are filled up to the 0x3xx parameters, which start a new packet
+        values = {parameter: bytes(60) for parameter in (0x80, 0x81)}
+        values[protocol.NIGHT_MODE_TIMER_SETPOINT] = bytes(60)
+        values[protocol.PARTY_MODE_TIMER_SETPOINT] = [0, 1]
+        packets = VentoExpertPacket.write_packets(self.device, values)
+        self.assertEqual([group for _, group in packets], [[0x80, 0x81], [protocol.NIGHT_MODE_TIMER_SETPOINT, protocol.PARTY_MODE_TIMER_SETPOINT]])
+        # every packet starts with the high byte 0 so it is changed again
+        data = bytes(packets[1][0].data)
+        start = 4 + len(DEVICE_ID) + 1 + len(PASSWORD) + 1
+        self.assertEqual(data[start: start + 2], bytes((protocol.SC_CHANGE_HIGH_BYTE, 0x03)))
+        self.assertEqual([parameter for _, parameter, _ in parse(packets[1][0])], packets[1][1])
+
+    def test_encode_value(self):
+        self.assertEqual(VentoExpertPacket.encode_value(protocol.SPEED, 255), b"\xff")
+        self.assertEqual(VentoExpertPacket.encode_value(protocol.FAN1RPM, 1300), (1300).to_bytes(2, "little"))
+        self.assertEqual(VentoExpertPacket.encode_value(protocol.WIFI_PASSWORD, "secret"), b"secret")
+        self.assertEqual(VentoExpertPacket.encode_value(protocol.RTC_TIME, [5, 30, 12]), bytes((5, 30, 12)))
+        # an unknown parameter takes the size of the value
+        self.assertEqual(VentoExpertPacket.encode_value(0x2F0, 0x10000), (0x10000).to_bytes(3, "little"))
+
+    def test_value_does_not_fit(self):
+        for parameter, value in ((protocol.SPEED, 256), (protocol.FAN1RPM, 0x10000), (protocol.SPEED, -1)):
+            with self.assertRaises(ValueError):
+                VentoExpertPacket.encode_value(parameter, value)
+        with self.assertRaises(ValueError):
+            VentoExpertPacket.write_packets(self.device, {protocol.ON_OFF: 1, protocol.MANUAL_SPEED: 300})
+
+
+
+class SettingsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device = Device(DEVICE_ID, PASSWORD, "127.0.0.1")
+
+    def test_settings_values(self):
+        values = VentoExpertPacket.settings_values
+        self.assertEqual(values(self.device, speed=protocol.SPEED_HIGH), {protocol.SPEED: 3, protocol.ON_OFF: 1})
+        self.assertEqual(values(self.device, manualspeed=128),
+                         {protocol.MANUAL_SPEED: 128, protocol.SPEED: protocol.SPEED_MANUAL, protocol.ON_OFF: 1})
+        self.assertEqual(values(self.device, speed=protocol.SPEED_OFF), {protocol.ON_OFF: 0})
+        self.assertEqual(values(self.device, on=False, mode=Mode.TWOWAY),
+                         {protocol.ON_OFF: 0, protocol.VENTILATION_MODE: int(Mode.TWOWAY)})
+        self.assertEqual(values(self.device), {})
+
+    def test_invalid_settings(self):
+        for settings in (
+            {"speed": protocol.SPEED_OFF, "on": True},
+            {"speed": 4},
+            {"manualspeed": 256},
+            {"manualspeed": 10, "speed": protocol.SPEED_LOW},
+        ):
+            with self.assertRaises(ValueError, msg=settings):
+                VentoExpertPacket.settings_values(self.device, **settings)
+
+    def test_one_packet(self):
+        values = VentoExpertPacket.settings_values(self.device, speed=protocol.SPEED_MEDIUM, mode=Mode.IN)
+        packet = VentoExpertPacket()
+        packet.initialize_write_cmd(self.device, values, protocol.WRITEREAD, {protocol.RESET_FILTER_TIMER: 1})
+        # the filter reset is written after the settings with WRITE so the device does not answer it
+        self.assertEqual(parse(packet), [
+            (protocol.WRITEREAD, protocol.ON_OFF, b"\x01"),
+            (protocol.WRITEREAD, protocol.SPEED, b"\x02"),
+            (protocol.WRITEREAD, protocol.VENTILATION_MODE, bytes((int(Mode.IN),))),
+            (protocol.WRITE, protocol.RESET_FILTER_TIMER, b"\x01"),
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+# Tests of the response packet decoder against the original decoder and of the layout cache.
+# Run from the repository root with: python -m unittest discover tests
+
+import datetime
+import unittest
+
+from VentoExpertSDK import ventoProtocol as protocol
+from VentoExpertSDK.responsepacket import ResponsePacket
+from benchmarks.bench_response import DEVICE_ID, FIELDS, FIRMWARE_RESPONSE, PASSWORD, STATUS_RESPONSE, build_response, legacy_decode
+
+
+def status_response(speed: int, manualspeed: int, rpm: int, humidity: int, timer: tuple = (0x0A, 0x05, 0x5A)) -> bytes:
+    """The status response of STATUS_RESPONSE with other values"""
+    return build_response([
+        protocol.ON_OFF, 0x01,
+        protocol.VENTILATION_MODE, 0x01,
+        protocol.SPEED, speed,
+        protocol.MANUAL_SPEED, manualspeed,
+        protocol.SC_CHANGE_VALUE_SIZE, 0x02, protocol.FAN1RPM, rpm & 0xFF, rpm >> 8,
+        protocol.FILTER_ALARM, 0x00,
+        protocol.SC_CHANGE_VALUE_SIZE, 0x03, protocol.FILTER_TIMER, *timer,
+        protocol.CURRENT_HUMIDITY, humidity,
+    ])
+
+
+def with_device(data: bytes, device_id: str) -> bytes:
+    """The datagram from another device with the same password"""
+    id_end = 4 + data[3]
+    header = bytearray(data[:3])
+    header.append(len(device_id))
+    header += device_id.encode("ascii")
+    packet = header + data[id_end: -2]
+    checksum = sum(packet[2:]) & 0xFFFF
+    packet += bytes((checksum & 0xFF, checksum >> 8))
+    return bytes(packet)
+
+
+class ResponsePacketTest(unittest.TestCase):
+
+    def setUp(self):
+        ResponsePacket._layouts.clear()
+
+    def decode_uncached(self, data: bytes) -> ResponsePacket:
+        ResponsePacket._layouts.clear()
+        return ResponsePacket.decode(data)
+
+    def assert_cached(self, data: bytes):
+        """Decoding from the layout cache gives the same packet as without"""
+        uncached = self.decode_uncached(data)
+        self.assertIsNotNone(uncached)
+        self.assertEqual(len(ResponsePacket._layouts), 1)
+        cached = ResponsePacket.decode(data)
+        self.assertEqual(cached.values, uncached.values)
+        self.assertEqual((cached.device_id, cached.device_password, cached.unknown),
+                         (uncached.device_id, uncached.device_password, uncached.unknown))
+        # the cached values must not be shared between packets
+        self.assertIsNot(cached.values, ResponsePacket.decode(data).values)
+
+    def test_legacy_fields(self):
+        for data in (STATUS_RESPONSE, FIRMWARE_RESPONSE):
+            legacy = legacy_decode(data)
+            for packet in (self.decode_uncached(data), ResponsePacket.decode(data)):
+                for field in FIELDS:
+                    self.assertEqual(getattr(packet, field), getattr(legacy, field), field)
+
+    def test_legacy_fields_other_values(self):
+        ResponsePacket.decode(STATUS_RESPONSE)
+        for speed, manualspeed, rpm, humidity in ((1, 0, 0, 0), (3, 255, 0xFFFF, 100), (255, 17, 1300, 45)):
+            data = status_response(speed, manualspeed, rpm, humidity)
+            packet = ResponsePacket.decode(data)
+            legacy = legacy_decode(data)
+            for field in FIELDS:
+                self.assertEqual(getattr(packet, field), getattr(legacy, field), field)
+        self.assertEqual(len(ResponsePacket._layouts), 1)
+
+    def test_cached_status(self):
+        self.assert_cached(STATUS_RESPONSE)
+
+    def test_cached_firmware(self):
+        self.assert_cached(FIRMWARE_RESPONSE)
+        packet = ResponsePacket.decode(FIRMWARE_RESPONSE)
+        self.assertEqual(packet.values[protocol.READ_FIRMWARE_VERSION], (0, 69, 17, 10, 2021))
+        self.assertEqual(packet.values[protocol.UNIT_TYPE], 3)
+
+    def test_cached_not_supported(self):
+        data = build_response([
+            protocol.ON_OFF, 0x01,
+            protocol.SC_PARAMETER_NOT_SUPPORTED, protocol.MACHINE_HOURS,
+            protocol.SPEED, 0x02,
+        ])
+        self.assert_cached(data)
+        packet = ResponsePacket.decode(data)
+        self.assertIsNone(packet.values[protocol.MACHINE_HOURS])
+        self.assertEqual(packet.values[protocol.SPEED], 2)
+
+    def test_cached_value_size(self):
+        data = build_response([
+            protocol.SC_CHANGE_VALUE_SIZE, 0x03, protocol.RTC_TIME, 0x05, 0x1E, 0x0C,
+            protocol.SC_CHANGE_VALUE_SIZE, 0x04, protocol.CURRENT_IP_ADDRESS, 192, 168, 1, 20,
+            protocol.SC_CHANGE_VALUE_SIZE, 0x04, protocol.MACHINE_HOURS, 0x01, 0x02, 0x03, 0x00,
+            protocol.SC_CHANGE_VALUE_SIZE, 0x02, protocol.CURRENT_RTC_BATTERY_VOLTAGE, 0x88, 0x13,
+        ])
+        self.assert_cached(data)
+        values = ResponsePacket.decode(data).values
+        self.assertEqual(values[protocol.RTC_TIME], datetime.time(12, 30, 5))
+        self.assertEqual(values[protocol.CURRENT_IP_ADDRESS], "192.168.1.20")
+        self.assertEqual(values[protocol.MACHINE_HOURS], 1 + 2 * 60 + 3 * 1440)
+        self.assertEqual(values[protocol.CURRENT_RTC_BATTERY_VOLTAGE], 5000)
+
+    def test_cached_high_byte(self):
+        data = build_response([
+            protocol.ON_OFF, 0x01,
+            protocol.SC_CHANGE_HIGH_BYTE, 0x03,
+            protocol.SC_CHANGE_VALUE_SIZE, 0x02, protocol.NIGHT_MODE_TIMER_SETPOINT & 0xFF, 0x1E, 0x08,
+            protocol.HUMIDITY_SETPOINT_STATUS & 0xFF, 0x01,
+        ])
+        self.assert_cached(data)
+        values = ResponsePacket.decode(data).values
+        self.assertEqual(values[protocol.ON_OFF], 1)
+        self.assertEqual(values[protocol.NIGHT_MODE_TIMER_SETPOINT], 30 + 8 * 60)
+        self.assertEqual(values[protocol.HUMIDITY_SETPOINT_STATUS], 1)
+
+    def test_cached_other_values(self):
+        ResponsePacket.decode(STATUS_RESPONSE)
+        data = status_response(3, 200, 2048, 61)
+        packet = ResponsePacket.decode(data)
+        self.assertEqual(len(ResponsePacket._layouts), 1)
+        self.assertEqual(packet.values, self.decode_uncached(data).values)
+        self.assertEqual((packet.speed, packet.manualspeed, packet.humidity), (3, 200, 61))
+
+    def test_other_layout(self):
+        # the same parameters in another order are another layout for the same device
+        ResponsePacket.decode(STATUS_RESPONSE)
+        data = build_response([
+            protocol.ON_OFF, 0x01,
+            protocol.VENTILATION_MODE, 0x01,
+            protocol.MANUAL_SPEED, 0x80,
+            protocol.SPEED, 0x02,
+            protocol.SC_CHANGE_VALUE_SIZE, 0x02, protocol.FAN1RPM, 0x10, 0x05,
+            protocol.FILTER_ALARM, 0x00,
+            protocol.SC_CHANGE_VALUE_SIZE, 0x03, protocol.FILTER_TIMER, 0x0A, 0x05, 0x5A,
+            protocol.CURRENT_HUMIDITY, 0x2D,
+        ])
+        self.assertEqual(len(data), len(STATUS_RESPONSE))
+        packet = ResponsePacket.decode(data)
+        self.assertEqual(packet.values, self.decode_uncached(data).values)
+        self.assertEqual((packet.speed, packet.manualspeed), (2, 0x80))
+
+    def test_other_device(self):
+        ResponsePacket.decode(STATUS_RESPONSE)
+        data = with_device(STATUS_RESPONSE, "FEDCBA9876543210")
+        packet = ResponsePacket.decode(data)
+        self.assertEqual(packet.device_id, "FEDCBA9876543210")
+        self.assertEqual(len(ResponsePacket._layouts), 2)
+        self.assertEqual(packet.values, self.decode_uncached(STATUS_RESPONSE).values)
+
+    def test_cached_many_values(self):
+        # more values than the dict displays of the layouts
+        parameters = [parameter for parameter, (size, decoder) in sorted(ResponsePacket.decoders.items())
+                      if size == 1 and decoder is None and parameter < 0x100][:10]
+        body = []
+        for number, parameter in enumerate(parameters):
+            body += [parameter, number]
+        data = build_response(body)
+        self.assert_cached(data)
+        self.assertEqual(ResponsePacket.decode(data).values, {parameter: number for number, parameter in enumerate(parameters)})
+
+    def test_cached_converted_values(self):
+        ResponsePacket.decode(STATUS_RESPONSE)
+        for timer in ((0x0A, 0x05, 0x5A), (0x0B, 0x05, 0x5A), (0x0A, 0x05, 0x5A)):
+            data = status_response(2, 0x80, 1296, 45, timer)
+            self.assertEqual(ResponsePacket.decode(data).values[protocol.FILTER_TIMER], timer[0] + timer[1] * 60 + timer[2] * 1440)
+        self.assertEqual(len(ResponsePacket._layouts), 1)
+
+    def test_cached_not_bytes(self):
+        ResponsePacket.decode(STATUS_RESPONSE)
+        for data in (bytearray(STATUS_RESPONSE), memoryview(STATUS_RESPONSE)):
+            self.assertEqual(ResponsePacket.decode(data).values, ResponsePacket.decode(STATUS_RESPONSE).values)
+
+    def test_short(self):
+        ResponsePacket.decode(STATUS_RESPONSE)
+        for size in (0, 3, 4, 10, 25, len(STATUS_RESPONSE) - 1):
+            self.assertIsNone(ResponsePacket.decode(STATUS_RESPONSE[:size]), size)
+
+    def test_not_response(self):
+        # the same packet start with another function is not found in the layouts
+        ResponsePacket.decode(STATUS_RESPONSE)
+        data = bytearray(STATUS_RESPONSE)
+        data[4 + len(DEVICE_ID) + 1 + len(PASSWORD)] = protocol.READ
+        checksum = sum(data[2: -2]) & 0xFFFF
+        data[-2:] = bytes((checksum & 0xFF, checksum >> 8))
+        self.assertIsNone(ResponsePacket.decode(bytes(data)))
+        self.assertEqual(ResponsePacket.error(bytes(data)), "function")
+
+    def test_large_not_cached(self):
+        data = build_response([protocol.ON_OFF, 0x01] * 130)
+        self.assertGreater(len(data), 256)
+        self.assertEqual(ResponsePacket.decode(data).values, {protocol.ON_OFF: 1})
+        self.assertEqual(len(ResponsePacket._layouts), 0)
+
+    def test_invalid(self):
+        ResponsePacket.decode(STATUS_RESPONSE)
+        data = bytearray(STATUS_RESPONSE)
+        data[-1] ^= 0xFF
+        self.assertIsNone(ResponsePacket.decode(bytes(data)))
+        self.assertEqual(ResponsePacket.error(bytes(data)), "checksum")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+# Tests of the poll scheduler: the order of the polls, the jitter and the missed polls.
+# Run from the repository root with: python -m unittest discover tests
+
+import unittest
+
+from VentoExpertSDK.scheduler import PollScheduler
+
+
+class PollSchedulerTest(unittest.TestCase):
+
+    def test_first_deadlines_spread(self):
+        scheduler = PollScheduler(1.0, jitter=0)
+        for number in range(10):
+            scheduler.add(str(number), now=0)
+        deadlines = sorted(entry[0] for entry in scheduler._entries.values())
+        self.assertTrue(all(0 <= deadline < 1 for deadline in deadlines))
+        # no two polls closer than a fraction of the interval
+        self.assertGreater(min(current - previous for previous, current in zip(deadlines, deadlines[1:])), 0.05)
+
+    def test_order(self):
+        scheduler = PollScheduler(1.0, jitter=0)
+        for number in range(5):
+            scheduler.add(str(number), now=0)
+        polled = []
+        now = 0
+        while now < 3:
+            now = scheduler.next_deadline()
+            due = scheduler.pop_due(now)
+            self.assertEqual(len(due), 1)
+            polled.append((now, due[0]))
+        self.assertEqual(polled, sorted(polled))
+        # every device once per interval in the same order
+        order = [device_id for _, device_id in polled]
+        self.assertEqual(order[5:10], order[:5])
+        self.assertEqual(sorted(order[:5]), ["0", "1", "2", "3", "4"])
+
+    def test_interval_of_device(self):
+        scheduler = PollScheduler(1.0, jitter=0)
+        scheduler.add("fast", 0.25, now=0)
+        scheduler.add("slow", 2.0, now=0)
+        polls = {"fast": 0, "slow": 0}
+        for device_id in scheduler.pop_due(0):
+            polls[device_id] += 1
+        for step in range(1, 81):
+            for device_id in scheduler.pop_due(step * 0.05):
+                polls[device_id] += 1
+        self.assertEqual(polls, {"fast": 17, "slow": 2})
+        self.assertEqual(scheduler.interval_of("fast"), 0.25)
+        self.assertIsNone(scheduler.interval_of("other"))
+
+    def test_jitter_bounds(self):
+        scheduler = PollScheduler(2.0, jitter=0.05)
+        for number in range(200):
+            scheduler.add(str(number), now=0)
+        first = {device_id: entry[0] for device_id, entry in scheduler._entries.items()}
+        for deadline, token, device_id in scheduler._heap:
+            self.assertLessEqual(abs(deadline - first[device_id]), 0.05 * 2.0)
+        # the deadlines are jittered, not just offset
+        self.assertGreater(len({round(deadline - first[device_id], 9) for deadline, _, device_id in scheduler._heap}), 100)
+        # the jitter does not add up over the polls
+        for _ in range(1000):
+            scheduler.pop_due(scheduler.next_deadline())
+        for deadline, token, device_id in scheduler._heap:
+            nominal, interval, current = scheduler._entries[device_id]
+            if token == current:
+                self.assertAlmostEqual((nominal - first[device_id]) / interval % 1, 0, places=6)
+                self.assertLessEqual(abs(deadline - nominal), 0.05 * 2.0)
+
+    def test_missed_polls_skipped(self):
+        scheduler = PollScheduler(1.0, jitter=0)
+        scheduler.add("fan", now=0)
+        self.assertEqual(scheduler.pop_due(0), ["fan"])
+        # the client was blocked for several intervals
+        self.assertEqual(scheduler.pop_due(5.5), ["fan"])
+        self.assertEqual(scheduler.pop_due(5.9), [])
+        self.assertEqual(scheduler.next_deadline(), 6.0)
+
+    def test_remove_and_reschedule(self):
+        scheduler = PollScheduler(1.0, jitter=0)
+        scheduler.add("a", now=0)
+        scheduler.add("b", now=0)
+        scheduler.remove("a")
+        self.assertNotIn("a", scheduler)
+        self.assertEqual(len(scheduler), 1)
+        self.assertEqual(scheduler.pop_due(10), ["b"])
+        scheduler.add("b", 5.0, now=10)
+        # the old deadline of b is not polled
+        self.assertEqual(scheduler.pop_due(11), [])
+        self.assertEqual(scheduler.interval_of("b"), 5.0)
+        scheduler.remove("b")
+        self.assertIsNone(scheduler.next_deadline())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+# Tests of the request parser of the fan simulator.
+# Run from the repository root with: python -m unittest discover tests
+
+import unittest
+
+from VentoExpertSDK import ventoProtocol as protocol
+from VentoExpertSDK.simulator import parse_request
+
+
+def request(body: list) -> bytes:
+    """A request packet with the body after the protocol type and its checksum"""
+    packet = bytearray([0xFD, 0xFD, protocol.PROTOCOL_TYPE] + body)
+    checksum = sum(packet[2:]) & 0xFFFF
+    return bytes(packet + bytes((checksum & 0xFF, checksum >> 8)))
+
+
+class ParseRequestTest(unittest.TestCase):
+
+    def test_request(self):
+        data = request([1, 0x41, 1, 0x42, protocol.WRITEREAD, protocol.SPEED, 0x02,
+                        protocol.SC_CHANGE_VALUE_SIZE, 0x02, protocol.FAN1RPM, 0x10, 0x05])
+        self.assertEqual(parse_request(data), ("A", "B", [
+            (protocol.WRITEREAD, protocol.SPEED, b"\x02"),
+            (protocol.WRITEREAD, protocol.FAN1RPM, b"\x10\x05"),
+        ]))
+
+    def test_short(self):
+        data = request([1, 0x41, 1, 0x42, protocol.READ, protocol.SPEED])
+        for size in range(len(data)):
+            self.assertIsNone(parse_request(data[:size]), size)
+
+    def test_lengths_past_the_end(self):
+        # the device id and password lengths point past the end of the packet
+        self.assertIsNone(parse_request(request([200, 1, 2, 3, 4])))
+        self.assertIsNone(parse_request(request([2, 0x41, 0x42, 200, 1])))
+        # a value cut off by the checksum
+        self.assertIsNone(parse_request(request([1, 0x41, 1, 0x42, protocol.WRITE, protocol.SC_CHANGE_VALUE_SIZE, 0x04, protocol.SPEED, 0x01])))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,20 +1,358 @@
 ''' Backend for managing Blauber Vento fans on the local network
     I uses the VentoExpert SDK to communicate with the fans
-    It can search for fans on the network and display their data and will keep a persistent list of discovered fans
+    It searches for fans on the network in the background and keeps their data in memory
     It can also send commands to the fans to change their speed, mode, etc.
     It will be used by the VentoManagerFront.py to display the data and send commands to the fans'''
 
-from flask import Flask, jsonify, request
-from VentoExpertSDK.ventoClient import VentoClient, Device
+import json
+import logging
+import queue
+import threading
 import time
 
-app = Flask(__name__)
+from datetime import datetime
+
+from flask import Flask, Response, jsonify, request
+from VentoExpertSDK.ventoClient import VentoClient, Device, Mode
+from VentoExpertSDK import ventoProtocol as protocol
+
+DISCOVERY_INTERVAL = 60.0       # seconds between the searches for new fans
+REFRESH_INTERVAL = 1.0          # seconds between the refreshes of the snapshot
+OFFLINE_AFTER = 10.0            # seconds without an answer before a fan is offline
+EVENT_BUFFER = 100              # events buffered for a subscriber before it is dropped
+KEEPALIVE_INTERVAL = 15.0       # seconds between the keepalive comments of an idle event stream
+
+logger = logging.getLogger(__name__)
+
+# the tags given to the fans as device id -> list of tags
+fanTags = {}
+
+
+def fan_record(device: Device) -> dict:
+    """Return the data of a fan shown by the dashboard"""
+    return {
+        'device_id': device.device_id,
+        'ip_address': device.ip_address,
+        'online': device.last_seen is not None and time.time() - device.last_seen < OFFLINE_AFTER,
+        'speed': device.speed,
+        'manualspeed': device.manualspeed,
+        'mode': None if device.mode is None else Mode(device.mode).name,
+        'fan1rpm': device.fan1rpm,
+        'fan2rpm': device.fan2rpm,
+        'humidity': device.humidity,
+        'filter_alarm': device.filter_alarm,
+        'filter_timer': device.filter_timer,
+        'firmware_version': device.firmware_version,
+        'firmware_date': device.firmware_date,
+        'unit_type': device.unit_type,
+        'tags': fanTags.get(device.device_id, []),
+    }
+
+
+class EventStream:
+    """Fans out server-sent events to the subscribers of /events.
+    An event is serialized once by the publisher and the same bytes are put
+    in the buffer of every subscriber. A subscriber that does not keep up
+    is dropped when its buffer is full, the browser reconnects by itself
+    and starts over with a snapshot"""
+
+    def __init__(self, buffer: int = EVENT_BUFFER):
+        self._buffer = buffer
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self) -> queue.Queue:
+        """Return the buffer of a new subscriber. None in the buffer means
+        the subscriber was dropped"""
+        # one more place for the None of a dropped subscriber
+        subscriber = queue.Queue(self._buffer + 1)
+        with self._lock:
+            self._subscribers = self._subscribers + [subscriber]
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        with self._lock:
+            self._subscribers = [item for item in self._subscribers if item is not subscriber]
+
+    def publish(self, event: bytes):
+        """Put the event in the buffer of every subscriber. Called by one thread at a time"""
+        for subscriber in self._subscribers:
+            if subscriber.qsize() < self._buffer:
+                subscriber.put_nowait(event)
+            else:
+                self.unsubscribe(subscriber)
+                subscriber.put_nowait(None)
+
+    @staticmethod
+    def event(name: str, data: bytes, event_id: str = None) -> bytes:
+        """Return a server-sent event"""
+        head = f'event: {name}\n' + (f'id: {event_id}\n' if event_id is not None else '')
+        return head.encode() + b'data: ' + data + b'\n\n'
+
+
+class FleetSnapshot:
+    """The data of the fans as JSON documents ready to be sent.
+    A document and its ETag are only built when the data of a fan changes so
+    the requests of the dashboard are served without touching the devices.
+    The ETags start with the start time of the backend so they never repeat
+    after a restart.
+    The changed fields of a fan are published as a "fan" event to the events"""
+
+    def __init__(self, events: EventStream = None):
+        self._events = events
+        self._lock = threading.Lock()
+        self._prefix = format(int(time.time()), 'x')
+        self._version = 0
+        self._fans = {}         # device id -> (record, etag, body)
+        self._listing = None    # (etag, body) of all the fans. None when it must be rebuilt
+
+    def __contains__(self, device_id):
+        return device_id in self._fans
+
+    def update(self, device: Device) -> bool:
+        """Update the data of a fan. Returns True if it changed"""
+        record = fan_record(device)
+        with self._lock:
+            current = self._fans.get(device.device_id)
+            if current is not None and current[0] == record:
+                return False
+            self._version += 1
+            etag = f'{self._prefix}-{self._version}'
+            self._fans[device.device_id] = (record, etag, json.dumps(record).encode())
+            self._listing = None
+            if self._events is not None and len(self._events):
+                delta = record if current is None else {key: value for key, value in record.items() if current[0].get(key) != value}
+                delta['device_id'] = device.device_id
+                self._events.publish(EventStream.event('fan', json.dumps(delta).encode(), etag))
+        return True
+
+    def device_ids(self) -> list:
+        """Return the ids of the fans"""
+        return list(self._fans)
+
+    def fan(self, device_id: str) -> tuple:
+        """Return (etag, body) of a fan. None if the fan is not known"""
+        current = self._fans.get(device_id)
+        return None if current is None else current[1:]
+
+    def fans(self) -> tuple:
+        """Return (etag, body) of the list of all fans"""
+        listing = self._listing
+        if listing is None:
+            with self._lock:
+                if self._listing is None:
+                    bodies = [self._fans[device_id][2] for device_id in sorted(self._fans)]
+                    self._listing = (f'{self._prefix}-{self._version}', b'[' + b','.join(bodies) + b']')
+                listing = self._listing
+        return listing
 
-# In-memory storage for fans
-listOfFans = []
 
-# Initialize VentoClient
+class FleetMonitor:
+    """Searches for fans in the background and adds them to the client so
+    their status is polled. The snapshot is updated by the change events of
+    the fans and refreshed every REFRESH_INTERVAL for the values that do not
+    trigger a change event, e.g. the fan rpm"""
+
+    def __init__(self, client: VentoClient, snapshot: FleetSnapshot):
+        self._client = client
+        self._snapshot = snapshot
+        self._device_ids = []
+        self._running = True
+        self._scan = threading.Event()
+        self._thread = threading.Thread(target=self.__monitor_fn, daemon=True)
+        self._thread.start()
+
+    def scan(self):
+        """Search for fans now"""
+        self._scan.set()
+
+    def close(self):
+        self._running = False
+        self._scan.set()
+        self._thread.join()
+
+    def __monitor_fn(self):
+        next_discovery = time.monotonic()
+        # an error is logged and the thread goes on, a dead thread would leave the snapshot stale
+        while self._running:
+            if self._scan.is_set() or time.monotonic() >= next_discovery:
+                self._scan.clear()
+                try:
+                    self.__discover()
+                except Exception:
+                    logger.exception('Search for fans failed')
+                next_discovery = time.monotonic() + DISCOVERY_INTERVAL
+            for device_id in list(self._device_ids):
+                device = self._client.get_device(device_id)
+                if device is None:
+                    continue
+                try:
+                    self._snapshot.update(device)
+                except Exception:
+                    logger.exception('Refresh of fan %s failed', device_id)
+            self._scan.wait(REFRESH_INTERVAL)
+
+    def __discover(self):
+        for device_id, ip_address in self._client.discover_iter(timeout=1.0):
+            if device_id not in self._snapshot:
+                device = self._client.add_device(device_id, ip_address=ip_address, onchange=self._snapshot.update)
+                self._device_ids.append(device_id)
+                self._snapshot.update(device)
+
+
+app = Flask(__name__)
+
+# Initialize VentoClient and the background search of the fans
 fanClient = VentoClient()
+events = EventStream()
+fleet = FleetSnapshot(events)
+monitor = FleetMonitor(fanClient, fleet)
+
+
+def cached_response(document: tuple) -> Response:
+    """Return the JSON document, or 304 if the client already has it"""
+    etag, body = document
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+
+def command_result(device: Device, command) -> tuple:
+    """Wait for the confirmation of a command.
+    Returns the result and the HTTP status for the fan"""
+    if command is None:
+        # the fan does not confirm the command, the result is seen by the next status poll
+        return {'status': 'accepted'}, 202
+    try:
+        command.result()
+    except TimeoutError:
+        return {'error': 'Fan did not respond'}, 504
+    fleet.update(device)
+    return {'status': 'success', 'fan': fan_record(device)}, 200
+
+
+def clock_values(clock: datetime) -> dict:
+    """Return the values of the real time clock parameters for a time"""
+    return {
+        protocol.RTC_TIME: bytes((clock.second, clock.minute, clock.hour)),
+        protocol.RTC_CALENDAR: bytes((clock.day, clock.isoweekday(), clock.month, clock.year % 100)),
+    }
+
+
+# The command functions send a command to a fan with the arguments from the
+# request body and return the command without waiting for the confirmation.
+# None is returned for a command the fan does not confirm.
+# A ValueError is raised for missing or wrong arguments before anything is sent
+
+
+def speed_command(device: Device, body: dict):
+    speed = body.get('speed')
+    if speed not in (protocol.SPEED_OFF, protocol.SPEED_LOW, protocol.SPEED_MEDIUM, protocol.SPEED_HIGH, protocol.SPEED_MANUAL):
+        raise ValueError('Speed not provided')
+    if speed != protocol.SPEED_OFF and device.speed in (None, protocol.SPEED_OFF):
+        # turn on and set the speed in one packet instead of waiting for the turn on.
+        # A fan not polled yet may be off too
+        return fanClient.apply(device, speed=speed)
+    return fanClient.set_speed(device, speed)
+
+
+def manual_speed_command(device: Device, body: dict):
+    manualspeed = body.get('manualspeed')
+    if not isinstance(manualspeed, int) or not 0 <= manualspeed <= 255:
+        raise ValueError('Manual speed not provided')
+    if device.speed != protocol.SPEED_MANUAL:
+        # switch to manual speed in the same packet instead of waiting for the switch
+        return fanClient.apply(device, manualspeed=manualspeed)
+    return fanClient.set_manual_speed(device, manualspeed)
+
+
+def mode_command(device: Device, body: dict):
+    mode = body.get('mode')
+    if mode not in Mode.__members__:
+        raise ValueError('Mode must be one of ' + ', '.join(Mode.__members__))
+    return fanClient.set_mode(device, Mode[mode])
+
+
+def clock_command(device: Device, body: dict):
+    clock_time = body.get('clock_time')
+    if clock_time is None:
+        raise ValueError('Clock time not provided')
+    try:
+        clock = datetime.fromisoformat(clock_time)
+    except (TypeError, ValueError):
+        raise ValueError('Clock time must be an ISO 8601 time') from None
+    return fanClient.write(device, clock_values(clock))
+
+
+def filter_command(device: Device, body: dict):
+    fanClient.reset_filter_alarm(device)
+    return None
+
+
+def apply_command(device: Device, body: dict):
+    """Apply any of on, speed, manualspeed and mode and the filter reset in one packet"""
+    on = body.get('on')
+    if on is not None and not isinstance(on, bool):
+        raise ValueError('On must be true or false')
+    mode = body.get('mode')
+    if mode is not None and mode not in Mode.__members__:
+        raise ValueError('Mode must be one of ' + ', '.join(Mode.__members__))
+    return fanClient.apply(device, on, body.get('speed'), body.get('manualspeed'), Mode[mode] if mode is not None else None, bool(body.get('reset_filter')))
+
+
+# the commands of a fan as name -> (the fields of the request body, command function)
+COMMANDS = {
+    'speed': (['speed'], speed_command),
+    'manualspeed': (['manualspeed'], manual_speed_command),
+    'on': ([], lambda device, body: fanClient.turn_on(device)),
+    'off': ([], lambda device, body: fanClient.turn_off(device)),
+    'mode': (['mode'], mode_command),
+    'clock': (['clock_time'], clock_command),
+    'filter': ([], filter_command),
+    'apply': (['on', 'speed', 'manualspeed', 'mode', 'reset_filter'], apply_command),
+}
+
+
+def run_command(name: str, device_id: str):
+    """Run a command on a fan and wait for the confirmation"""
+    device = fanClient.get_device(device_id)
+    if device is None:
+        return jsonify({'error': 'Fan not found'}), 404
+    try:
+        command = COMMANDS[name][1](device, request.get_json(silent=True) or {})
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+    result, status = command_result(device, command)
+    return jsonify(result), status
+
+
+def select_devices(body: dict) -> tuple:
+    """Return the devices selected by a bulk command and the ids of the
+    devices that are not known.
+    The devices are a list of device ids or a selector: "all",
+    {"unit_type": <unit type>} or {"tag": <tag>}"""
+    device_ids = body.get('devices')
+    if device_ids is not None:
+        if not isinstance(device_ids, list):
+            raise ValueError('Devices must be a list of device ids')
+        devices = [fanClient.get_device(device_id) for device_id in device_ids]
+        return [device for device in devices if device is not None], [device_id for device_id, device in zip(device_ids, devices) if device is None]
+    selector = body.get('select')
+    devices = [fanClient.get_device(device_id) for device_id in fleet.device_ids()]
+    devices = [device for device in devices if device is not None]
+    if selector == 'all':
+        return devices, []
+    if isinstance(selector, dict) and 'unit_type' in selector:
+        return [device for device in devices if device.unit_type == selector['unit_type']], []
+    if isinstance(selector, dict) and 'tag' in selector:
+        return [device for device in devices if selector['tag'] in fanTags.get(device.device_id, [])], []
+    raise ValueError('Give the devices as a list of device ids or select "all", {"unit_type": ...} or {"tag": ...}')
 
 
 @app.route('/test', methods=['GET'])
@@ -24,78 +362,144 @@ def test():
 
 @app.route('/scan', methods=['GET'])
 def scan_fans():
-    def newdevice_callback(deviceid: str, ip_addr: str):
-        duplicateDevice = False
-        dataPair = (deviceid, ip_addr)
-        if not listOfFans:
-            listOfFans.append(dataPair)
-        else:
-            for i in range(0, len(listOfFans)):
-                # deviceToCompare = deviceAdressList[i]
-                if listOfFans[i][0] == deviceid:
-                    duplicateDevice = True
-                    print("Duplicate found ", i, deviceid)
-                    continue
-            if not duplicateDevice:
-                listOfFans.append(dataPair)
-
-    print("Discovering devices on the network")
-    fanClient.search_devices(newdevice_callback)
-    time.sleep(4)  # Give fans time to respond to the search command
-    return jsonify(listOfFans)
+    # the search runs in the background, the fans found are added to /fans
+    monitor.scan()
+    return Response(fleet.fans()[1], status=202, mimetype='application/json')
 
 
 @app.route('/fans', methods=['GET'])
 def get_fans():
-    if listOfFans == {}:
+    return cached_response(fleet.fans())
+
+
+@app.route('/fans/<device_id>', methods=['GET'])
+def get_fan(device_id):
+    document = fleet.fan(device_id)
+    if document is None:
         return jsonify({'error': 'Fan not found'}), 404
-    return jsonify(listOfFans)
+    return cached_response(document)
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Prometheus text exposition format of the metrics of the client
+    return Response(fanClient.metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/events', methods=['GET'])
+def get_events():
+    """A "fans" event with all the fans followed by a "fan" event with the
+    changed fields every time a fan changes"""
+    subscriber = events.subscribe()
+
+    def stream():
+        try:
+            # subscribed before the snapshot is taken so no change is missed
+            etag, body = fleet.fans()
+            yield EventStream.event('fans', body, etag)
+            while True:
+                try:
+                    event = subscriber.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    yield b': keepalive\n\n'
+                    continue
+                if event is None:
+                    # too slow, dropped by the event stream
+                    return
+                yield event
+        finally:
+            events.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/fans/commands', methods=['POST'])
+def run_fleet_command():
+    """Run a command on many fans. The body is the command, the devices and
+    the arguments of the command, e.g.
+    {"command": "speed", "select": "all", "speed": 1}
+    The commands are sent to all the fans before waiting for the
+    confirmations so it takes about one round trip"""
+    body = request.get_json(silent=True) or {}
+    name = body.get('command')
+    if name not in COMMANDS:
+        return jsonify({'error': 'Command must be one of ' + ', '.join(COMMANDS)}), 400
+    try:
+        devices, missing = select_devices(body)
+        # the arguments are the same for all the fans so a ValueError comes before anything is sent.
+        # The command functions do not wait, so all the commands are in flight before the first wait
+        commands = [(device, COMMANDS[name][1](device, body)) for device in devices]
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+    results = {device_id: {'error': 'Fan not found'} for device_id in missing}
+    # the waits overlap as every command is already sent, so this takes about the slowest round trip
+    for device, command in commands:
+        results[device.device_id] = command_result(device, command)[0]
+    return jsonify({'results': results})
 
 
 @app.route('/fans/<device_id>/commands', methods=['GET'])
 def get_fan_commands(device_id):
-    if device_id not in listOfFans:
+    if device_id not in fleet:
         return jsonify({'error': 'Fan not found'}), 404
+    return jsonify({name: fields for name, (fields, _) in COMMANDS.items()})
 
-    # Assuming the SDK provides a method to get available commands
-    commands = fanClient.get_device_commands(device_id)
-    return jsonify(commands)
+
+@app.route('/fans/<device_id>/tags', methods=['PUT'])
+def set_fan_tags(device_id):
+    device = fanClient.get_device(device_id)
+    if device is None:
+        return jsonify({'error': 'Fan not found'}), 404
+
+    tags = (request.get_json(silent=True) or {}).get('tags')
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        return jsonify({'error': 'Tags must be a list of strings'}), 400
+
+    fanTags[device_id] = sorted(set(tags))
+    fleet.update(device)
+    return jsonify({'status': 'success', 'fan': fan_record(device)})
 
 
 @app.route('/fans/<device_id>/speed', methods=['POST'])
 def set_fan_speed(device_id):
-    if device_id not in listOfFans:
-        return jsonify({'error': 'Fan not found'}), 404
+    return run_command('speed', device_id)
 
-    speed = request.json.get('speed')
-    if speed is None:
-        return jsonify({'error': 'Speed not provided'}), 400
 
-    fanClient.set_device_speed(device_id, speed)
-    return jsonify({'status': 'success'})
+@app.route('/fans/<device_id>/manualspeed', methods=['POST'])
+def set_fan_manual_speed(device_id):
+    return run_command('manualspeed', device_id)
 
 
-@app.route('/fans/<device_id>/clock', methods=['POST'])
-def set_real_time_clock(device_id):
-    if device_id not in listOfFans:
-        return jsonify({'error': 'Fan not found'}), 404
+@app.route('/fans/<device_id>/on', methods=['POST'])
+def turn_fan_on(device_id):
+    return run_command('on', device_id)
 
-    clock_time = request.json.get('clock_time')
-    if clock_time is None:
-        return jsonify({'error': 'Clock time not provided'}), 400
 
-    fanClient.set_device_clock(device_id, clock_time)
-    return jsonify({'status': 'success'})
+@app.route('/fans/<device_id>/off', methods=['POST'])
+def turn_fan_off(device_id):
+    return run_command('off', device_id)
+
+
+@app.route('/fans/<device_id>/mode', methods=['POST'])
+def set_fan_mode(device_id):
+    return run_command('mode', device_id)
+
+
+@app.route('/fans/<device_id>/clock', methods=['POST'])
+def set_real_time_clock(device_id):
+    return run_command('clock', device_id)
 
 
 @app.route('/fans/<device_id>/filter', methods=['POST'])
 def reset_filter_timer(device_id):
-    if device_id not in listOfFans:
-        return jsonify({'error': 'Fan not found'}), 404
+    return run_command('filter', device_id)
+
 
-    fanClient.reset_device_filter_timer(device_id)
-    return jsonify({'status': 'success'})
+@app.route('/fans/<device_id>/apply', methods=['POST'])
+def apply_settings(device_id):
+    return run_command('apply', device_id)
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # the reloader would start a second client and search in the reloader process
+    app.run(debug=True, use_reloader=False)